@@ -6,13 +6,14 @@ import warnings
 from tempfile import mkdtemp
 from shutil import rmtree
 
+import numpy as np
 from six import string_types
 
 import oddt
 from oddt.utils import (is_openbabel_molecule,
                         is_molecule,
                         check_molecule)
-from oddt.spatial import rmsd
+from oddt.spatial import rmsd_batch
 
 
 class autodock_vina(object):
@@ -283,6 +284,7 @@ class autodock_vina(object):
                         del ligand.data['REMARK']
 
             docked_ligands = oddt.toolkit.readfile('pdbqt', ligand_outfile)
+            poses = []
             for docked_ligand, score in zip(docked_ligands, scores):
                 # Renumber atoms to match the input ligand
                 if (is_openbabel_molecule(docked_ligand) and
@@ -293,15 +295,22 @@ class autodock_vina(object):
                 clone = ligand.clone
                 clone.clone_coords(docked_ligand)
                 clone.data.update(score)
+                poses.append(clone)
 
-                # Calculate RMSD to the input pose
+            # Calculate RMSD to the input pose, all poses share the topology
+            # of the input ligand
+            if poses:
+                coords = np.array([pose.coords for pose in poses])
                 try:
-                    clone.data['vina_rmsd_input'] = rmsd(ligand, clone)
-                    clone.data['vina_rmsd_input_min'] = rmsd(ligand, clone,
-                                                             method='min_symmetry')
+                    for pose, value in zip(poses, rmsd_batch(ligand, ligand,
+                                                             coords)):
+                        pose.data['vina_rmsd_input'] = value
+                    for pose, value in zip(poses, rmsd_batch(
+                            ligand, ligand, coords, method='min_symmetry')):
+                        pose.data['vina_rmsd_input_min'] = value
                 except Exception:
                     pass
-                output_array.append(clone)
+            output_array.extend(poses)
         rmtree(ligand_dir)
         return output_array
 
@@ -1,7 +1,8 @@
 """ ODDT's internal docking/scoring engines """
 import numpy as np
 import math
-from oddt.spatial import distance, dihedral, rotate
+from oddt.spatial import (distance, dihedral, rotate, rotation_matrix,
+                          axis_angle_matrix, transform)
 
 
 def get_children(molecule, mother, restricted):
@@ -52,6 +53,16 @@ def change_dihedral(coords, a1, a2, a3, a4, target_angle, rot_mask):
     return coords + centroid
 
 
+def change_dihedral_batch(coords, a1, a2, a3, a4, target_angles, rot_mask):
+    """Vectorized `change_dihedral` for many poses at once, coords are of
+    shape [n_poses, n_atoms, 3] and target_angles of shape [n_poses]."""
+    coords = coords.copy()
+    rot_matrix = axis_angle_matrix(coords[:, a2] - coords[:, a3], target_angles)
+    coords[:, rot_mask] = transform(coords[:, rot_mask], rot_matrix,
+                                    center=coords[:, a3])
+    return coords
+
+
 def num_rotors_pdbqt(lig):
     i = 0
     for atom in lig.atoms:
@@ -294,6 +305,32 @@ class vina_ligand(object):
         self.x1 = x.copy()
         return c
 
+    def mutate_batch(self, x):
+        """Full mutation of many poses at once (i.e. whole population of
+        a search algorithm). Rigid-body and torsion updates are applied to
+        all poses in vectorized manner.
+
+        Parameters
+        ----------
+        x : numpy array, shape = [n_poses, 6 + num_rotors]
+            Translations, rotations and torsions of poses.
+
+        Returns
+        -------
+        coords : numpy array, shape = [n_poses, n_atoms, 3]
+            Coordinates of poses, as returned by `mutate(x, force=True)`
+            for each of them.
+        """
+        x = np.atleast_2d(x)
+        c = transform(self.c0,
+                      rotation_matrix(x[:, 3], x[:, 4], x[:, 5]),
+                      x[:, :3] * self.box_size)
+        for i, rotor in enumerate(self.engine.rotors):
+            a = rotor['atoms']
+            c = change_dihedral_batch(c, a[0], a[1], a[2], a[3], x[:, 6 + i],
+                                      rotor['mask'])
+        return c
+
     def _inc_mutate(self, x, c):
         c = c.copy()
         trans_vec = x[:3]
@@ -4,19 +4,17 @@
 
 """
 from __future__ import division
-from six.moves import zip_longest
+import sys
 from itertools import chain
 from collections import OrderedDict
 import numpy as np
-from scipy.sparse import csr_matrix, isspmatrix_csr
+from scipy.sparse import csr_matrix, isspmatrix_csr, issparse
 import oddt
 from oddt.utils import is_openbabel_molecule
-from oddt.interactions import (pi_stacking,
-                               hbond_acceptor_donor,
-                               salt_bridge_plus_minus,
-                               hydrophobic_contacts,
-                               acceptor_metal,
+from oddt.interactions import (ReceptorIndex,
+                               interaction_profile,
                                close_contacts)
+from oddt.interactions import _atoms
 
 
 __all__ = ['InteractionFingerprint',
@@ -29,6 +27,46 @@ __all__ = ['InteractionFingerprint',
            'tanimoto']
 
 
+def _protein_resids(protein):
+    """Sorted unique residue indices of protein, cached for ReceptorIndex"""
+    if isinstance(protein, ReceptorIndex):
+        if 'resids' not in protein.cache:
+            protein.cache['resids'] = np.unique(protein.atom_dict['resid'])
+        return protein.cache['resids']
+    return np.unique(protein.atom_dict['resid'])
+
+
+def _heavy_atom_reprs(mol):
+    """ECFP representations of all heavy atoms in a molecule (see
+    `_ECFP_atom_reprs`). Cached for ReceptorIndex."""
+    if isinstance(mol, ReceptorIndex):
+        if 'ECFP_heavy_atom_reprs' not in mol.cache:
+            mol.cache['ECFP_heavy_atom_reprs'] = _heavy_atom_reprs(mol.mol)
+        return mol.cache['ECFP_heavy_atom_reprs']
+    mol.atom_dict  # representations are read from atom_dict
+    return _ECFP_atom_reprs(mol)
+
+
+def _protein_environments(protein, atoms, depth, atom_reprs):
+    """ECFP environment hashes of protein atoms (see `_ECFP_environments`).
+    For ReceptorIndex they are computed once per atom and stored in a table
+    shared by all ligands. Hashes for a lower depth are a prefix of the ones
+    for a higher depth, so a single, deepest entry is kept per atom."""
+    if isinstance(protein, ReceptorIndex):
+        table = protein.cache.setdefault('ECFP_atom_hashes', {})
+        missing = [aidx for aidx in set(atoms)
+                   if aidx not in table or len(table[aidx]) <= depth]
+        if missing:
+            for aidx, hashes in zip(missing, _ECFP_environments(
+                    protein.mol, missing, depth=depth,
+                    atom_reprs=atom_reprs).tolist()):
+                table[aidx] = hashes
+        return np.array([table[aidx][:depth + 1] for aidx in atoms],
+                        dtype=np.int64).reshape(len(atoms), depth + 1)
+    return _ECFP_environments(protein, atoms, depth=depth,
+                              atom_reprs=atom_reprs)
+
+
 def InteractionFingerprint(ligand, protein, strict=True):
     """Interaction fingerprint accomplished by converting the molecular
     interaction of ligand-protein into bit array according to
@@ -48,7 +86,8 @@ def InteractionFingerprint(ligand, protein, strict=True):
     Parameters
     ----------
     ligand, protein : oddt.toolkit.Molecule object
-        Molecules, which are analysed in order to find interactions.
+        Molecules, which are analysed in order to find interactions. Protein
+        can be also given as `oddt.interactions.ReceptorIndex`.
 
     strict : bool (deafult = True)
         If False, do not include condition, which informs whether atoms
@@ -60,49 +99,56 @@ def InteractionFingerprint(ligand, protein, strict=True):
         Vector of calculated IFP (size = no residues * 8 type of interaction)
 
     """
-    resids = np.unique(protein.atom_dict['resid'])
+    profile = interaction_profile(ligand, protein)
+    resids = _protein_resids(protein)
     IFP = np.zeros((len(resids), 8), dtype=np.uint8)
 
     # hydrophobic contacts (column = 0)
-    hydrophobic = hydrophobic_contacts(protein, ligand)[0]['resid']
-    np.add.at(IFP, [np.searchsorted(resids, np.sort(hydrophobic)[::-1]), 0], 1)
+    hydrophobic = profile.hydrophobic_contacts(
+        protein, ligand, return_index=True)[0]['resid']
+    np.add.at(IFP, (np.searchsorted(resids, np.sort(hydrophobic)[::-1]), 0), 1)
 
     # aromatic face to face (Column = 1), aromatic edge to face (Column = 2)
-    rings, _, strict_parallel, strict_perpendicular = pi_stacking(
-        protein, ligand)
-    np.add.at(IFP, [np.searchsorted(
-        resids, np.sort(rings[strict_parallel]['resid'])[::-1]), 1], 1)
-    np.add.at(IFP, [np.searchsorted(
-        resids, np.sort(rings[strict_perpendicular]['resid'])[::-1]), 2], 1)
+    rings, _, strict_parallel, strict_perpendicular = profile.pi_stacking(
+        protein, ligand, return_index=True)
+    np.add.at(IFP, (np.searchsorted(
+        resids, np.sort(rings[strict_parallel]['resid'])[::-1]), 1), 1)
+    np.add.at(IFP, (np.searchsorted(
+        resids, np.sort(rings[strict_perpendicular]['resid'])[::-1]), 2), 1)
 
     # h-bonds, protein as a donor (Column = 3)
-    _, donors, strict0 = hbond_acceptor_donor(ligand, protein)
+    _, donors, strict0 = profile.hbond_acceptor_donor(ligand, protein,
+                                                      return_index=True)
     if strict is False:
         strict0 = None
-    np.add.at(IFP, [np.searchsorted(
-        resids, np.sort(donors[strict0]['resid'])[::-1]), 3], 1)
+    np.add.at(IFP, (np.searchsorted(
+        resids, np.sort(donors[strict0]['resid'])[::-1]), 3), 1)
 
     # h-bonds, protein as an acceptor (Column = 4)
-    acceptors, _, strict1 = hbond_acceptor_donor(protein, ligand)
+    acceptors, _, strict1 = profile.hbond_acceptor_donor(protein, ligand,
+                                                         return_index=True)
     if strict is False:
         strict1 = None
-    np.add.at(IFP, [np.searchsorted(
-        resids, np.sort(acceptors[strict1]['resid'])[::-1]), 4], 1)
+    np.add.at(IFP, (np.searchsorted(
+        resids, np.sort(acceptors[strict1]['resid'])[::-1]), 4), 1)
 
     # salt bridges, protein positively charged (Column = 5)
-    plus, _ = salt_bridge_plus_minus(protein, ligand)
-    np.add.at(IFP, [np.searchsorted(resids, np.sort(plus['resid'])[::-1]), 5], 1)
+    plus, _ = profile.salt_bridge_plus_minus(protein, ligand,
+                                             return_index=True)
+    np.add.at(IFP, (np.searchsorted(resids, np.sort(plus['resid'])[::-1]), 5), 1)
 
     # salt bridges, protein negatively charged (Colum = 6)
-    _, minus = salt_bridge_plus_minus(ligand, protein)
-    np.add.at(IFP, [np.searchsorted(resids, np.sort(minus['resid'])[::-1]), 6], 1)
+    _, minus = profile.salt_bridge_plus_minus(ligand, protein,
+                                              return_index=True)
+    np.add.at(IFP, (np.searchsorted(resids, np.sort(minus['resid'])[::-1]), 6), 1)
 
     # salt bridges, ionic bond with metal ion (Column = 7)
-    _, metal, strict2 = acceptor_metal(protein, ligand)
+    _, metal, strict2 = profile.acceptor_metal(protein, ligand,
+                                               return_index=True)
     if strict is False:
         strict2 = None
-    np.add.at(IFP, [np.searchsorted(
-        resids, np.sort(metal[strict2]['resid'])[::-1]), 7], 1)
+    np.add.at(IFP, (np.searchsorted(
+        resids, np.sort(metal[strict2]['resid'])[::-1]), 7), 1)
 
     return IFP.flatten()
 
@@ -130,7 +176,8 @@ def SimpleInteractionFingerprint(ligand, protein, strict=True):
     Parameters
     ----------
     ligand, protein : oddt.toolkit.Molecule object
-        Molecules, which are analysed in order to find interactions.
+        Molecules, which are analysed in order to find interactions. Protein
+        can be also given as `oddt.interactions.ReceptorIndex`.
 
     strict : bool (deafult = True)
         If False, do not include condition, which informs whether atoms
@@ -149,61 +196,62 @@ def SimpleInteractionFingerprint(ligand, protein, strict=True):
                            dtype='<U3')
 
     IFP = np.zeros((len(amino_acids), 8), dtype=np.uint8)
+    profile = interaction_profile(ligand, protein)
 
     # hydrophobic (Column = 0)
-    hydrophobic = hydrophobic_contacts(protein, ligand)[0]['resname']
+    hydrophobic = profile.hydrophobic_contacts(protein, ligand)[0]['resname']
     hydrophobic[~np.in1d(hydrophobic, amino_acids)] = ''
-    np.add.at(IFP, [np.searchsorted(amino_acids,
-                                    np.sort(hydrophobic)[::-1]), 0], 1)
+    np.add.at(IFP, (np.searchsorted(amino_acids,
+                                    np.sort(hydrophobic)[::-1]), 0), 1)
 
     # aromatic face to face (Column = 1), aromatic edge to face (Column = 2)
-    rings, _, strict_parallel, strict_perpendicular = pi_stacking(
+    rings, _, strict_parallel, strict_perpendicular = profile.pi_stacking(
         protein, ligand)
     rings[strict_parallel]['resname'][~np.in1d(
         rings[strict_parallel]['resname'], amino_acids)] = ''
-    np.add.at(IFP, [np.searchsorted(
-        amino_acids, np.sort(rings[strict_parallel]['resname'])[::-1]), 1], 1)
+    np.add.at(IFP, (np.searchsorted(
+        amino_acids, np.sort(rings[strict_parallel]['resname'])[::-1]), 1), 1)
     rings[strict_perpendicular]['resname'][~np.in1d(
         rings[strict_perpendicular]['resname'], amino_acids)] = ''
-    np.add.at(IFP, [np.searchsorted(
+    np.add.at(IFP, (np.searchsorted(
         amino_acids,
-        np.sort(rings[strict_perpendicular]['resname'])[::-1]), 2], 1)
+        np.sort(rings[strict_perpendicular]['resname'])[::-1]), 2), 1)
 
     # hbonds donated by the protein (Column = 3)
-    _, donors, strict0 = hbond_acceptor_donor(ligand, protein)
+    _, donors, strict0 = profile.hbond_acceptor_donor(ligand, protein)
     donors['resname'][~np.in1d(donors['resname'], amino_acids)] = ''
     if strict is False:
         strict0 = None
-    np.add.at(IFP, [np.searchsorted(
-        amino_acids, np.sort(donors[strict0]['resname'])[::-1]), 3], 1)
+    np.add.at(IFP, (np.searchsorted(
+        amino_acids, np.sort(donors[strict0]['resname'])[::-1]), 3), 1)
 
     # hbonds donated by the ligand (Column = 4)
-    acceptors, _, strict1 = hbond_acceptor_donor(protein, ligand)
+    acceptors, _, strict1 = profile.hbond_acceptor_donor(protein, ligand)
     acceptors['resname'][~np.in1d(acceptors['resname'], amino_acids)] = ''
     if strict is False:
         strict1 = None
-    np.add.at(IFP, [np.searchsorted(
-        amino_acids, np.sort(acceptors[strict1]['resname'])[::-1]), 4], 1)
+    np.add.at(IFP, (np.searchsorted(
+        amino_acids, np.sort(acceptors[strict1]['resname'])[::-1]), 4), 1)
 
     # ionic bond with protein cation(Column = 5)
-    plus, _ = salt_bridge_plus_minus(protein, ligand)
+    plus, _ = profile.salt_bridge_plus_minus(protein, ligand)
     plus['resname'][~np.in1d(plus['resname'], amino_acids)] = ''
-    np.add.at(IFP, [np.searchsorted(amino_acids,
-                                    np.sort(plus['resname'])[::-1]), 5], 1)
+    np.add.at(IFP, (np.searchsorted(amino_acids,
+                                    np.sort(plus['resname'])[::-1]), 5), 1)
 
     # ionic bond with protein anion(Column = 6)
-    _, minus = salt_bridge_plus_minus(ligand, protein)
+    _, minus = profile.salt_bridge_plus_minus(ligand, protein)
     minus['resname'][~np.in1d(minus['resname'], amino_acids)] = ''
-    np.add.at(IFP, [np.searchsorted(amino_acids,
-                                    np.sort(minus['resname'])[::-1]), 6], 1)
+    np.add.at(IFP, (np.searchsorted(amino_acids,
+                                    np.sort(minus['resname'])[::-1]), 6), 1)
 
     # ionic bond with metal ion (Column = 7)
-    _, metal, strict2 = acceptor_metal(protein, ligand)
+    _, metal, strict2 = profile.acceptor_metal(protein, ligand)
     metal['resname'][~np.in1d(metal['resname'], amino_acids)] = ''
     if strict is False:
         strict2 = None
-    np.add.at(IFP, [np.searchsorted(
-        amino_acids, np.sort(metal[strict2]['resname'])[::-1]), 7], 1)
+    np.add.at(IFP, (np.searchsorted(
+        amino_acids, np.sort(metal[strict2]['resname'])[::-1]), 7), 1)
 
     return IFP.flatten()
 
@@ -346,6 +394,91 @@ def hash32(value):
     return hash(value) & 0xffffffff
 
 
+# Constants of CPython's tuple hash (Objects/tupleobject.c) for 64-bit
+# builds. Python >= 3.8 uses a variant of xxHash, older ones a FNV-like hash.
+_XXPRIME_1 = np.uint64(11400714785074694791)
+_XXPRIME_2 = np.uint64(14029467366897019727)
+_XXPRIME_5 = np.uint64(2870177450012600261)
+_UINT64_MAX = np.uint64(2 ** 64 - 1)
+
+
+def _int_hash_lanes(values):
+    """Python's hashes of small integers (-1 hashes to -2) as uint64"""
+    values = np.asarray(values, dtype=np.int64)
+    return np.where(values == -1, -2, values).astype(np.int64).view(np.uint64)
+
+
+def _tuple_hash_lanes(lanes, offsets):
+    """Vectorized CPython's hash of tuples, which items' hashes (`lanes`,
+    uint64) are concatenated and delimited by `offsets` (CSR-like, one more
+    than the number of tuples). Returns hashes as uint64 (bit pattern of
+    Python's signed hash)."""
+    lanes = np.asarray(lanes, dtype=np.uint64)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    lengths = np.diff(offsets)
+    n = len(lengths)
+    if sys.version_info >= (3, 8):
+        acc = np.full(n, _XXPRIME_5, dtype=np.uint64)
+        for k in range(lengths.max() if n else 0):
+            # items present in all tuples need no gather and scatter
+            if k < lengths.min():
+                a = acc + lanes[offsets[:-1] + k] * _XXPRIME_2
+                a = (a << np.uint64(31)) | (a >> np.uint64(33))
+                acc = a * _XXPRIME_1
+                continue
+            rows = np.flatnonzero(lengths > k)
+            a = acc[rows] + lanes[offsets[rows] + k] * _XXPRIME_2
+            a = (a << np.uint64(31)) | (a >> np.uint64(33))
+            acc[rows] = a * _XXPRIME_1
+        acc += (lengths.astype(np.uint64) ^
+                (_XXPRIME_5 ^ np.uint64(3527539)))
+        acc[acc == _UINT64_MAX] = np.uint64(1546275796)
+    else:
+        acc = np.full(n, 0x345678, dtype=np.uint64)
+        mult = np.full(n, 1000003, dtype=np.uint64)
+        for k in range(lengths.max() if n else 0):
+            rows = np.flatnonzero(lengths > k)
+            acc[rows] = (acc[rows] ^ lanes[offsets[rows] + k]) * mult[rows]
+            # remaining length is decreased before each item
+            mult[rows] += (np.uint64(82520) +
+                           2 * (lengths[rows] - k - 1).astype(np.uint64))
+        acc += np.uint64(97531)
+        acc[acc == _UINT64_MAX] = _UINT64_MAX - np.uint64(1)
+    return acc
+
+
+def _hash32_rows(rows):
+    """`hash32` of each row of 2D integer array converted to a tuple"""
+    rows = np.asarray(rows, dtype=np.int64)
+    if not _VECTORIZED_HASH:
+        return np.array([hash32(tuple(row)) for row in rows.tolist()],
+                        dtype=np.int64).reshape(len(rows))
+    offsets = np.arange(len(rows) + 1) * rows.shape[1]
+    return (_tuple_hash_lanes(_int_hash_lanes(rows).ravel(), offsets) &
+            np.uint64(0xffffffff)).astype(np.int64)
+
+
+def _vectorized_hash_works():
+    """Vectorized hashes have to be identical to Python's `hash`, which is
+    not guaranteed on all platforms (i.e. 32-bit builds or PyPy). If they
+    are not, pure Python implementation is used."""
+    samples = [(6, 0, 3, 1, 0, 1, 1), (-1, 2, -2), (2 ** 32 - 1,), ()]
+    try:
+        lengths = [len(sample) for sample in samples]
+        inner = _tuple_hash_lanes(
+            _int_hash_lanes(list(chain(*samples))),
+            np.cumsum([0] + lengths))
+        outer = _tuple_hash_lanes(inner, [0, len(samples)])
+        return ([int(h) for h in inner] ==
+                [hash(sample) % 2 ** 64 for sample in samples] and
+                int(outer[0]) == hash(tuple(samples)) % 2 ** 64)
+    except Exception:
+        return False
+
+
+_VECTORIZED_HASH = _vectorized_hash_works()
+
+
 def _ECFP_atom_repr(mol, idx, use_pharm_features=False):
     """Simple description of atoms used in ECFP/FCFP. Bonds are not described
     accounted for. Hydrogens are explicitly forbidden, they raise Exception.
@@ -499,6 +632,281 @@ def _ECFP_atom_hash(mol, idx, depth=2, use_pharm_features=False,
     return out_hash
 
 
+def _complete_atom_dict(mol):
+    """Molecule's `atom_dict` if it is already computed and its neighbors
+    table holds all bonds, otherwise None"""
+    atom_dict = getattr(mol, '_atom_dict', None)
+    # neighbors_id is int16
+    if atom_dict is None or len(atom_dict) > np.iinfo(np.int16).max:
+        return None
+    num_bonds = (mol.OBMol.NumBonds() if is_openbabel_molecule(mol)
+                 else mol.Mol.GetNumBonds())
+    if (~np.isnan(atom_dict['neighbors'][:, :, 0])).sum() != 2 * num_bonds:
+        return None
+    return atom_dict
+
+
+def _ECFP_atom_reprs(mol, use_pharm_features=False):
+    """Representations of all heavy atoms of a molecule at once, identical
+    to `_ECFP_atom_repr` of each of them. Columns of an already computed
+    `atom_dict` are used, so only properties missing there are read atom by
+    atom.
+
+    Parameters
+    ----------
+    mol : oddt.toolkit.Molecule object
+        Input molecule for the FP calculations
+
+    use_pharm_features : bool (default=False)
+        Switch to use pharmacophoric features as atom representation instead of
+        explicit atomic numbers etc.
+
+    Returns
+    -------
+    atom_reprs : tuple of numpy arrays
+        Indices (0-based) of heavy atoms and their representations in rows,
+        shape=(n_heavy, 6 or 7).
+    """
+    if use_pharm_features:
+        atom_dict = mol.atom_dict
+        heavy = atom_dict[atom_dict['atomicnum'] != 1]
+        return (heavy['id'].astype(np.intp),
+                np.column_stack([heavy[field] for field in (
+                    'isdonor', 'isacceptor', 'ishydrophobe', 'isplus',
+                    'isminus', 'isaromatic')]).astype(np.int64))
+
+    atom_dict = _complete_atom_dict(mol)
+    if atom_dict is None:
+        if is_openbabel_molecule(mol):
+            atoms = oddt.toolkits.ob.ob.OBMolAtomIter(mol.OBMol)
+        else:
+            atoms = mol.Mol.GetAtoms()
+        heavy = [i for i, atom in enumerate(atoms) if atom.GetAtomicNum() != 1]
+        return (np.array(heavy, dtype=np.intp),
+                np.array([_ECFP_atom_repr(mol, aidx) for aidx in heavy],
+                         dtype=np.int64).reshape(len(heavy), 7))
+
+    max_ring_size = 10  # dont catch macromolecular rings
+    heavy = np.flatnonzero(atom_dict['atomicnum'] != 1)
+    nbr_mask = ~np.isnan(atom_dict['neighbors'][heavy, :, 0])
+    num_h_nbrs = (nbr_mask & (atom_dict['atomicnum'][
+        atom_dict['neighbors_id'][heavy]] == 1)).sum(axis=1)
+    if is_openbabel_molecule(mol):
+        ob_atoms = map(mol.OBMol.GetAtom, (heavy + 1).tolist())
+        props = np.array([(atom.GetIsotope(),
+                           atom.ImplicitHydrogenCount(),
+                           atom.GetFormalCharge(),
+                           atom.MemberOfRingSize())
+                          for atom in ob_atoms],
+                         dtype=np.int64).reshape(len(heavy), 4)
+        isotope, num_hs, charge, ringsize = props.T
+        isring = (ringsize > 0) & (ringsize <= max_ring_size)
+        # implicit and explicit hydrogens
+        num_hs = num_hs + num_h_nbrs
+    else:
+        # atoms are matched in bulk, getters are called only for the few
+        # atoms with unusual values
+        isotope = _rdkit_atom_values(
+            mol, '[!0*]', lambda atom: atom.GetIsotope())[heavy]
+        charge = _rdkit_atom_values(
+            mol, '[!+0]', lambda atom: atom.GetFormalCharge())[heavy]
+        # "H" SMARTS primitive counts implicit and explicit hydrogens
+        num_hs = _rdkit_atom_values(mol, '[!H0&!H1&!H2&!H3&!H4]',
+                                    lambda atom: atom.GetTotalNumHs(True))
+        for count in range(1, 5):
+            num_hs[_rdkit_matches(mol, '[H%i]' % count)] = count
+        num_hs = num_hs[heavy]
+        isring = np.zeros(len(atom_dict), dtype=bool)
+        isring[list(chain.from_iterable(
+            ring for ring in mol.Mol.GetRingInfo().AtomRings()
+            if len(ring) <= max_ring_size))] = True
+        isring = isring[heavy]
+    return heavy, np.column_stack((
+        atom_dict['atomicnum'][heavy],
+        isotope,
+        # heavy atoms' valence
+        nbr_mask.sum(axis=1) - num_h_nbrs,
+        num_hs,
+        charge,
+        isring,
+        atom_dict['isaromatic'][heavy])).astype(np.int64)
+
+
+def _rdkit_matches(mol, smarts):
+    """Indices of all atoms matching single atom SMARTS"""
+    matches = mol.Mol.GetSubstructMatches(
+        oddt.toolkits.rdk.smarts_registry[smarts].rdksmarts,
+        uniquify=False, maxMatches=mol.Mol.GetNumAtoms())
+    return np.fromiter(chain.from_iterable(matches), dtype=np.intp)
+
+
+def _rdkit_atom_values(mol, smarts, getter):
+    """Values of an atom property, read only for atoms matching SMARTS (zero
+    for the rest)"""
+    values = np.zeros(mol.Mol.GetNumAtoms(), dtype=np.int64)
+    matches = _rdkit_matches(mol, smarts)
+    if len(matches):
+        values[matches] = [getter(mol.Mol.GetAtomWithIdx(aidx))
+                           for aidx in matches.tolist()]
+    return values
+
+
+def _bonds(mol):
+    """Indices (0-based) of atoms of all bonds in a molecule"""
+    atom_dict = _complete_atom_dict(mol)
+    if atom_dict is not None:
+        nbr_mask = ~np.isnan(atom_dict['neighbors'][:, :, 0])
+        atoms = np.repeat(np.arange(len(atom_dict)), nbr_mask.sum(axis=1))
+        nbrs = atom_dict['neighbors_id'][nbr_mask]
+        return np.column_stack((atoms, nbrs))[atoms < nbrs].astype(np.intp)
+    if is_openbabel_molecule(mol):
+        bonds = [(bond.GetBeginAtomIdx() - 1, bond.GetEndAtomIdx() - 1)
+                 for bond in oddt.toolkits.ob.ob.OBMolBondIter(mol.OBMol)]
+    else:
+        bonds = [(bond.GetBeginAtomIdx(), bond.GetEndAtomIdx())
+                 for bond in mol.Mol.GetBonds()]
+    return np.array(bonds, dtype=np.intp).reshape(-1, 2)
+
+
+def _ECFP_environments(mol, roots, depth, atom_reprs):
+    """Hashed environments of many atoms at once, identical to
+    `_ECFP_atom_hash` for each of them. Heavy atoms graph (atoms present in
+    `atom_reprs`) is stored as an adjacency matrix (CSR for large
+    molecules) and environments of all roots are expanded layer by layer with
+    matrix products. Atoms in each environment are sorted by the rank of
+    their representation and hashed with vectorized Python's tuple hash.
+
+    Parameters
+    ----------
+    mol : oddt.toolkit.Molecule object
+        Input molecule for the FP calculations
+
+    roots : list of ints
+        Root atoms indices (0-based).
+
+    depth : int
+        The depth of the environments (see `_ECFP_atom_hash`).
+
+    atom_reprs : tuple of numpy arrays
+        Indices and representations of all heavy atoms (see
+        `_ECFP_atom_reprs`).
+
+    Returns
+    -------
+    environment_hashes : numpy array, shape=(len(roots), depth + 1)
+        Hashed environments for each root atom
+    """
+    roots = np.asarray(roots, dtype=np.intp).reshape(-1)
+    atom_ids, reprs = atom_reprs
+    if not _VECTORIZED_HASH:
+        atom_repr_dict = dict(zip(atom_ids.tolist(),
+                                  map(tuple, reprs.tolist())))
+        return np.array([_ECFP_atom_hash(mol, idx, depth=depth,
+                                         atom_repr_dict=atom_repr_dict)
+                         for idx in roots.tolist()],
+                        dtype=np.int64).reshape(len(roots), depth + 1)
+    num_nodes = len(atom_ids)
+    # nodes are labeled by lexicographic rank of atoms' representations, so
+    # atoms of each environment are sorted as in `_ECFP_atom_hash`
+    rank = np.lexsort(reprs.T[::-1])
+    reprs = reprs[rank]
+    repr_hashes = _tuple_hash_lanes(
+        _int_hash_lanes(reprs).ravel(),
+        np.arange(num_nodes + 1) * reprs.shape[1])
+    bonds = _bonds(mol)
+    node = np.full(max(atom_ids.max() if num_nodes else 0,
+                       bonds.max() if len(bonds) else 0) + 1, -1,
+                   dtype=np.intp)
+    node[atom_ids[rank]] = np.arange(num_nodes)
+    # hydrogens are ignored during neighbor lookup
+    bonds = node[bonds]
+    bonds = bonds[(bonds >= 0).all(axis=1)]
+    bonds = (np.concatenate((bonds[:, 0], bonds[:, 1])),
+             np.concatenate((bonds[:, 1], bonds[:, 0])))
+
+    num_roots = len(roots)
+    out = np.empty((num_roots, depth + 1), dtype=np.int64)
+    # dense matrices are faster for small molecules
+    if num_nodes <= 256:
+        adjacency = np.zeros((num_nodes, num_nodes), dtype=bool)
+        adjacency[bonds] = True
+        environments = np.zeros((num_roots, num_nodes), dtype=bool)
+        environments[np.arange(num_roots), node[roots]] = True
+    else:
+        adjacency = csr_matrix((np.ones(len(bonds[0]), dtype=np.int32),
+                                bonds), shape=(num_nodes, num_nodes))
+        environments = csr_matrix(
+            (np.ones(num_roots, dtype=np.int32),
+             (np.arange(num_roots), node[roots])),
+            shape=(num_roots, num_nodes))
+    for r in range(depth + 1):
+        if r > 0:
+            if isinstance(environments, np.ndarray):
+                environments = environments | environments.dot(adjacency)
+            else:
+                environments = environments + environments.dot(adjacency)
+                environments.data[:] = 1
+        if isinstance(environments, np.ndarray):
+            rows, nodes = np.nonzero(environments)
+            offsets = np.concatenate(([0], np.cumsum(
+                np.bincount(rows, minlength=num_roots))))
+        else:
+            environments.sort_indices()
+            nodes, offsets = environments.indices, environments.indptr
+        out[:, r] = (_tuple_hash_lanes(repr_hashes[nodes], offsets) &
+                     np.uint64(0xffffffff)).astype(np.int64)
+    return out
+
+
+# Environments of ligands are cached by topology, so that many poses or
+# conformers of a molecule share them. Least recently used are dropped first.
+_ECFP_CACHE_SIZE = 1024
+_ECFP_cache = OrderedDict()
+
+
+def _topology_key(mol):
+    """Hashable description of molecule's topology (atoms with their
+    charges, isotopes and hydrogens, bonds and atoms' order), which does not
+    depend on coordinates or stereochemistry."""
+    if is_openbabel_molecule(mol):
+        ob = oddt.toolkits.ob.ob
+        return (tuple((atom.GetAtomicNum(),
+                       atom.GetIsotope(),
+                       atom.GetFormalCharge(),
+                       atom.ImplicitHydrogenCount(),
+                       atom.IsAromatic())
+                      for atom in ob.OBMolAtomIter(mol.OBMol)),
+                tuple((bond.GetBeginAtomIdx(),
+                       bond.GetEndAtomIdx(),
+                       bond.GetBondOrder(),
+                       bond.IsAromatic())
+                      for bond in ob.OBMolBondIter(mol.OBMol)))
+    Chem = oddt.toolkits.rdk.Chem
+    # quick copy skips conformers and properties
+    rdmol = Chem.Mol(mol.Mol, True)
+    Chem.RemoveStereochemistry(rdmol)
+    return rdmol.ToBinary()
+
+
+def _ligand_environments(ligand, depth):
+    """ECFP environment hashes of all heavy atoms of a ligand (see
+    `_ECFP_environments`), in rows indexed by atom id (rows of hydrogens are
+    0). They are cached by ligand's topology, hence computed once for all its
+    poses."""
+    key = _topology_key(ligand)
+    environments = _ECFP_cache.pop(key, None)
+    if environments is None or environments.shape[1] <= depth:
+        environments = np.zeros((len(ligand.atom_dict), depth + 1),
+                                dtype=np.int64)
+        atom_reprs = _ECFP_atom_reprs(ligand)
+        environments[atom_reprs[0]] = _ECFP_environments(
+            ligand, atom_reprs[0], depth=depth, atom_reprs=atom_reprs)
+    _ECFP_cache[key] = environments
+    while len(_ECFP_cache) > _ECFP_CACHE_SIZE:
+        _ECFP_cache.popitem(last=False)
+    return environments[:, :depth + 1]
+
+
 def ECFP(mol, depth=2, size=4096, count_bits=True, sparse=True,
          use_pharm_features=False):
     """Extended connectivity fingerprints (ECFP) with an option to include
@@ -540,18 +948,10 @@ def ECFP(mol, depth=2, size=4096, count_bits=True, sparse=True,
         is either integer or boolean.
     """
     # Hash atom environments
-    mol_hashed = []
-    atom_repr_dict = {}
-    for idx, atom in enumerate(mol.atoms):
-        if atom.atomicnum == 1:
-            continue
-        atom_repr_dict[idx] = _ECFP_atom_repr(
-            mol, idx, use_pharm_features=use_pharm_features)
-    for idx in atom_repr_dict.keys():
-        mol_hashed.append(_ECFP_atom_hash(mol, idx, depth=depth,
-                                          use_pharm_features=use_pharm_features,
-                                          atom_repr_dict=atom_repr_dict))
-    mol_hashed = np.array(sorted(chain(*mol_hashed)))
+    atom_reprs = _ECFP_atom_reprs(mol, use_pharm_features=use_pharm_features)
+    mol_hashed = np.sort(_ECFP_environments(mol, atom_reprs[0], depth=depth,
+                                            atom_reprs=atom_reprs),
+                         axis=None)
 
     # folding
     mol_hashed = fold(mol_hashed, size)
@@ -574,6 +974,9 @@ def SPLIF(ligand, protein, depth=1, size=4096, distance_cutoff=4.5):
     ----------
     ligand, protein : oddt.toolkit.Molecule object
             Molecules, which are analysed in order to find interactions.
+            Protein can be also given as `oddt.interactions.ReceptorIndex`.
+            ECFP environments of ligand's atoms are cached by its topology,
+            so they are computed once for all poses of a ligand.
     depth : int (deafult = 1)
         The depth of the fingerprint, i.e. the number of bonds in Morgan
         algorithm. Note: For ECFP2: depth = 1, ECFP4: depth = 2, etc.
@@ -594,39 +997,35 @@ def SPLIF(ligand, protein, depth=1, size=4096, distance_cutoff=4.5):
     """
 
     # removing h
-    protein_dict = protein.atom_dict[protein.atom_dict['atomicnum'] != 1]
+    protein_dict, protein_tree = _atoms(protein, 'heavy')
     ligand_dict = ligand.atom_dict[ligand.atom_dict['atomicnum'] != 1]
 
     protein_atoms, ligand_atoms = close_contacts(
-        protein_dict, ligand_dict, cutoff=distance_cutoff)
+        protein_dict, ligand_dict, cutoff=distance_cutoff, x_tree=protein_tree)
     splif = np.zeros((len(ligand_atoms)),
                      dtype=[('hash', int), ('ligand_coords', np.float32, (7, 3)),
                             ('protein_coords', np.float32, (7, 3))])
 
-    lig_atom_repr = {aidx: _ECFP_atom_repr(ligand, int(aidx))
-                     for aidx in ligand_dict['id']}
-    prot_atom_repr = {aidx: _ECFP_atom_repr(protein, int(aidx))
-                      for aidx in protein_dict['id']}
-
-    for i, (ligand_atom, protein_atom) in enumerate(zip(ligand_atoms,
-                                                        protein_atoms)):
-        if ligand_atom['atomicnum'] == 1 or protein_atom['atomicnum'] == 1:
-            continue
-        # function sorted used below solves isue, when order of parameteres
-        # is not correct -> splif(protein, ligand)
-        splif[i] = (hash32(tuple(sorted((
-            _ECFP_atom_hash(ligand,
-                            int(ligand_atom['id']),
-                            depth=depth,
-                            atom_repr_dict=lig_atom_repr)[-1],
-            _ECFP_atom_hash(protein,
-                            int(protein_atom['id']),
-                            depth=depth,
-                            atom_repr_dict=prot_atom_repr)[-1])))),
-                    np.vstack((ligand_atom['coords'].reshape((1, 3)),
-                               ligand_atom['neighbors'])),
-                    np.vstack((protein_atom['coords'].reshape((1, 3)),
-                               protein_atom['neighbors'])))
+    prot_atom_reprs = _heavy_atom_reprs(protein)
+
+    # unique protein atoms in contact
+    protein_idx, protein_inv = np.unique(protein_atoms['id'],
+                                         return_inverse=True)
+    ligand_ecfp = _ligand_environments(ligand, depth=depth)
+    protein_ecfp = _protein_environments(protein, protein_idx.tolist(),
+                                         depth=depth,
+                                         atom_reprs=prot_atom_reprs)
+    # sorting solves isue, when order of parameteres is not correct
+    # -> splif(protein, ligand)
+    splif['hash'] = _hash32_rows(np.sort(np.column_stack((
+        ligand_ecfp[ligand_atoms['id'], -1],
+        protein_ecfp[protein_inv.reshape(-1), -1])), axis=1))
+    splif['ligand_coords'] = np.concatenate(
+        (ligand_atoms['coords'][:, np.newaxis], ligand_atoms['neighbors']),
+        axis=1)
+    splif['protein_coords'] = np.concatenate(
+        (protein_atoms['coords'][:, np.newaxis], protein_atoms['neighbors']),
+        axis=1)
 
     # folding
     splif['hash'] = fold(splif['hash'], size)
@@ -706,6 +1105,10 @@ def PLEC(ligand, protein, depth_ligand=2, depth_protein=4, distance_cutoff=4.5,
     ----------
     ligand, protein : oddt.toolkit.Molecule object
             Molecules, which are analysed in order to find interactions.
+            Protein can be also given as `oddt.interactions.ReceptorIndex`,
+            which also stores ECFP environments of protein atoms, so they are
+            computed once for all ligands. Environments of ligand's atoms
+            are cached by its topology, thus computed once for all its poses.
 
     depth_ligand, depth_protein : int (deafult = (2, 4))
         The depth of the fingerprint, i.e. the number of bonds in Morgan
@@ -737,44 +1140,35 @@ def PLEC(ligand, protein, depth_ligand=2, depth_protein=4, distance_cutoff=4.5,
     """
     result = []
     # removing h
-    protein_mask = protein_no_h = (protein.atom_dict['atomicnum'] != 1)
-    if ignore_hoh:
-        # a copy is needed, so not modifing inplace
-        protein_mask = protein_mask & (protein.atom_dict['resname'] != 'HOH')
-    protein_dict = protein.atom_dict[protein_mask]
+    protein_dict, protein_tree = _atoms(protein,
+                                        'heavy_nohoh' if ignore_hoh else 'heavy')
     ligand_dict = ligand.atom_dict[ligand.atom_dict['atomicnum'] != 1]
 
     # atoms in contact
     protein_atoms, ligand_atoms = close_contacts(
-        protein_dict, ligand_dict, cutoff=distance_cutoff)
+        protein_dict, ligand_dict, cutoff=distance_cutoff, x_tree=protein_tree)
 
-    lig_atom_repr = {aidx: _ECFP_atom_repr(ligand, aidx)
-                     for aidx in ligand_dict['id'].tolist()}
     # HOH residues might be connected to metal atoms
-    prot_atom_repr = {aidx: _ECFP_atom_repr(protein, aidx)
-                      for aidx in protein.atom_dict[protein_no_h]['id'].tolist()}
-
-    for ligand_atom, protein_atom in zip(ligand_atoms['id'].tolist(),
-                                         protein_atoms['id'].tolist()):
-        ligand_ecfp = _ECFP_atom_hash(ligand,
-                                      ligand_atom,
-                                      depth=depth_ligand,
-                                      atom_repr_dict=lig_atom_repr)
-        protein_ecfp = _ECFP_atom_hash(protein,
-                                       protein_atom,
-                                       depth=depth_protein,
-                                       atom_repr_dict=prot_atom_repr)
-        assert len(ligand_ecfp) == depth_ligand + 1
-        assert len(protein_ecfp) == depth_protein + 1
-        # fillvalue is parameter from zip_longest
-        # it's used, when ligand_ecfp and protein_ecfp are not the same size,
-        # so if one is shorter the last given ECFP is used
-        if depth_ligand < depth_protein:
-            fillvalue = ligand_ecfp[-1]
-        else:
-            fillvalue = protein_ecfp[-1]
-        for pair in zip_longest(ligand_ecfp, protein_ecfp, fillvalue=fillvalue):
-                result.append(hash32(pair))
+    prot_atom_reprs = _heavy_atom_reprs(protein)
+
+    # unique protein atoms in contact
+    protein_idx, protein_inv = np.unique(protein_atoms['id'],
+                                         return_inverse=True)
+    ligand_ecfp = _ligand_environments(ligand, depth=depth_ligand)
+    ligand_ecfp = ligand_ecfp[ligand_atoms['id']]
+    protein_ecfp = _protein_environments(protein, protein_idx.tolist(),
+                                         depth=depth_protein,
+                                         atom_reprs=prot_atom_reprs)
+    protein_ecfp = protein_ecfp[protein_inv.reshape(-1)]
+    # when ligand_ecfp and protein_ecfp are not the same size, the last
+    # ECFP of the shorter one is repeated
+    depth = max(depth_ligand, depth_protein)
+    ligand_ecfp = np.column_stack(
+        [ligand_ecfp] + [ligand_ecfp[:, -1]] * (depth - depth_ligand))
+    protein_ecfp = np.column_stack(
+        [protein_ecfp] + [protein_ecfp[:, -1]] * (depth - depth_protein))
+    result = _hash32_rows(np.column_stack((ligand_ecfp.ravel(),
+                                           protein_ecfp.ravel())))
     # folding and sorting
     plec = np.sort(fold(np.array(result), size=size))
 
@@ -864,3 +1258,353 @@ def tanimoto(a, b, sparse=False):
         if denominator > 0:
             return a_b / denominator
     return 0.
+
+
+class PackedFingerprints(object):
+    def __init__(self, fps, size=None, count_bits=False):
+        """Fingerprints packed to bits of `np.uint64` words, one fingerprint
+        per row, which is 8 times less memory than dense `np.uint8`
+        fingerprints (and 64 times less than int64 ones). Counts of bits of
+        count fingerprints are stored separately, as a compact `np.uint8`
+        array of counts of 'on' bits only.
+
+        Packed fingerprints can be used as a library (and query) in
+        `similarity_search`, which then computes similarities with popcount.
+
+        .. versionadded:: 0.7
+
+        Parameters
+        ----------
+        fps : array-like, scipy.sparse matrix or list of sparse fingerprints
+            Dense fingerprint (1D) or fingerprints stacked in rows of a 2D
+            array or sparse matrix. If `size` is given, `fps` is a list of
+            sparse fingerprints (indices of 'on' bits, dupplicated for count
+            vectors).
+
+        size : int or None (default=None)
+            The size of sparse fingerprints.
+
+        count_bits : bool (default=False)
+            Should the counts of bits be stored (up to 255).
+        """
+        if size is None or issparse(fps):
+            fps = _fingerprints_matrix(fps, 'fps')
+        else:
+            fps = [np.asarray(fp, dtype=np.uint64).ravel() for fp in fps]
+            lengths = [len(fp) for fp in fps]
+            cols = (np.concatenate(fps) if fps else
+                    np.zeros(0, dtype=np.uint64))
+            if len(cols) and cols.max() >= size:
+                raise ValueError('Fingerprint bits exceed size %i' % size)
+            rows = np.repeat(np.arange(len(fps)), lengths)
+            fps = _fingerprints_matrix(
+                csr_matrix((np.ones(len(cols), dtype=np.int64),
+                            (rows, cols.astype(np.intp))),
+                           shape=(len(fps), size)), 'fps')
+        self.size = fps.shape[1]
+        num_words = (self.size + 63) // 64
+        rows = np.repeat(np.arange(fps.shape[0]), np.diff(fps.indptr))
+        # bits within a word are unique, so their sum is a bitwise or
+        keys = rows * num_words + (fps.indices >> 6)
+        starts = np.flatnonzero(np.concatenate(([True],
+                                                keys[1:] != keys[:-1])))
+        self.bits = np.zeros((fps.shape[0], num_words), dtype=np.uint64)
+        if len(keys):
+            self.bits.flat[keys[starts]] = np.add.reduceat(
+                np.left_shift(np.uint64(1),
+                              (fps.indices & 63).astype(np.uint64)),
+                starts)
+        if count_bits:
+            self.counts = np.minimum(fps.data, 255).astype(np.uint8)
+            self.offsets = fps.indptr.astype(np.intp)
+            # counts above one, used to compute sums of minimal counts
+            self._excess = csr_matrix((self.counts - 1, fps.indices.copy(),
+                                       fps.indptr.copy()), shape=fps.shape)
+            self._excess.eliminate_zeros()
+        else:
+            self.counts = self.offsets = self._excess = None
+
+    @property
+    def count_bits(self):
+        return self.counts is not None
+
+    @property
+    def shape(self):
+        return len(self.bits), self.size
+
+    @property
+    def nbytes(self):
+        """Memory used by fingerprints"""
+        return self.bits.nbytes + (self.counts.nbytes + self.offsets.nbytes +
+                                   self._excess.data.nbytes +
+                                   self._excess.indices.nbytes +
+                                   self._excess.indptr.nbytes
+                                   if self.count_bits else 0)
+
+    def __len__(self):
+        return len(self.bits)
+
+    def __getitem__(self, key):
+        """Subset of fingerprints (always 2D, also for an integer key)"""
+        if isinstance(key, slice):
+            idx = np.arange(*key.indices(len(self)))
+        else:
+            idx = np.atleast_1d(np.arange(len(self))[key])
+        subset = PackedFingerprints.__new__(PackedFingerprints)
+        subset.size = self.size
+        subset.bits = self.bits[idx]
+        if self.count_bits:
+            lengths = self.offsets[idx + 1] - self.offsets[idx]
+            subset.offsets = np.concatenate(([0], np.cumsum(lengths)))
+            # positions of counts of selected fingerprints
+            positions = (np.arange(subset.offsets[-1]) +
+                         np.repeat(self.offsets[idx] - subset.offsets[:-1],
+                                   lengths))
+            subset.counts = self.counts[positions]
+            subset._excess = self._excess[idx]
+        else:
+            subset.counts = subset.offsets = subset._excess = None
+        return subset
+
+    def popcount(self):
+        """Number of 'on' bits of each fingerprint, or the sum of counts for
+        count fingerprints"""
+        if self.count_bits:
+            counts = np.concatenate(
+                ([0], np.cumsum(self.counts, dtype=np.int64)))
+            return counts[self.offsets[1:]] - counts[self.offsets[:-1]]
+        return _popcount(self.bits).sum(axis=1).astype(np.int64)
+
+    def to_dense(self):
+        """Dense fingerprints, `np.uint8` counts or bool array of shape
+        (n, size)"""
+        # little endian bytes of words, bits reversed to little endian order
+        dense = np.unpackbits(
+            self.bits.astype('<u8').view(np.uint8).reshape(-1, 1),
+            axis=1)[:, ::-1].reshape(len(self), -1)[:, :self.size]
+        dense = dense.astype(bool)
+        if self.count_bits:
+            dense = dense.astype(np.uint8)
+            dense[dense > 0] = self.counts
+        return dense
+
+    def to_csr_matrix(self):
+        """Fingerprints as `scipy.sparse.csr_matrix` of `np.uint8` counts or
+        bools, as in `sparse_to_csr_matrix`"""
+        return csr_matrix(self.to_dense())
+
+    def __repr__(self):
+        return '<PackedFingerprints of %i fingerprints, size %i%s>' % (
+            len(self), self.size, ', with counts' if self.count_bits else '')
+
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0f0f0f0f0f0f0f0f)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def _popcount(words):
+    """Number of set bits in each of np.uint64 words"""
+    if hasattr(np, 'bitwise_count'):  # numpy >= 2.0
+        return np.bitwise_count(words)
+    # SWAR popcount
+    words = words - ((words >> np.uint64(1)) & _M1)
+    words = (words & _M2) + ((words >> np.uint64(2)) & _M2)
+    words = (words + (words >> np.uint64(4))) & _M4
+    return (words * _H01) >> np.uint64(56)
+
+
+def _fingerprints_matrix(fps, name):
+    """Stack of fingerprints as CSR matrix, one fingerprint per row"""
+    if not issparse(fps):
+        fps = np.asarray(fps)
+        if fps.ndim == 1:
+            fps = fps.reshape(1, -1)
+        if fps.ndim != 2:
+            raise ValueError('%s must be a 2D array or sparse matrix of '
+                             'dense fingerprints' % name)
+    fps = csr_matrix(fps)
+    # canonical format (sorted, unique indices) without explicit zeros,
+    # input matrices are not modified
+    if not fps.has_canonical_format or not fps.data.all():
+        fps = fps.copy()
+        fps.sum_duplicates()
+        fps.eliminate_zeros()
+    return fps
+
+
+def _common_counts(query, library):
+    """Sums of minimal counts for all pairs of rows of CSR matrices"""
+    # sum of minimal counts is computed from unary encoded counts, i.e.
+    # min(a, b) = sum([a >= t and b >= t for t in 1..min(a, b)])
+    max_count = int(min(query.data.max() if query.nnz else 0,
+                        library.data.max() if library.nnz else 0))
+    common = np.zeros((query.shape[0], library.shape[0]))
+    for t in range(1, max_count + 1):
+        common += (query >= t).astype(float).dot(
+            (library >= t).astype(float).T).toarray()
+    return common
+
+
+def _similarity_block(query, library, metric, count_bits, alpha, beta):
+    """Similarity of all pairs of query and library fingerprints (rows of
+    CSR matrices or `PackedFingerprints`), as dense array of shape
+    (n_query, n_library)"""
+    if isinstance(library, PackedFingerprints):
+        if count_bits:
+            query_size = query.popcount().astype(float)[:, np.newaxis]
+            library_size = library.popcount().astype(float)[np.newaxis]
+        else:
+            # stored counts are ignored for binary similarity
+            query_size = _popcount(query.bits).sum(axis=1).astype(
+                float)[:, np.newaxis]
+            library_size = _popcount(library.bits).sum(axis=1).astype(
+                float)[np.newaxis]
+        common = np.empty((len(query), len(library)))
+        # library is processed in chunks which fit in CPU cache
+        step = max(1, 2 ** 16 // library.bits.shape[1])
+        for start in range(0, len(library), step):
+            library_words = library.bits[start:start + step]
+            for i, words in enumerate(query.bits):
+                common[i, start:start + step] = _popcount(
+                    library_words & words).sum(axis=1)
+        if count_bits:
+            # min(a, b) = 1 + min(a - 1, b - 1) for bits set in both
+            common += _common_counts(query._excess, library._excess)
+    elif count_bits:
+        query_size = np.asarray(query.sum(axis=1), dtype=float)
+        library_size = np.asarray(library.sum(axis=1), dtype=float).T
+        common = _common_counts(query, library)
+    else:
+        query = query.astype(bool).astype(float)
+        library = library.astype(bool).astype(float)
+        query_size = np.diff(query.indptr).astype(float)[:, np.newaxis]
+        library_size = np.diff(library.indptr).astype(float)[np.newaxis]
+        common = query.dot(library.T).toarray()
+
+    if metric == 'tanimoto':
+        denominator = query_size + library_size - common
+    elif metric == 'dice':
+        common *= 2
+        denominator = query_size + library_size
+    else:
+        denominator = (common + alpha * (query_size - common) +
+                       beta * (library_size - common))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sims = common / denominator
+    sims[denominator == 0] = 0.
+    return sims
+
+
+def similarity_search(query, library, metric='tanimoto', top_k=None,
+                      threshold=None, count_bits=False, alpha=1., beta=1.,
+                      block_size=None):
+    """Compares query fingerprints against a whole library at once and
+    returns the most similar pairs. Similarities are computed with sparse
+    matrix products (or popcount for `PackedFingerprints`), in blocks of
+    library fingerprints to bound memory.
+
+    .. versionadded:: 0.7
+
+    Parameters
+    ----------
+    query : numpy array, scipy.sparse matrix or PackedFingerprints
+        Dense fingerprint (1D), or fingerprints stacked in rows of a 2D array
+        or sparse matrix, e.g. `sparse_to_csr_matrix` outputs stacked with
+        `scipy.sparse.vstack`.
+
+    library : numpy array, scipy.sparse matrix or PackedFingerprints
+        Library of fingerprints, one per row, of the same size as query.
+        CSR matrix or `PackedFingerprints` (for dense fingerprints with many
+        'on' bits) are the most memory efficient. Packed library has to store
+        counts to be searched with `count_bits=True`.
+
+    metric : str (default='tanimoto')
+        Similarity metric: 'tanimoto', 'dice' or 'tversky'.
+
+    top_k : int or None (default=None)
+        Number of the most similar library fingerprints returned for each
+        query.
+
+    threshold : float or None (default=None)
+        Minimal similarity of returned pairs. At least one of `top_k` and
+        `threshold` is required, if both are given the top-k pairs above the
+        threshold are returned.
+
+    count_bits : bool (default=False)
+        Should the counts of bits be used (bits in common are the minimal
+        counts). Otherwise fingerprints are casted to boolean, as in
+        `tanimoto`. Note that `dice` uses counts.
+
+    alpha, beta : float (default=1.)
+        Tversky weights of query and library features, respectively. The
+        default ones are equivalent to Tanimoto coefficient.
+
+    block_size : int or None (default=None)
+        Number of library fingerprints compared at once. By default a block
+        of similarities has at most 2^24 elements.
+
+    Returns
+    -------
+    query_idx, library_idx, scores : numpy arrays
+        Indices of query and library fingerprints of similar pairs and their
+        similarities. Pairs are sorted by query, then by descending
+        similarity (ties by library index).
+    """
+    if metric not in ('tanimoto', 'dice', 'tversky'):
+        raise ValueError('Unsupported metric "%s". Use "tanimoto", "dice" or '
+                         '"tversky".' % metric)
+    if top_k is None and threshold is None:
+        raise ValueError('Either top_k or threshold is required.')
+    if top_k is not None and top_k < 1:
+        raise ValueError('top_k must be positive, got %s' % top_k)
+    if isinstance(library, PackedFingerprints):
+        if count_bits and not library.count_bits:
+            raise ValueError('Library is packed without counts.')
+        if not isinstance(query, PackedFingerprints):
+            query = PackedFingerprints(query, count_bits=count_bits)
+        elif count_bits and not query.count_bits:
+            raise ValueError('Query is packed without counts.')
+    else:
+        if isinstance(query, PackedFingerprints):
+            query = query.to_csr_matrix()
+        query = _fingerprints_matrix(query, 'query')
+        library = _fingerprints_matrix(library, 'library')
+    if query.shape[1] != library.shape[1]:
+        raise ValueError('Query and library fingerprints have different '
+                         'sizes: %i and %i' % (query.shape[1],
+                                               library.shape[1]))
+    if block_size is None:
+        block_size = max(1, 2 ** 24 // max(query.shape[0], 1))
+
+    query_idx = np.zeros(0, dtype=np.intp)
+    library_idx = np.zeros(0, dtype=np.intp)
+    scores = np.zeros(0)
+    for start in range(0, library.shape[0], block_size):
+        sims = _similarity_block(query, library[start:start + block_size],
+                                 metric, count_bits, alpha, beta)
+        mask = np.ones(sims.shape, dtype=bool)
+        if threshold is not None:
+            mask &= sims >= threshold
+        if top_k is not None and top_k < sims.shape[1]:
+            # candidates are k most similar, including ties
+            kth = -np.partition(-sims, top_k - 1, axis=1)[:, top_k - 1]
+            mask &= sims >= kth[:, np.newaxis]
+        rows, cols = np.nonzero(mask)
+        query_idx = np.concatenate((query_idx, rows))
+        library_idx = np.concatenate((library_idx, cols + start))
+        scores = np.concatenate((scores, sims[rows, cols]))
+
+        order = np.lexsort((library_idx, -scores, query_idx))
+        query_idx = query_idx[order]
+        library_idx = library_idx[order]
+        scores = scores[order]
+        if top_k is not None:
+            # rank of pairs within each query
+            first = np.searchsorted(query_idx, query_idx)
+            keep = np.arange(len(query_idx)) - first < top_k
+            query_idx = query_idx[keep]
+            library_idx = library_idx[keep]
+            scores = scores[keep]
+    return query_idx, library_idx, scores
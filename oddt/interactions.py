@@ -12,9 +12,16 @@ Currently following interacions are implemented:
 """
 
 import numpy as np
-from oddt.spatial import angle, angle_2v, distance
+from scipy.spatial import cKDTree
+from six import string_types
 
-__all__ = ['close_contacts',
+from oddt.spatial import angle, angle_2v, close_pairs
+from oddt.utils import is_openbabel_molecule
+from oddt.toolkits.common import canonize_ring_path
+
+__all__ = ['ReceptorIndex',
+           'DictIndex',
+           'close_contacts',
            'hbond_acceptor_donor',
            'hbonds',
            'halogenbond_acceptor_halogen',
@@ -25,11 +32,232 @@ __all__ = ['close_contacts',
            'hydrophobic_contacts',
            'pi_cation',
            'acceptor_metal',
-           'pi_metal']
+           'pi_metal',
+           'interaction_profile',
+           'batch_interactions',
+           'BATCH_INTERACTION_TYPES']
+
+
+# Named atom selections available in `ReceptorIndex.atoms` in addition to
+# boolean columns of atom_dict (i.e. 'isacceptor', 'ishydrophobe')
+_ATOM_SELECTIONS = {
+    'all': lambda atom_dict: np.ones(len(atom_dict), dtype=bool),
+    'heavy': lambda atom_dict: atom_dict['atomicnum'] != 1,
+    'heavy_nohoh': lambda atom_dict: ((atom_dict['atomicnum'] != 1) &
+                                      (atom_dict['resname'] != 'HOH')),
+}
+
+
+class ReceptorIndex(object):
+    def __init__(self, mol):
+        """Reusable index of a receptor (or any other molecule which is
+        queried repeatedly, i.e. by many ligands in virtual screening). Atom
+        subsets (acceptors, donors, hydrophobes, heavy atoms, etc.), ring
+        centroids and KD-trees built on them are computed lazily once and
+        reused by all subsequent queries.
+
+        The index can be used in place of `oddt.toolkit.Molecule` in all
+        interaction functions, interaction fingerprints and descriptors. All
+        other attributes are passed through to the underlying molecule. If
+        coordinates of the molecule change (or the molecule is otherwise
+        modified so that its atom_dict is rebuilt) the index is invalidated
+        automatically.
+
+        .. versionadded:: 0.7
+
+        Parameters
+        ----------
+        mol : oddt.toolkit.Molecule object or ReceptorIndex
+            Molecule to be indexed. An index is unwrapped to its molecule.
+        """
+        if isinstance(mol, ReceptorIndex):
+            mol = mol.mol
+        self.mol = mol
+        self._reset()
+
+    def _reset(self):
+        self._atom_dict = self.mol.atom_dict
+        self._selections = {}
+        self._masks = {}
+        self._trees = {}
+        # a storage for data derived from the receptor by other modules
+        self.cache = {}
+
+    def _check(self):
+        """Invalidate the index if molecule's dictionaries were rebuilt"""
+        if self.mol.atom_dict is not self._atom_dict:
+            self._reset()
+
+    @property
+    def atom_dict(self):
+        return self.mol.atom_dict
+
+    @property
+    def ring_dict(self):
+        return self.mol.ring_dict
+
+    @property
+    def res_dict(self):
+        return self.mol.res_dict
+
+    def atoms(self, name, mask=None):
+        """Returns a cached subset of atom_dict.
+
+        Parameters
+        ----------
+        name : str or hashable
+            Name of the selection: one of the boolean columns of atom_dict
+            (i.e. 'isacceptor'), 'all', 'heavy' (non-hydrogen atoms) or
+            'heavy_nohoh' (non-hydrogen atoms outside of water molecules).
+            Any other hashable can be used as a name if `mask` is provided.
+
+        mask : numpy array, dtype=bool or None (default=None)
+            Custom mask of atoms, which is stored under `name`. A different
+            mask for an already cached selection raises ValueError.
+
+        Returns
+        -------
+        atoms : atom_dict-type numpy array
+            Selected atoms
+        """
+        self._check()
+        if name not in self._selections:
+            atom_dict = self._atom_dict
+            if mask is None:
+                if name in _ATOM_SELECTIONS:
+                    mask = _ATOM_SELECTIONS[name](atom_dict)
+                elif (name in atom_dict.dtype.names and
+                      atom_dict.dtype[name] == np.bool_):
+                    mask = atom_dict[name]
+                else:
+                    raise ValueError('Unknown atom selection: "%s"' % name)
+            self._masks[name] = np.asarray(mask, dtype=bool)
+            self._selections[name] = atom_dict[self._masks[name]]
+        elif (mask is not None and
+              not np.array_equal(self._masks[name],
+                                 np.asarray(mask, dtype=bool))):
+            raise ValueError('Atom selection "%s" is cached with a different '
+                             'mask' % name)
+        return self._selections[name]
+
+    def rings(self):
+        """Returns cached ring_dict of the molecule"""
+        self._check()
+        if 'rings' not in self._selections:
+            self._selections['rings'] = self.mol.ring_dict
+        return self._selections['rings']
+
+    def tree(self, name, mask=None):
+        """Returns a cached `scipy.spatial.cKDTree` built on coordinates of
+        atoms selected by `name` (see `ReceptorIndex.atoms`) or ring centroids
+        if `name` is 'rings'. Returns None for empty selections.
+        """
+        self._check()
+        if mask is not None:
+            # validates the mask of a cached selection
+            self.atoms(name, mask=mask)
+        if name not in self._trees:
+            if name == 'rings':
+                coords = self.rings()['centroid']
+            else:
+                coords = self.atoms(name, mask=mask)['coords']
+            self._trees[name] = cKDTree(coords) if len(coords) else None
+        return self._trees[name]
+
+    def __getattr__(self, name):
+        # avoid infinite recursion if mol is not set (i.e. during unpickling)
+        if name == 'mol':
+            raise AttributeError(name)
+        return getattr(self.mol, name)
+
+    def __getstate__(self):
+        # selections and trees are cheap to rebuild, data in cache might not
+        return {'mol': self.mol, 'cache': self.cache}
+
+    def __setstate__(self, state):
+        self.mol = state['mol']
+        self._reset()
+        self.cache.update(state.get('cache', {}))
+
+    def __repr__(self):
+        return '<ReceptorIndex of %r>' % self.mol
+
+
+def _atoms(mol, name):
+    """Atom subset selected by boolean column or named selection and its
+    KD-tree, if molecule is a `ReceptorIndex`, otherwise None."""
+    if isinstance(mol, ReceptorIndex):
+        return mol.atoms(name), mol.tree(name)
+    if name in _ATOM_SELECTIONS:
+        return mol.atom_dict[_ATOM_SELECTIONS[name](mol.atom_dict)], None
+    return mol.atom_dict[mol.atom_dict[name]], None
+
+
+def _rings(mol):
+    """Ring dict and its KD-tree, if molecule is a `ReceptorIndex`,
+    otherwise None."""
+    if isinstance(mol, ReceptorIndex):
+        return mol.rings(), mol.tree('rings')
+    return mol.ring_dict, None
+
+
+class DictIndex(np.ndarray):
+    """Integer indices of rows of atom_dict or ring_dict, returned by
+    interaction functions with `return_index=True`. Columns are resolved
+    lazily, only when requested, so no structured records are copied::
+
+        >>> a, d, strict = hbond_acceptor_donor(ligand, protein,
+        ...                                     return_index=True)
+        >>> a  # atom ids (rows of ligand.atom_dict)
+        >>> a['coords']  # same as ligand.atom_dict['coords'][a]
+        >>> a.records  # full atom_dict rows
+
+    .. versionadded:: 0.7
+    """
+    def __new__(cls, index, source):
+        obj = np.asarray(index, dtype=np.intp).view(cls)
+        obj.source = source
+        return obj
+
+    def __array_finalize__(self, obj):
+        self.source = getattr(obj, 'source', None)
+
+    def __getitem__(self, key):
+        if isinstance(key, string_types):
+            return self.source[key][self.view(np.ndarray)]
+        return super(DictIndex, self).__getitem__(key)
+
+    @property
+    def records(self):
+        """Structured rows of the source dictionary"""
+        return self.source[self.view(np.ndarray)]
+
+    def __reduce__(self):
+        return DictIndex, (self.view(np.ndarray), self.source)
+
+
+def _take(mol, subset, index, return_index=False):
+    """Rows of atom or ring subset (see `_atoms` and `_rings`) at given
+    positions, optionally as `DictIndex` into molecule's dictionary."""
+    if not return_index:
+        return subset[index]
+    if 'id' in subset.dtype.names:
+        return DictIndex(subset['id'][index], mol.atom_dict)
+    # ring subsets are full ring_dicts
+    return DictIndex(index, mol.ring_dict)
+
+
+def _concatenate(arrays):
+    """Concatenate results, keeping the source of `DictIndex`"""
+    out = np.concatenate(arrays)
+    if isinstance(arrays[0], DictIndex):
+        return DictIndex(out, arrays[0].source)
+    return out
 
 
 def close_contacts(x, y, cutoff, x_column='coords', y_column='coords',
-                   cutoff_low=0.):
+                   cutoff_low=0., method='auto', x_tree=None, y_tree=None,
+                   return_index=False):
     """Returns pairs of atoms which are within close contac distance cutoff.
     The cutoff is semi-inclusive, i.e (cutoff_low, cutoff].
 
@@ -49,25 +277,46 @@ def close_contacts(x, y, cutoff, x_column='coords', y_column='coords',
         Lower bound of contacts to find (exclusive). Zero by default.
         .. versionadded:: 0.6
 
+    method : str (default='auto')
+        Neighbor search backend passed to `oddt.spatial.close_pairs`. By
+        default a KD-tree is used for large systems and a full distance
+        matrix for small ones.
+        .. versionadded:: 0.7
+
+    x_tree, y_tree : scipy.spatial.cKDTree or None (default=None)
+        Precomputed KD-trees built on x or y coordinates (i.e. obtained from
+        `ReceptorIndex.tree`).
+        .. versionadded:: 0.7
+
+    return_index : bool (default=False)
+        If True, positions of atoms in x and y are returned instead of
+        copies of their rows.
+        .. versionadded:: 0.7
+
     Returns
     -------
     x_, y_ : atom_dict-type numpy array
         Aligned pairs of atoms in close contact for further processing.
+        Integer arrays of positions in x and y if `return_index` is True.
     """
-    if len(x[x_column]) > 0 and len(x[x_column]) > 0:
-        d = distance(x[x_column], y[y_column])
-        index = np.argwhere((d > cutoff_low) & (d <= cutoff))
-        return x[index[:, 0]], y[index[:, 1]]
+    if len(x[x_column]) > 0 and len(y[y_column]) > 0:
+        index = close_pairs(x[x_column], y[y_column], cutoff,
+                            cutoff_low=cutoff_low, method=method,
+                            x_tree=x_tree, y_tree=y_tree)
     else:
-        return x[[]], y[[]]
+        index = np.empty((0, 2), dtype=int)
+    if return_index:
+        return index[:, 0], index[:, 1]
+    return x[index[:, 0]], y[index[:, 1]]
 
 
-def hbond_acceptor_donor(mol1, mol2, cutoff=3.5, base_angle=120, tolerance=30):
+def hbond_acceptor_donor(mol1, mol2, cutoff=3.5, base_angle=120, tolerance=30,
+                         return_index=False):
     """Returns pairs of acceptor-donor atoms, which meet H-bond criteria
 
     Parameters
     ----------
-    mol1, mol2 : oddt.toolkit.Molecule object
+    mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
         Molecules to compute H-bond acceptor and H-bond donor pairs
 
     cutoff : float, (default=3.5)
@@ -82,6 +331,11 @@ def hbond_acceptor_donor(mol1, mol2, cutoff=3.5, base_angle=120, tolerance=30):
         Range (+/- tolerance) from perfect direction (base_angle/n_neighbors)
         in which H-bonds are considered as strict.
 
+    return_index : bool (default=False)
+        If True, `DictIndex` arrays (integer rows of atom_dict or ring_dict
+        with lazy column access) are returned instead of copies of records.
+        .. versionadded:: 0.7
+
     Returns
     -------
     a, d : atom_dict-type numpy array
@@ -93,26 +347,37 @@ def hbond_acceptor_donor(mol1, mol2, cutoff=3.5, base_angle=120, tolerance=30):
         form 'strict' H-bond (pass all angular cutoffs). If false,
         only distance cutoff is met, therefore the bond is 'crude'.
     """
-    a, d = close_contacts(mol1.atom_dict[mol1.atom_dict['isacceptor']],
-                          mol2.atom_dict[mol2.atom_dict['isdonor']],
-                          cutoff)
+    a, a_tree = _atoms(mol1, 'isacceptor')
+    d, d_tree = _atoms(mol2, 'isdonor')
+    a_idx, d_idx = close_contacts(a, d, cutoff, x_tree=a_tree, y_tree=d_tree,
+                                  return_index=True)
+    a = _take(mol1, a, a_idx, return_index)
+    d = _take(mol2, d, d_idx, return_index)
+    return a, d, _hbond_strict(a['coords'], a['neighbors'],
+                               d['coords'], d['neighbors'],
+                               base_angle, tolerance)
+
+
+def _hbond_strict(a_coords, a_neighbors, d_coords, d_neighbors, base_angle,
+                  tolerance):
+    """Angular H-bond criteria for aligned acceptor-donor pairs"""
     # skip empty values
-    if len(a) > 0 and len(d) > 0:
-        angle1 = angle(d['coords'][:, np.newaxis, :],
-                       a['coords'][:, np.newaxis, :],
-                       a['neighbors'])
-        a_neighbors_num = np.sum(~np.isnan(a['neighbors'][:, :, 0]), axis=-1)[:, np.newaxis]
-        angle2 = angle(a['coords'][:, np.newaxis, :],
-                       d['coords'][:, np.newaxis, :],
-                       d['neighbors'])
-        d_neighbors_num = np.sum(~np.isnan(d['neighbors'][:, :, 0]), axis=-1)[:, np.newaxis]
+    if len(a_coords) > 0 and len(d_coords) > 0:
+        angle1 = angle(d_coords[:, np.newaxis, :],
+                       a_coords[:, np.newaxis, :],
+                       a_neighbors)
+        a_neighbors_num = np.sum(~np.isnan(a_neighbors[:, :, 0]), axis=-1)[:, np.newaxis]
+        angle2 = angle(a_coords[:, np.newaxis, :],
+                       d_coords[:, np.newaxis, :],
+                       d_neighbors)
+        d_neighbors_num = np.sum(~np.isnan(d_neighbors[:, :, 0]), axis=-1)[:, np.newaxis]
         strict = (((np.nan_to_num(angle1) > (base_angle / a_neighbors_num - tolerance)) |
                    np.isnan(angle1)) &
                   ((np.nan_to_num(angle2) > (base_angle / d_neighbors_num - tolerance)) |
                    np.isnan(angle2))).all(axis=-1)
-        return a, d, strict
+        return strict
     else:
-        return a, d, np.array([], dtype=bool)
+        return np.array([], dtype=bool)
 
 
 def hbonds(mol1, mol2, *args, **kwargs):
@@ -120,7 +385,7 @@ def hbonds(mol1, mol2, *args, **kwargs):
 
     Parameters
     ----------
-    mol1, mol2 : oddt.toolkit.Molecule object
+    mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
         Molecules to compute H-bond acceptor and H-bond donor pairs
 
     cutoff : float, (default=3.5)
@@ -135,6 +400,11 @@ def hbonds(mol1, mol2, *args, **kwargs):
         Range (+/- tolerance) from perfect direction (base_angle/n_neighbors)
         in which H-bonds are considered as strict.
 
+    return_index : bool (default=False)
+        If True, `DictIndex` arrays (integer rows of atom_dict or ring_dict
+        with lazy column access) are returned instead of copies of records.
+        .. versionadded:: 0.7
+
     Returns
     -------
     mol1_atoms, mol2_atoms : atom_dict-type numpy array
@@ -147,7 +417,7 @@ def hbonds(mol1, mol2, *args, **kwargs):
     """
     a1, d1, s1 = hbond_acceptor_donor(mol1, mol2, *args, **kwargs)
     a2, d2, s2 = hbond_acceptor_donor(mol2, mol1, *args, **kwargs)
-    return np.concatenate((a1, d2)), np.concatenate((d1, a2)), np.concatenate((s1, s2))
+    return _concatenate((a1, d2)), _concatenate((d1, a2)), np.concatenate((s1, s2))
 
 
 def halogenbond_acceptor_halogen(mol1,
@@ -155,12 +425,13 @@ def halogenbond_acceptor_halogen(mol1,
                                  base_angle_acceptor=120,
                                  base_angle_halogen=180,
                                  tolerance=30,
-                                 cutoff=4):
+                                 cutoff=4,
+                                 return_index=False):
     """Returns pairs of acceptor-halogen atoms, which meet halogen bond criteria
 
     Parameters
     ----------
-    mol1, mol2 : oddt.toolkit.Molecule object
+    mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
         Molecules to compute halogen bond acceptor and halogen pairs
 
     cutoff : float, (default=4)
@@ -178,6 +449,11 @@ def halogenbond_acceptor_halogen(mol1,
         Range (+/- tolerance) from perfect direction (base_angle/n_neighbors)
         in which halogen bonds are considered as strict.
 
+    return_index : bool (default=False)
+        If True, `DictIndex` arrays (integer rows of atom_dict or ring_dict
+        with lazy column access) are returned instead of copies of records.
+        .. versionadded:: 0.7
+
     Returns
     -------
     a, h : atom_dict-type numpy array
@@ -189,26 +465,38 @@ def halogenbond_acceptor_halogen(mol1,
         form 'strict' halogen bond (pass all angular cutoffs). If false,
         only distance cutoff is met, therefore the bond is 'crude'.
     """
-    a, h = close_contacts(mol1.atom_dict[mol1.atom_dict['isacceptor']],
-                          mol2.atom_dict[mol2.atom_dict['ishalogen']],
-                          cutoff)
+    a, a_tree = _atoms(mol1, 'isacceptor')
+    h, h_tree = _atoms(mol2, 'ishalogen')
+    a_idx, h_idx = close_contacts(a, h, cutoff, x_tree=a_tree, y_tree=h_tree,
+                                  return_index=True)
+    a = _take(mol1, a, a_idx, return_index)
+    h = _take(mol2, h, h_idx, return_index)
+    return a, h, _halogenbond_strict(a['coords'], a['neighbors'],
+                                     h['coords'], h['neighbors'],
+                                     base_angle_acceptor, base_angle_halogen,
+                                     tolerance)
+
+
+def _halogenbond_strict(a_coords, a_neighbors, h_coords, h_neighbors,
+                        base_angle_acceptor, base_angle_halogen, tolerance):
+    """Angular halogen bond criteria for aligned acceptor-halogen pairs"""
     # skip empty values
-    if len(a) > 0 and len(h) > 0:
-        angle1 = angle(h['coords'][:, np.newaxis, :],
-                       a['coords'][:, np.newaxis, :],
-                       a['neighbors'])
-        angle2 = angle(a['coords'][:, np.newaxis, :],
-                       h['coords'][:, np.newaxis, :],
-                       h['neighbors'])
-        a_neighbors_num = np.sum(~np.isnan(a['neighbors'][:, :, 0]), axis=-1)[:, np.newaxis]
-        h_neighbors_num = np.sum(~np.isnan(h['neighbors'][:, :, 0]), axis=-1)[:, np.newaxis]
+    if len(a_coords) > 0 and len(h_coords) > 0:
+        angle1 = angle(h_coords[:, np.newaxis, :],
+                       a_coords[:, np.newaxis, :],
+                       a_neighbors)
+        angle2 = angle(a_coords[:, np.newaxis, :],
+                       h_coords[:, np.newaxis, :],
+                       h_neighbors)
+        a_neighbors_num = np.sum(~np.isnan(a_neighbors[:, :, 0]), axis=-1)[:, np.newaxis]
+        h_neighbors_num = np.sum(~np.isnan(h_neighbors[:, :, 0]), axis=-1)[:, np.newaxis]
         strict = (((np.nan_to_num(angle1) > (base_angle_acceptor / a_neighbors_num - tolerance)) |
                    np.isnan(angle1)) &
                   ((np.nan_to_num(angle2) > (base_angle_halogen / h_neighbors_num - tolerance)) |
                    np.isnan(angle2))).all(axis=-1)
-        return a, h, strict
+        return strict
     else:
-        return a, h, np.array([], dtype=bool)
+        return np.array([], dtype=bool)
 
 
 def halogenbonds(mol1, mol2, **kwargs):
@@ -216,7 +504,7 @@ def halogenbonds(mol1, mol2, **kwargs):
 
     Parameters
     ----------
-    mol1, mol2 : oddt.toolkit.Molecule object
+    mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
         Molecules to compute halogen bond acceptor and halogen pairs
 
     cutoff : float, (default=4)
@@ -234,6 +522,11 @@ def halogenbonds(mol1, mol2, **kwargs):
         Range (+/- tolerance) from perfect direction (base_angle/n_neighbors)
         in which halogen bonds are considered as strict.
 
+    return_index : bool (default=False)
+        If True, `DictIndex` arrays (integer rows of atom_dict or ring_dict
+        with lazy column access) are returned instead of copies of records.
+        .. versionadded:: 0.7
+
     Returns
     -------
     mol1_atoms, mol2_atoms : atom_dict-type numpy array
@@ -246,15 +539,15 @@ def halogenbonds(mol1, mol2, **kwargs):
     """
     a1, h1, s1 = halogenbond_acceptor_halogen(mol1, mol2, **kwargs)
     a2, h2, s2 = halogenbond_acceptor_halogen(mol2, mol1, **kwargs)
-    return np.concatenate((a1, h2)), np.concatenate((h1, a2)), np.concatenate((s1, s2))
+    return _concatenate((a1, h2)), _concatenate((h1, a2)), np.concatenate((s1, s2))
 
 
-def pi_stacking(mol1, mol2, cutoff=5, tolerance=30):
+def pi_stacking(mol1, mol2, cutoff=5, tolerance=30, return_index=False):
     """Returns pairs of rings, which meet pi stacking criteria
 
     Parameters
     ----------
-    mol1, mol2 : oddt.toolkit.Molecule object
+    mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
         Molecules to compute ring pairs
 
     cutoff : float, (default=5)
@@ -264,6 +557,11 @@ def pi_stacking(mol1, mol2, cutoff=5, tolerance=30):
         Range (+/- tolerance) from perfect direction (parallel or
         perpendicular) in which pi-stackings are considered as strict.
 
+    return_index : bool (default=False)
+        If True, `DictIndex` arrays (integer rows of atom_dict or ring_dict
+        with lazy column access) are returned instead of copies of records.
+        .. versionadded:: 0.7
+
     Returns
     -------
     r1, r2 : ring_dict-type numpy array
@@ -279,46 +577,70 @@ def pi_stacking(mol1, mol2, cutoff=5, tolerance=30):
         form 'strict' perpendicular pi-stacking (T-shaped, T-face, etc.).
         If false, only distance cutoff is met, therefore the stacking is 'crude'.
     """
-    r1, r2 = close_contacts(mol1.ring_dict,
-                            mol2.ring_dict,
-                            cutoff,
-                            x_column='centroid',
-                            y_column='centroid')
-    if len(r1) > 0 and len(r2) > 0:
-        angle1 = angle_2v(r1['vector'], r2['vector'])
-        angle2 = angle(r1['vector'] + r1['centroid'],
-                       r1['centroid'],
-                       r2['centroid'])
+    r1, r1_tree = _rings(mol1)
+    r2, r2_tree = _rings(mol2)
+    r1_idx, r2_idx = close_contacts(r1,
+                                    r2,
+                                    cutoff,
+                                    x_column='centroid',
+                                    y_column='centroid',
+                                    x_tree=r1_tree,
+                                    y_tree=r2_tree,
+                                    return_index=True)
+    r1 = _take(mol1, r1, r1_idx, return_index)
+    r2 = _take(mol2, r2, r2_idx, return_index)
+    return (r1, r2) + _pi_stacking_strict(r1['centroid'], r1['vector'],
+                                          r2['centroid'], r2['vector'],
+                                          tolerance)
+
+
+def _pi_stacking_strict(r1_centroid, r1_vector, r2_centroid, r2_vector,
+                        tolerance):
+    """Angular pi-stacking criteria (parallel and perpendicular) for aligned
+    ring pairs"""
+    if len(r1_centroid) > 0 and len(r2_centroid) > 0:
+        angle1 = angle_2v(r1_vector, r2_vector)
+        angle2 = angle(r1_vector + r1_centroid,
+                       r1_centroid,
+                       r2_centroid)
         strict_parallel = (((angle1 > 180 - tolerance) | (angle1 < tolerance)) &
                            ((angle2 > 180 - tolerance) | (angle2 < tolerance)))
         strict_perpendicular = (((angle1 > 90 - tolerance) & (angle1 < 90 + tolerance)) &
                                 ((angle2 > 180 - tolerance) | (angle2 < tolerance)))
-        return r1, r2, strict_parallel, strict_perpendicular
+        return strict_parallel, strict_perpendicular
     else:
-        return r1, r2, np.array([], dtype=bool), np.array([], dtype=bool)
+        return np.array([], dtype=bool), np.array([], dtype=bool)
 
 
-def salt_bridge_plus_minus(mol1, mol2, cutoff=4):
+def salt_bridge_plus_minus(mol1, mol2, cutoff=4, return_index=False):
     """Returns pairs of plus-mins atoms, which meet salt bridge criteria
 
     Parameters
     ----------
-    mol1, mol2 : oddt.toolkit.Molecule object
+    mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
         Molecules to compute plus and minus pairs
 
     cutoff : float, (default=4)
         Distance cutoff for A-H pairs
 
+    return_index : bool (default=False)
+        If True, `DictIndex` arrays (integer rows of atom_dict or ring_dict
+        with lazy column access) are returned instead of copies of records.
+        .. versionadded:: 0.7
+
     Returns
     -------
     plus, minus : atom_dict-type numpy array
         Aligned arrays of atoms forming salt bridge, firstly plus, secondly minus
 
     """
-    m1_plus, m2_minus = close_contacts(mol1.atom_dict[mol1.atom_dict['isplus']],
-                                       mol2.atom_dict[mol2.atom_dict['isminus']],
-                                       cutoff)
-    return m1_plus, m2_minus
+    plus, plus_tree = _atoms(mol1, 'isplus')
+    minus, minus_tree = _atoms(mol2, 'isminus')
+    plus_idx, minus_idx = close_contacts(plus, minus, cutoff,
+                                         x_tree=plus_tree, y_tree=minus_tree,
+                                         return_index=True)
+    return (_take(mol1, plus, plus_idx, return_index),
+            _take(mol2, minus, minus_idx, return_index))
 
 
 def salt_bridges(mol1, mol2, *args, **kwargs):
@@ -326,12 +648,17 @@ def salt_bridges(mol1, mol2, *args, **kwargs):
 
     Parameters
     ----------
-    mol1, mol2 : oddt.toolkit.Molecule object
+    mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
         Molecules to compute plus and minus pairs
 
     cutoff : float, (default=4)
         Distance cutoff for plus-minus pairs
 
+    return_index : bool (default=False)
+        If True, `DictIndex` arrays (integer rows of atom_dict or ring_dict
+        with lazy column access) are returned instead of copies of records.
+        .. versionadded:: 0.7
+
     Returns
     -------
     mol1_atoms, mol2_atoms : atom_dict-type numpy array
@@ -339,38 +666,46 @@ def salt_bridges(mol1, mol2, *args, **kwargs):
     """
     m1_plus, m2_minus = salt_bridge_plus_minus(mol1, mol2, *args, **kwargs)
     m2_plus, m1_minus = salt_bridge_plus_minus(mol2, mol1, *args, **kwargs)
-    return np.concatenate((m1_plus, m1_minus)), np.concatenate((m2_minus, m2_plus))
+    return _concatenate((m1_plus, m1_minus)), _concatenate((m2_minus, m2_plus))
 
 
-def hydrophobic_contacts(mol1, mol2, cutoff=4):
+def hydrophobic_contacts(mol1, mol2, cutoff=4, return_index=False):
     """Calculates hydrophobic contacts between molecules
 
     Parameters
     ----------
-    mol1, mol2 : oddt.toolkit.Molecule object
+    mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
         Molecules to compute hydrophobe pairs
 
     cutoff : float, (default=4)
         Distance cutoff for hydrophobe pairs
 
+    return_index : bool (default=False)
+        If True, `DictIndex` arrays (integer rows of atom_dict or ring_dict
+        with lazy column access) are returned instead of copies of records.
+        .. versionadded:: 0.7
+
     Returns
     -------
     mol1_atoms, mol2_atoms : atom_dict-type numpy array
         Aligned arrays of atoms forming hydrophobic contacts
 
     """
-    h1, h2 = close_contacts(mol1.atom_dict[mol1.atom_dict['ishydrophobe']],
-                            mol2.atom_dict[mol2.atom_dict['ishydrophobe']],
-                            cutoff)
-    return h1, h2
+    h1, h1_tree = _atoms(mol1, 'ishydrophobe')
+    h2, h2_tree = _atoms(mol2, 'ishydrophobe')
+    h1_idx, h2_idx = close_contacts(h1, h2, cutoff,
+                                    x_tree=h1_tree, y_tree=h2_tree,
+                                    return_index=True)
+    return (_take(mol1, h1, h1_idx, return_index),
+            _take(mol2, h2, h2_idx, return_index))
 
 
-def pi_cation(mol1, mol2, cutoff=5, tolerance=30):
+def pi_cation(mol1, mol2, cutoff=5, tolerance=30, return_index=False):
     """Returns pairs of ring-cation atoms, which meet pi-cation criteria
 
     Parameters
     ----------
-    mol1, mol2 : oddt.toolkit.Molecule object
+    mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
         Molecules to compute ring-cation pairs
 
     cutoff : float, (default=5)
@@ -380,6 +715,11 @@ def pi_cation(mol1, mol2, cutoff=5, tolerance=30):
         Range (+/- tolerance) from perfect direction (perpendicular)
         in which pi-cation are considered as strict.
 
+    return_index : bool (default=False)
+        If True, `DictIndex` arrays (integer rows of atom_dict or ring_dict
+        with lazy column access) are returned instead of copies of records.
+        .. versionadded:: 0.7
+
     Returns
     -------
     r1 : ring_dict-type numpy array
@@ -394,25 +734,40 @@ def pi_cation(mol1, mol2, cutoff=5, tolerance=30):
         therefore the interaction is 'crude'.
 
     """
-    r1, plus2 = close_contacts(mol1.ring_dict,
-                               mol2.atom_dict[mol2.atom_dict['isplus']],
-                               cutoff,
-                               x_column='centroid')
-    if len(r1) > 0 and len(plus2) > 0:
-        angle1 = angle_2v(r1['vector'], plus2['coords'] - r1['centroid'])
+    r1, r1_tree = _rings(mol1)
+    plus2, plus2_tree = _atoms(mol2, 'isplus')
+    r1_idx, plus2_idx = close_contacts(r1,
+                                       plus2,
+                                       cutoff,
+                                       x_column='centroid',
+                                       x_tree=r1_tree,
+                                       y_tree=plus2_tree,
+                                       return_index=True)
+    r1 = _take(mol1, r1, r1_idx, return_index)
+    plus2 = _take(mol2, plus2, plus2_idx, return_index)
+    return r1, plus2, _pi_atom_strict(r1['centroid'], r1['vector'],
+                                      plus2['coords'], tolerance)
+
+
+def _pi_atom_strict(r_centroid, r_vector, a_coords, tolerance):
+    """Angular criteria for aligned ring-atom pairs (pi-cation, pi-metal),
+    the atom has to be placed perpendicularly to the ring"""
+    if len(r_centroid) > 0 and len(a_coords) > 0:
+        angle1 = angle_2v(r_vector, a_coords - r_centroid)
         strict = (angle1 > 180 - tolerance) | (angle1 < tolerance)
-        return r1, plus2, strict
+        return strict
     else:
-        return r1, plus2, np.array([], dtype=bool)
+        return np.array([], dtype=bool)
 
 
-def acceptor_metal(mol1, mol2, base_angle=120, tolerance=30, cutoff=4):
+def acceptor_metal(mol1, mol2, base_angle=120, tolerance=30, cutoff=4,
+                   return_index=False):
     """Returns pairs of acceptor-metal atoms, which meet metal coordination criteria
     Note: This function is directional (mol1 holds acceptors, mol2 holds metals)
 
     Parameters
     ----------
-    mol1, mol2 : oddt.toolkit.Molecule object
+    mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
         Molecules to compute acceptor and metal pairs
 
     cutoff : float, (default=4)
@@ -427,6 +782,11 @@ def acceptor_metal(mol1, mol2, base_angle=120, tolerance=30, cutoff=4):
         Range (+/- tolerance) from perfect direction (base_angle/n_neighbors)
         in metal coordination are considered as strict.
 
+    return_index : bool (default=False)
+        If True, `DictIndex` arrays (integer rows of atom_dict or ring_dict
+        with lazy column access) are returned instead of copies of records.
+        .. versionadded:: 0.7
+
     Returns
     -------
     a, d : atom_dict-type numpy array
@@ -439,28 +799,38 @@ def acceptor_metal(mol1, mol2, base_angle=120, tolerance=30, cutoff=4):
         If false, only distance cutoff is met, therefore the interaction
         is 'crude'.
     """
-    a, m = close_contacts(mol1.atom_dict[mol1.atom_dict['isacceptor']],
-                          mol2.atom_dict[mol2.atom_dict['ismetal']],
-                          cutoff)
+    a, a_tree = _atoms(mol1, 'isacceptor')
+    m, m_tree = _atoms(mol2, 'ismetal')
+    a_idx, m_idx = close_contacts(a, m, cutoff, x_tree=a_tree, y_tree=m_tree,
+                                  return_index=True)
+    a = _take(mol1, a, a_idx, return_index)
+    m = _take(mol2, m, m_idx, return_index)
+    return a, m, _acceptor_metal_strict(a['coords'], a['neighbors'],
+                                        m['coords'], base_angle, tolerance)
+
+
+def _acceptor_metal_strict(a_coords, a_neighbors, m_coords, base_angle,
+                           tolerance):
+    """Angular metal coordination criteria for aligned acceptor-metal pairs"""
     # skip empty values
-    if len(a) > 0 and len(m) > 0:
-        angle1 = angle(m['coords'][:, np.newaxis, :],
-                       a['coords'][:, np.newaxis, :],
-                       a['neighbors'])
-        a_neighbors_num = np.sum(~np.isnan(a['neighbors'][:, :, 0]), axis=-1)[:, np.newaxis]
+    if len(a_coords) > 0 and len(m_coords) > 0:
+        angle1 = angle(m_coords[:, np.newaxis, :],
+                       a_coords[:, np.newaxis, :],
+                       a_neighbors)
+        a_neighbors_num = np.sum(~np.isnan(a_neighbors[:, :, 0]), axis=-1)[:, np.newaxis]
         strict = ((np.nan_to_num(angle1) > (base_angle / a_neighbors_num - tolerance)) |
                   np.isnan(angle1)).all(axis=-1)
-        return a, m, strict
+        return strict
     else:
-        return a, m, np.array([], dtype=bool)
+        return np.array([], dtype=bool)
 
 
-def pi_metal(mol1, mol2, cutoff=5, tolerance=30):
+def pi_metal(mol1, mol2, cutoff=5, tolerance=30, return_index=False):
     """Returns pairs of ring-metal atoms, which meet pi-metal criteria
 
     Parameters
     ----------
-    mol1, mol2 : oddt.toolkit.Molecule object
+    mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
         Molecules to compute ring-metal pairs
 
     cutoff : float, (default=5)
@@ -470,6 +840,11 @@ def pi_metal(mol1, mol2, cutoff=5, tolerance=30):
         Range (+/- tolerance) from perfect direction (perpendicular)
         in which pi-metal are considered as strict.
 
+    return_index : bool (default=False)
+        If True, `DictIndex` arrays (integer rows of atom_dict or ring_dict
+        with lazy column access) are returned instead of copies of records.
+        .. versionadded:: 0.7
+
     Returns
     -------
     r1 : ring_dict-type numpy array
@@ -484,13 +859,582 @@ def pi_metal(mol1, mol2, cutoff=5, tolerance=30):
         therefore the interaction is 'crude'.
 
     """
-    r1, m = close_contacts(mol1.ring_dict,
-                           mol2.atom_dict[mol2.atom_dict['ismetal']],
-                           cutoff,
-                           x_column='centroid')
-    if len(r1) > 0 and len(m) > 0:
-        angle1 = angle_2v(r1['vector'], m['coords'] - r1['centroid'])
-        strict = (angle1 > 180 - tolerance) | (angle1 < tolerance)
-        return r1, m, strict
+    r1, r1_tree = _rings(mol1)
+    m, m_tree = _atoms(mol2, 'ismetal')
+    r1_idx, m_idx = close_contacts(r1,
+                                   m,
+                                   cutoff,
+                                   x_column='centroid',
+                                   x_tree=r1_tree,
+                                   y_tree=m_tree,
+                                   return_index=True)
+    r1 = _take(mol1, r1, r1_idx, return_index)
+    m = _take(mol2, m, m_idx, return_index)
+    return r1, m, _pi_atom_strict(r1['centroid'], r1['vector'],
+                                  m['coords'], tolerance)
+
+
+class interaction_profile(object):
+    def __init__(self, ligand, protein, cutoff=4, ring_cutoff=5):
+        """Interaction profile of a ligand-protein pair. A single neighbor
+        search is made between all atoms of both molecules (rings are
+        searched separately, only if needed), then all interaction types are
+        derived from it. Methods of the profile mirror interaction functions of this
+        module (`hbonds`, `pi_stacking`, etc.) and return exactly the same
+        results, but molecules passed to them must be the ligand or the
+        protein of the profile (in any order).
+
+        .. versionadded:: 0.7
+
+        Parameters
+        ----------
+        ligand, protein : oddt.toolkit.Molecule object or ReceptorIndex
+            Molecules to compute interactions between.
+
+        cutoff : float (default=4)
+            The largest cutoff of atom-atom interactions which can be
+            derived from the profile.
+
+        ring_cutoff : float (default=5)
+            The largest cutoff of interactions involving rings
+            (pi-stacking, pi-cation, pi-metal).
+
+        Examples
+        --------
+        >>> profile = interaction_profile(ligand, protein)
+        >>> a, d, strict = profile.hbond_acceptor_donor(protein, ligand)
+        >>> r1, r2, parallel, perpendicular = profile.pi_stacking(ligand, protein)
+        """
+        self.ligand = ligand
+        self.protein = protein
+        self.cutoff = cutoff
+        self.ring_cutoff = ring_cutoff
+
+        lig_dict = self.ligand.atom_dict
+        prot_dict = self.protein.atom_dict
+        prot_tree = (protein.tree('all')
+                     if isinstance(protein, ReceptorIndex) else None)
+        # pairs of ligand and protein atoms, ordered by ligand atom
+        self._atom_pairs = close_pairs(lig_dict['coords'],
+                                       prot_dict['coords'],
+                                       cutoff,
+                                       y_tree=prot_tree)
+        self._atom_dist = self._pair_distance(lig_dict['coords'],
+                                              prot_dict['coords'],
+                                              self._atom_pairs)
+
+        # ring searches are done lazily, on first use
+        self._ring_pairs = None
+        self._ring_atom_pairs = {}
+
+    def _get_ring_pairs(self):
+        if self._ring_pairs is None:
+            prot_rings, prot_rings_tree = _rings(self.protein)
+            self._ring_pairs = close_pairs(self.ligand.ring_dict['centroid'],
+                                           prot_rings['centroid'],
+                                           self.ring_cutoff,
+                                           y_tree=prot_rings_tree)
+        return self._ring_pairs
+
+    def _get_ring_atom_pairs(self, role):
+        """Pairs of rings of one molecule and atoms of the other"""
+        if role not in self._ring_atom_pairs:
+            if role == 'ligand':
+                prot_tree = (self.protein.tree('all')
+                             if isinstance(self.protein, ReceptorIndex)
+                             else None)
+                index = close_pairs(self.ligand.ring_dict['centroid'],
+                                    self.protein.atom_dict['coords'],
+                                    self.ring_cutoff,
+                                    y_tree=prot_tree)
+            else:
+                prot_rings, prot_rings_tree = _rings(self.protein)
+                index = close_pairs(prot_rings['centroid'],
+                                    self.ligand.atom_dict['coords'],
+                                    self.ring_cutoff,
+                                    x_tree=prot_rings_tree)
+            self._ring_atom_pairs[role] = index
+        return self._ring_atom_pairs[role]
+
+    @staticmethod
+    def _pair_distance(x, y, index):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        return np.sqrt(((x[index[:, 0]] - y[index[:, 1]]) ** 2).sum(axis=-1))
+
+    def _role(self, mol):
+        if mol is self.ligand:
+            return 'ligand'
+        elif mol is self.protein:
+            return 'protein'
+        raise ValueError('Molecule "%s" is not a part of this interaction '
+                         'profile.' % mol)
+
+    @staticmethod
+    def _mask(atom_dict, selection):
+        if isinstance(selection, np.ndarray):
+            return selection
+        if selection in _ATOM_SELECTIONS:
+            return _ATOM_SELECTIONS[selection](atom_dict)
+        return atom_dict[selection]
+
+    def atom_pairs(self, mol1, mol2, cutoff, selection1='all',
+                   selection2='all', cutoff_low=0., return_index=False):
+        """Returns aligned atoms of mol1 and mol2 which are within the
+        cutoff, as `close_contacts` would on selected atoms.
+
+        Parameters
+        ----------
+        mol1, mol2 : oddt.toolkit.Molecule object or ReceptorIndex
+            Ligand and protein of the profile, in any order.
+
+        cutoff : float
+            Cutoff distance for close contacts, not larger than the cutoff of
+            the profile.
+
+        selection1, selection2 : str or numpy array, dtype=bool (default='all')
+            Atoms of each molecule to use: name of boolean column of
+            atom_dict, 'all', 'heavy', 'heavy_nohoh' or a custom mask.
+
+        cutoff_low : float (default=0.)
+            Lower bound of contacts to find (exclusive).
+
+        return_index : bool (default=False)
+            If True, `DictIndex` arrays are returned instead of copies of
+            atom_dict records.
+
+        Returns
+        -------
+        x_, y_ : atom_dict-type numpy array
+            Aligned pairs of atoms in close contact.
+        """
+        if cutoff > self.cutoff:
+            raise ValueError('Cutoff %s is larger than the one used to build '
+                             'the profile (%s).' % (cutoff, self.cutoff))
+        role1 = self._role(mol1)
+        self._role(mol2)
+        lig_dict = self.ligand.atom_dict
+        prot_dict = self.protein.atom_dict
+        if role1 == 'ligand':
+            lig_mask = self._mask(lig_dict, selection1)
+            prot_mask = self._mask(prot_dict, selection2)
+        else:
+            lig_mask = self._mask(lig_dict, selection2)
+            prot_mask = self._mask(prot_dict, selection1)
+        lig_idx, prot_idx = self._atom_pairs.T
+        mask = (lig_mask[lig_idx] & prot_mask[prot_idx] &
+                (self._atom_dist > cutoff_low) & (self._atom_dist <= cutoff))
+        lig_idx = lig_idx[mask]
+        prot_idx = prot_idx[mask]
+        if role1 == 'ligand':
+            return (self._rows(lig_dict, lig_idx, return_index),
+                    self._rows(prot_dict, prot_idx, return_index))
+        # order pairs by protein atoms, as close_contacts does
+        order = np.lexsort((lig_idx, prot_idx))
+        return (self._rows(prot_dict, prot_idx[order], return_index),
+                self._rows(lig_dict, lig_idx[order], return_index))
+
+    @staticmethod
+    def _rows(source, index, return_index):
+        return DictIndex(index, source) if return_index else source[index]
+
+    def _ring_atom_pairs_within(self, mol1, mol2, cutoff, selection,
+                                return_index=False):
+        if cutoff > self.ring_cutoff:
+            raise ValueError('Cutoff %s is larger than the one used to build '
+                             'the profile (%s).' % (cutoff, self.ring_cutoff))
+        role1 = self._role(mol1)
+        self._role(mol2)
+        rings = mol1.ring_dict
+        atom_dict = mol2.atom_dict
+        index = self._get_ring_atom_pairs(role1)
+        dist = self._pair_distance(rings['centroid'], atom_dict['coords'], index)
+        index = index[self._mask(atom_dict, selection)[index[:, 1]] &
+                      (dist <= cutoff)]
+        return (self._rows(rings, index[:, 0], return_index),
+                self._rows(atom_dict, index[:, 1], return_index))
+
+    def hbond_acceptor_donor(self, mol1, mol2, cutoff=3.5, base_angle=120,
+                             tolerance=30, return_index=False):
+        """See `oddt.interactions.hbond_acceptor_donor`"""
+        a, d = self.atom_pairs(mol1, mol2, cutoff, 'isacceptor', 'isdonor',
+                               return_index=return_index)
+        return a, d, _hbond_strict(a['coords'], a['neighbors'],
+                                   d['coords'], d['neighbors'],
+                                   base_angle, tolerance)
+
+    def hbonds(self, mol1, mol2, *args, **kwargs):
+        """See `oddt.interactions.hbonds`"""
+        a1, d1, s1 = self.hbond_acceptor_donor(mol1, mol2, *args, **kwargs)
+        a2, d2, s2 = self.hbond_acceptor_donor(mol2, mol1, *args, **kwargs)
+        return _concatenate((a1, d2)), _concatenate((d1, a2)), np.concatenate((s1, s2))
+
+    def halogenbond_acceptor_halogen(self, mol1, mol2, base_angle_acceptor=120,
+                                     base_angle_halogen=180, tolerance=30,
+                                     cutoff=4, return_index=False):
+        """See `oddt.interactions.halogenbond_acceptor_halogen`"""
+        a, h = self.atom_pairs(mol1, mol2, cutoff, 'isacceptor', 'ishalogen',
+                               return_index=return_index)
+        return a, h, _halogenbond_strict(a['coords'], a['neighbors'],
+                                         h['coords'], h['neighbors'],
+                                         base_angle_acceptor,
+                                         base_angle_halogen, tolerance)
+
+    def halogenbonds(self, mol1, mol2, **kwargs):
+        """See `oddt.interactions.halogenbonds`"""
+        a1, h1, s1 = self.halogenbond_acceptor_halogen(mol1, mol2, **kwargs)
+        a2, h2, s2 = self.halogenbond_acceptor_halogen(mol2, mol1, **kwargs)
+        return _concatenate((a1, h2)), _concatenate((h1, a2)), np.concatenate((s1, s2))
+
+    def pi_stacking(self, mol1, mol2, cutoff=5, tolerance=30,
+                    return_index=False):
+        """See `oddt.interactions.pi_stacking`"""
+        if cutoff > self.ring_cutoff:
+            raise ValueError('Cutoff %s is larger than the one used to build '
+                             'the profile (%s).' % (cutoff, self.ring_cutoff))
+        role1 = self._role(mol1)
+        self._role(mol2)
+        lig_rings = self.ligand.ring_dict
+        prot_rings = self.protein.ring_dict
+        ring_pairs = self._get_ring_pairs()
+        lig_idx, prot_idx = ring_pairs.T
+        dist = self._pair_distance(lig_rings['centroid'],
+                                   prot_rings['centroid'],
+                                   ring_pairs)
+        mask = dist <= cutoff
+        lig_idx = lig_idx[mask]
+        prot_idx = prot_idx[mask]
+        if role1 == 'ligand':
+            r1 = self._rows(lig_rings, lig_idx, return_index)
+            r2 = self._rows(prot_rings, prot_idx, return_index)
+        else:
+            order = np.lexsort((lig_idx, prot_idx))
+            r1 = self._rows(prot_rings, prot_idx[order], return_index)
+            r2 = self._rows(lig_rings, lig_idx[order], return_index)
+        return (r1, r2) + _pi_stacking_strict(r1['centroid'], r1['vector'],
+                                              r2['centroid'], r2['vector'],
+                                              tolerance)
+
+    def salt_bridge_plus_minus(self, mol1, mol2, cutoff=4, return_index=False):
+        """See `oddt.interactions.salt_bridge_plus_minus`"""
+        return self.atom_pairs(mol1, mol2, cutoff, 'isplus', 'isminus',
+                               return_index=return_index)
+
+    def salt_bridges(self, mol1, mol2, *args, **kwargs):
+        """See `oddt.interactions.salt_bridges`"""
+        m1_plus, m2_minus = self.salt_bridge_plus_minus(mol1, mol2, *args, **kwargs)
+        m2_plus, m1_minus = self.salt_bridge_plus_minus(mol2, mol1, *args, **kwargs)
+        return _concatenate((m1_plus, m1_minus)), _concatenate((m2_minus, m2_plus))
+
+    def hydrophobic_contacts(self, mol1, mol2, cutoff=4, return_index=False):
+        """See `oddt.interactions.hydrophobic_contacts`"""
+        return self.atom_pairs(mol1, mol2, cutoff, 'ishydrophobe', 'ishydrophobe',
+                               return_index=return_index)
+
+    def pi_cation(self, mol1, mol2, cutoff=5, tolerance=30, return_index=False):
+        """See `oddt.interactions.pi_cation`"""
+        r1, plus2 = self._ring_atom_pairs_within(mol1, mol2, cutoff, 'isplus',
+                                                 return_index=return_index)
+        return r1, plus2, _pi_atom_strict(r1['centroid'], r1['vector'],
+                                          plus2['coords'], tolerance)
+
+    def acceptor_metal(self, mol1, mol2, base_angle=120, tolerance=30, cutoff=4,
+                       return_index=False):
+        """See `oddt.interactions.acceptor_metal`"""
+        a, m = self.atom_pairs(mol1, mol2, cutoff, 'isacceptor', 'ismetal',
+                               return_index=return_index)
+        return a, m, _acceptor_metal_strict(a['coords'], a['neighbors'],
+                                            m['coords'], base_angle, tolerance)
+
+    def pi_metal(self, mol1, mol2, cutoff=5, tolerance=30, return_index=False):
+        """See `oddt.interactions.pi_metal`"""
+        r1, m = self._ring_atom_pairs_within(mol1, mol2, cutoff, 'ismetal',
+                                             return_index=return_index)
+        return r1, m, _pi_atom_strict(r1['centroid'], r1['vector'],
+                                      m['coords'], tolerance)
+
+
+# Types of interactions reported by `batch_interactions`, the 'type' column
+# holds an index of this tuple.
+BATCH_INTERACTION_TYPES = ('hydrophobic_contacts',
+                           'hbond_acceptor',
+                           'hbond_donor',
+                           'halogenbond_acceptor',
+                           'halogenbond_halogen',
+                           'salt_bridge_plus',
+                           'salt_bridge_minus',
+                           'acceptor_metal',
+                           'pi_stacking_parallel',
+                           'pi_stacking_perpendicular',
+                           'pi_cation_ligand_ring',
+                           'pi_cation_protein_ring',
+                           'pi_metal')
+
+_BATCH_CUTOFFS = {'hydrophobic_contacts': 4,
+                  'hbond_acceptor': 3.5,
+                  'hbond_donor': 3.5,
+                  'halogenbond_acceptor': 4,
+                  'halogenbond_halogen': 4,
+                  'salt_bridge_plus': 4,
+                  'salt_bridge_minus': 4,
+                  'acceptor_metal': 4,
+                  'pi_stacking_parallel': 5,
+                  'pi_stacking_perpendicular': 5,
+                  'pi_cation_ligand_ring': 5,
+                  'pi_cation_protein_ring': 5,
+                  'pi_metal': 5}
+
+_BATCH_DTYPE = [('pose', np.uint32),
+                ('ligand_id', np.uint32),
+                ('protein_id', np.uint32),
+                ('type', np.uint8),
+                ('strict', bool)]
+
+
+def _aromatic_ring_paths(mol):
+    """Canonic atom paths of aromatic rings, aligned with mol.ring_dict"""
+    if is_openbabel_molecule(mol):
+        # NOTE: mol.sssr is 1-based in OpenBabel
+        return [canonize_ring_path([x - 1 for x in ring._path])
+                for ring in mol.sssr if ring.IsAromatic()]
+    return [canonize_ring_path(path) for path in mol.sssr
+            if mol.Mol.GetAtomWithIdx(path[0]).GetIsAromatic()]
+
+
+def _batch_rings(ligand, coords):
+    """Ring centroids and normal vectors of all poses, computed the same way
+    as ring_dict is. Returns arrays of shape [n_poses, n_rings, 3]."""
+    paths = _aromatic_ring_paths(ligand)
+    n_poses = len(coords)
+    centroids = np.zeros((n_poses, len(paths), 3), dtype=np.float32)
+    vectors = np.zeros((n_poses, len(paths), 3), dtype=np.float32)
+    # vectorize over rings of the same size
+    for size in set(map(len, paths)):
+        ring_idx = [i for i, path in enumerate(paths) if len(path) == size]
+        atom_idx = np.array([paths[i] for i in ring_idx])
+        ring_coords = coords[:, atom_idx]
+        centroid = ring_coords.mean(axis=2)
+        ring_vectors = ring_coords - centroid[:, :, np.newaxis]
+        # ring_dict rolls flattened ring coordinates, mimic that exactly
+        shape = ring_vectors.shape
+        rolled = np.roll(ring_vectors.reshape(shape[:2] + (-1,)), 1,
+                         axis=-1).reshape(shape)
+        centroids[:, ring_idx] = centroid
+        vectors[:, ring_idx] = np.cross(ring_vectors, rolled).mean(axis=2)
+    return centroids, vectors
+
+
+def batch_interactions(ligand, coords, protein, cutoffs=None, tolerance=30):
+    """Computes interactions of many poses of a single ligand with a protein.
+    All poses share the topology of the ligand (atom types, features,
+    bonds), only their coordinates differ. Neighbor searches and angular
+    criteria are vectorized across all poses.
+
+    .. versionadded:: 0.7
+
+    Parameters
+    ----------
+    ligand : oddt.toolkit.Molecule object
+        Ligand providing the topology of all poses.
+
+    coords : numpy array, shape = [n_poses, n_atoms, 3]
+        Coordinates of all atoms of the ligand (including hydrogens present
+        in the molecule) in each pose.
+
+    protein : oddt.toolkit.Molecule object or ReceptorIndex
+        Protein to compute interactions with.
+
+    cutoffs : dict or None (default=None)
+        Distance cutoffs overriding defaults of particular interaction types
+        (keys of `BATCH_INTERACTION_TYPES`). Defaults match the ones of
+        corresponding interaction functions.
+
+    tolerance : int, (default=30)
+        Angular tolerance used for strict interactions (see interaction
+        functions). Base angles are the defaults of interaction functions.
+
+    Returns
+    -------
+    interactions : numpy array
+        Structured array ordered by pose, with columns:
+            - pose - index of the pose
+            - ligand_id - ligand atom id, or index in ring_dict for
+              interactions of ligand rings (pi-stacking, pi-cation with
+              ligand ring, pi-metal)
+            - protein_id - protein atom id, or index in ring_dict for
+              interactions of protein rings (pi-stacking, pi-cation with
+              protein ring)
+            - type - index of interaction type in `BATCH_INTERACTION_TYPES`.
+              Types are named after the role of the ligand, i.e.
+              'hbond_acceptor' is `hbond_acceptor_donor(ligand, protein)`
+              and 'hbond_donor' is `hbond_acceptor_donor(protein, ligand)`.
+            - strict - whether angular criteria are met (always True for
+              interactions without them)
+        Each pose yields the same pairs as interaction functions applied to
+        the ligand with its coordinates.
+    """
+    batch_cutoffs = dict(_BATCH_CUTOFFS)
+    if cutoffs is not None:
+        unknown = set(cutoffs) - set(batch_cutoffs)
+        if unknown:
+            raise ValueError('Unknown interaction types: %s'
+                             % ', '.join(sorted(unknown)))
+        batch_cutoffs.update(cutoffs)
+
+    lig_dict = ligand.atom_dict
+    coords = np.asarray(coords, dtype=np.float32)
+    if coords.ndim == 2:
+        coords = coords[np.newaxis]
+    if coords.ndim != 3 or coords.shape[1:] != (len(lig_dict), 3):
+        raise ValueError('Coordinates of shape [n_poses, %i, 3] were expected, '
+                         'got %s.' % (len(lig_dict), coords.shape))
+    n_poses, n_atoms = coords.shape[:2]
+    flat_coords = coords.reshape(-1, 3)
+
+    prot_dict = protein.atom_dict
+    prot_rings = protein.ring_dict
+    if isinstance(protein, ReceptorIndex):
+        prot_tree = protein.tree('all')
+        prot_rings_tree = protein.tree('rings')
     else:
-        return r1, m, np.array([], dtype=bool)
+        prot_tree = prot_rings_tree = None
+
+    lig_nbr_mask = ~np.isnan(lig_dict['neighbors'][:, :, 0])
+
+    def lig_neighbors(pose, atom):
+        """Neighbors coordinates of ligand atoms in given poses"""
+        nbr_coords = coords[pose[:, np.newaxis], lig_dict['neighbors_id'][atom]]
+        nbr_coords[~lig_nbr_mask[atom]] = np.nan
+        return nbr_coords
+
+    out = []
+
+    def add(type_name, pose, lig_id, prot_id, strict):
+        table = np.zeros(len(pose), dtype=_BATCH_DTYPE)
+        table['pose'] = pose
+        table['ligand_id'] = lig_id
+        table['protein_id'] = prot_id
+        table['type'] = BATCH_INTERACTION_TYPES.index(type_name)
+        table['strict'] = strict
+        out.append(table)
+
+    # atom-atom interactions
+    atom_types = ('hydrophobic_contacts', 'hbond_acceptor', 'hbond_donor',
+                  'halogenbond_acceptor', 'halogenbond_halogen',
+                  'salt_bridge_plus', 'salt_bridge_minus', 'acceptor_metal')
+    index = close_pairs(flat_coords, prot_dict['coords'],
+                        max(batch_cutoffs[t] for t in atom_types),
+                        y_tree=prot_tree)
+    pose, lig_idx = np.divmod(index[:, 0], n_atoms)
+    prot_idx = index[:, 1]
+    dist = np.sqrt(((flat_coords[index[:, 0]].astype(np.float64) -
+                     prot_dict['coords'][prot_idx]) ** 2).sum(axis=-1))
+
+    def select(type_name, lig_field, prot_field):
+        mask = (lig_dict[lig_field][lig_idx] & prot_dict[prot_field][prot_idx] &
+                (dist <= batch_cutoffs[type_name]))
+        return pose[mask], lig_idx[mask], prot_idx[mask]
+
+    poses, lig, prot = select('hydrophobic_contacts',
+                              'ishydrophobe', 'ishydrophobe')
+    add('hydrophobic_contacts', poses, lig, prot_dict['id'][prot], True)
+
+    poses, lig, prot = select('hbond_acceptor', 'isacceptor', 'isdonor')
+    strict = _hbond_strict(coords[poses, lig], lig_neighbors(poses, lig),
+                           prot_dict['coords'][prot],
+                           prot_dict['neighbors'][prot],
+                           120, tolerance)
+    add('hbond_acceptor', poses, lig, prot_dict['id'][prot], strict)
+
+    poses, lig, prot = select('hbond_donor', 'isdonor', 'isacceptor')
+    strict = _hbond_strict(prot_dict['coords'][prot],
+                           prot_dict['neighbors'][prot],
+                           coords[poses, lig], lig_neighbors(poses, lig),
+                           120, tolerance)
+    add('hbond_donor', poses, lig, prot_dict['id'][prot], strict)
+
+    poses, lig, prot = select('halogenbond_acceptor',
+                              'isacceptor', 'ishalogen')
+    strict = _halogenbond_strict(coords[poses, lig], lig_neighbors(poses, lig),
+                                 prot_dict['coords'][prot],
+                                 prot_dict['neighbors'][prot],
+                                 120, 180, tolerance)
+    add('halogenbond_acceptor', poses, lig, prot_dict['id'][prot], strict)
+
+    poses, lig, prot = select('halogenbond_halogen', 'ishalogen', 'isacceptor')
+    strict = _halogenbond_strict(prot_dict['coords'][prot],
+                                 prot_dict['neighbors'][prot],
+                                 coords[poses, lig], lig_neighbors(poses, lig),
+                                 120, 180, tolerance)
+    add('halogenbond_halogen', poses, lig, prot_dict['id'][prot], strict)
+
+    poses, lig, prot = select('salt_bridge_plus', 'isplus', 'isminus')
+    add('salt_bridge_plus', poses, lig, prot_dict['id'][prot], True)
+
+    poses, lig, prot = select('salt_bridge_minus', 'isminus', 'isplus')
+    add('salt_bridge_minus', poses, lig, prot_dict['id'][prot], True)
+
+    poses, lig, prot = select('acceptor_metal', 'isacceptor', 'ismetal')
+    strict = _acceptor_metal_strict(coords[poses, lig],
+                                    lig_neighbors(poses, lig),
+                                    prot_dict['coords'][prot], 120, tolerance)
+    add('acceptor_metal', poses, lig, prot_dict['id'][prot], strict)
+
+    # interactions of ligand rings
+    centroids, vectors = _batch_rings(ligand, coords)
+    n_rings = centroids.shape[1]
+    flat_centroids = centroids.reshape(-1, 3)
+    flat_vectors = vectors.reshape(-1, 3)
+    if n_rings:
+        # ring-ring
+        stacking_types = ('pi_stacking_parallel', 'pi_stacking_perpendicular')
+        index = close_pairs(flat_centroids, prot_rings['centroid'],
+                            max(batch_cutoffs[t] for t in stacking_types),
+                            y_tree=prot_rings_tree)
+        dist = np.sqrt(((flat_centroids[index[:, 0]].astype(np.float64) -
+                         prot_rings['centroid'][index[:, 1]]) ** 2).sum(axis=-1))
+        parallel, perpendicular = _pi_stacking_strict(
+            flat_centroids[index[:, 0]], flat_vectors[index[:, 0]],
+            prot_rings['centroid'][index[:, 1]],
+            prot_rings['vector'][index[:, 1]], tolerance)
+        poses, lig = np.divmod(index[:, 0], n_rings)
+        for type_name, strict in zip(stacking_types, (parallel, perpendicular)):
+            mask = dist <= batch_cutoffs[type_name]
+            add(type_name, poses[mask], lig[mask], index[mask, 1],
+                strict[mask])
+
+        # ring-atom
+        index = close_pairs(flat_centroids, prot_dict['coords'],
+                            max(batch_cutoffs['pi_cation_ligand_ring'],
+                                batch_cutoffs['pi_metal']),
+                            y_tree=prot_tree)
+        dist = np.sqrt(((flat_centroids[index[:, 0]].astype(np.float64) -
+                         prot_dict['coords'][index[:, 1]]) ** 2).sum(axis=-1))
+        poses, lig = np.divmod(index[:, 0], n_rings)
+        for type_name, prot_field in (('pi_cation_ligand_ring', 'isplus'),
+                                      ('pi_metal', 'ismetal')):
+            mask = (prot_dict[prot_field][index[:, 1]] &
+                    (dist <= batch_cutoffs[type_name]))
+            prot = index[mask, 1]
+            strict = _pi_atom_strict(flat_centroids[index[mask, 0]],
+                                     flat_vectors[index[mask, 0]],
+                                     prot_dict['coords'][prot], tolerance)
+            add(type_name, poses[mask], lig[mask], prot_dict['id'][prot],
+                strict)
+
+    # protein rings with ligand cations
+    index = close_pairs(prot_rings['centroid'], flat_coords,
+                        batch_cutoffs['pi_cation_protein_ring'],
+                        x_tree=prot_rings_tree)
+    poses, lig = np.divmod(index[:, 1], n_atoms)
+    mask = lig_dict['isplus'][lig]
+    prot = index[mask, 0]
+    poses, lig = poses[mask], lig[mask]
+    strict = _pi_atom_strict(prot_rings['centroid'][prot],
+                             prot_rings['vector'][prot],
+                             coords[poses, lig], tolerance)
+    add('pi_cation_protein_ring', poses, lig, prot, strict)
+
+    out = np.concatenate(out)
+    # stable sort keeps the order of interaction types within a pose
+    return out[np.argsort(out['pose'], kind='mergesort')]
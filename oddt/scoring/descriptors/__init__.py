@@ -8,6 +8,8 @@ from oddt.utils import is_molecule
 from oddt.docking import autodock_vina
 from oddt.docking.internal import vina_docking
 from oddt.fingerprints import sparse_to_csr_matrix
+from oddt.interactions import ReceptorIndex
+from oddt.spatial import close_pairs
 import re
 
 # ProDy
@@ -53,6 +55,30 @@ def atoms_by_type(atom_dict, types, mode='atomic_nums'):
         A dictionary of queried atom types (types are keys of the dictionary).
         Values are of oddt.toolkit.Molecule.atom_dict type.
     """
+    return {t: atom_dict[mask]
+            for t, mask in atom_masks_by_type(atom_dict, types, mode).items()}
+
+
+def atom_masks_by_type(atom_dict, types, mode='atomic_nums'):
+    """Returns boolean masks of atoms based on given criteria, as used in
+    `atoms_by_type`.
+
+    .. versionadded:: 0.7
+
+    Parameters
+    ----------
+    atom_dict: oddt.toolkit.Molecule.atom_dict
+        Atom dictionary as implemeted in oddt.toolkit.Molecule class
+
+    types: array-like
+        List of atom types/numbers wanted.
+
+    Returns
+    -------
+    out: dictionary of shape=[len(types)]
+        A dictionary of queried atom types (types are keys of the dictionary).
+        Values are boolean masks of atom_dict.
+    """
 
     ad4_to_atomicnum = {
         'HD': 1, 'C': 6, 'CD': 6, 'A': 6, 'N': 7, 'NA': 7, 'OA': 8, 'F': 9,
@@ -61,10 +87,10 @@ def atoms_by_type(atom_dict, types, mode='atomic_nums'):
     }
 
     if mode == 'atomic_nums':
-        return {num: atom_dict[atom_dict['atomicnum'] == num]
+        return {num: atom_dict['atomicnum'] == num
                 for num in set(types)}
     elif mode == 'atom_types_sybyl':
-        return {t: atom_dict[atom_dict['atomtype'] == t]
+        return {t: atom_dict['atomtype'] == t
                 for t in set(types)}
     elif mode == 'atom_types_ad4':
         # all AD4 atom types are capitalized
@@ -90,7 +116,7 @@ def atoms_by_type(atom_dict, types, mode='atomic_nums'):
                 elif t in ('NA', 'OA', 'SA'):
                     constraints &= atom_dict['isacceptor']
 
-                out[t] = atom_dict[constraints]
+                out[t] = constraints
 
             else:
                 raise ValueError('Unsopported atom type: %s' % t)
@@ -163,6 +189,21 @@ class close_contacts_descriptor(object):
                            for c1, c2 in self.cutoff
                            ]
 
+    def _local_protein_dict(self, mol):
+        """Protein atoms within the maximum cutoff from any ligand atom"""
+        if isinstance(self.protein, ReceptorIndex):
+            # cutoff_low < 0 keeps overlapping atoms, as in <= cutoff
+            index = close_pairs(mol.atom_dict['coords'],
+                                self.protein.atom_dict['coords'],
+                                self.cutoff.max(),
+                                cutoff_low=-1.,
+                                y_tree=self.protein.tree('all'))
+            return self.protein.atom_dict[np.unique(index[:, 1])]
+        dist = distance(self.protein.atom_dict['coords'],
+                        mol.atom_dict['coords'])
+        within_cutoff = (dist <= self.cutoff.max()).any(axis=1)
+        return self.protein.atom_dict[within_cutoff]
+
     def build(self, ligands, protein=None):
         """Builds descriptors for series of ligands
 
@@ -172,7 +213,7 @@ class close_contacts_descriptor(object):
             A list or iterable of ligands to build the descriptor or a
             single molecule.
 
-        protein: oddt.toolkit.Molecule or None (default=None)
+        protein: oddt.toolkit.Molecule, ReceptorIndex or None (default=None)
             Default protein to use as reference
 
         """
@@ -190,10 +231,7 @@ class close_contacts_descriptor(object):
                          for mol_type in self.ligand_types
                          for prot_type in self.protein_types]
 
-            dist = distance(self.protein.atom_dict['coords'],
-                            mol.atom_dict['coords'])
-            within_cutoff = (dist <= self.cutoff.max()).any(axis=1)
-            local_protein_dict = self.protein.atom_dict[within_cutoff]
+            local_protein_dict = self._local_protein_dict(mol)
 
             prot_dict = atoms_by_type(local_protein_dict, self.protein_types,
                                       self.mode)
@@ -244,10 +282,7 @@ class close_contacts_descriptor(object):
                          for mol_type in self.ligand_types
                          for prot_type in self.protein_types]
 
-            dist = distance(self.protein.atom_dict['coords'],
-                            mol.atom_dict['coords'])
-            within_cutoff = (dist <= self.cutoff.max()).any(axis=1)
-            local_protein_dict = self.protein.atom_dict[within_cutoff]
+            local_protein_dict = self._local_protein_dict(mol)
 
             prot_dict = atoms_by_type(local_protein_dict, self.protein_types,
                                       self.mode)
@@ -314,10 +349,7 @@ class close_contacts_descriptor(object):
                          for mol_type in self.ligand_types
                          for prot_type in self.protein_types]
 
-            dist = distance(self.protein.atom_dict['coords'],
-                            mol.atom_dict['coords'])
-            within_cutoff = (dist <= self.cutoff.max()).any(axis=1)
-            local_protein_dict = self.protein.atom_dict[within_cutoff]
+            local_protein_dict = self._local_protein_dict(mol)
 
             prot_dict = atoms_by_type(local_protein_dict, self.protein_types,
                                       self.mode)
@@ -381,10 +413,7 @@ class close_contacts_descriptor(object):
                          for mol_type in self.ligand_types
                          for prot_type in self.protein_types]
 
-            dist = distance(self.protein.atom_dict['coords'],
-                            mol.atom_dict['coords'])
-            within_cutoff = (dist <= self.cutoff.max()).any(axis=1)
-            local_protein_dict = self.protein.atom_dict[within_cutoff]
+            local_protein_dict = self._local_protein_dict(mol)
 
             prot_dict = atoms_by_type(local_protein_dict, self.protein_types,
                                       self.mode)
@@ -443,10 +472,7 @@ class close_contacts_descriptor(object):
                          for mol_type in self.ligand_types
                          for prot_type in self.protein_types]
 
-            dist = distance(self.protein.atom_dict['coords'],
-                            mol.atom_dict['coords'])
-            within_cutoff = (dist <= self.cutoff.max()).any(axis=1)
-            local_protein_dict = self.protein.atom_dict[within_cutoff]
+            local_protein_dict = self._local_protein_dict(mol)
 
             prot_dict = atoms_by_type(local_protein_dict, self.protein_types,
                                       self.mode)
@@ -531,10 +557,7 @@ class close_contacts_descriptor(object):
                          for mol_type in self.ligand_types
                          for prot_type in self.protein_types]
 
-            dist = distance(self.protein.atom_dict['coords'],
-                            mol.atom_dict['coords'])
-            within_cutoff = (dist <= self.cutoff.max()).any(axis=1)
-            local_protein_dict = self.protein.atom_dict[within_cutoff]
+            local_protein_dict = self._local_protein_dict(mol)
 
             prot_dict = atoms_by_type(local_protein_dict, self.protein_types,
                                       self.mode)
@@ -629,10 +652,7 @@ class close_contacts_descriptor(object):
                          for mol_type in self.ligand_types
                          for prot_type in self.protein_types]
 
-            dist = distance(self.protein.atom_dict['coords'],
-                            mol.atom_dict['coords'])
-            within_cutoff = (dist <= self.cutoff.max()).any(axis=1)
-            local_protein_dict = self.protein.atom_dict[within_cutoff]
+            local_protein_dict = self._local_protein_dict(mol)
 
             prot_dict = atoms_by_type(local_protein_dict, self.protein_types,
                                       self.mode)
@@ -685,10 +705,7 @@ class close_contacts_descriptor(object):
                          for mol_type in self.ligand_types
                          for prot_type in self.protein_types]
 
-            dist = distance(self.protein.atom_dict['coords'],
-                            mol.atom_dict['coords'])
-            within_cutoff = (dist <= self.cutoff.max()).any(axis=1)
-            local_protein_dict = self.protein.atom_dict[within_cutoff]
+            local_protein_dict = self._local_protein_dict(mol)
 
             prot_dict = atoms_by_type(local_protein_dict, self.protein_types,
                                       self.mode)
@@ -746,10 +763,7 @@ class close_contacts_descriptor(object):
                          for mol_type in self.ligand_types
                          for prot_type in self.protein_types]
 
-            dist = distance(self.protein.atom_dict['coords'],
-                            mol.atom_dict['coords'])
-            within_cutoff = (dist <= self.cutoff.max()).any(axis=1)
-            local_protein_dict = self.protein.atom_dict[within_cutoff]
+            local_protein_dict = self._local_protein_dict(mol)
 
             prot_dict = atoms_by_type(local_protein_dict, self.protein_types,
                                       self.mode)
@@ -860,10 +874,7 @@ class close_contacts_descriptor(object):
                          for mol_type in self.ligand_types
                          for prot_type in self.protein_types]
 
-            dist = distance(self.protein.atom_dict['coords'],
-                            mol.atom_dict['coords'])
-            within_cutoff = (dist <= self.cutoff.max()).any(axis=1)
-            local_protein_dict = self.protein.atom_dict[within_cutoff]
+            local_protein_dict = self._local_protein_dict(mol)
 
             prot_dict = atoms_by_type(local_protein_dict, self.protein_types,
                                       self.mode)
@@ -966,7 +977,8 @@ class universal_descriptor(object):
                  func,
                  protein=None,
                  shape=None,
-                 sparse=False):
+                 sparse=False,
+                 index_protein=False):
         """An universal descriptor which converts a callable object (function)
         to a descriptor generator which can be used in scoring methods.
 
@@ -983,16 +995,40 @@ class universal_descriptor(object):
         protein: oddt.toolkit.Molecule or None (default=None)
             Default protein to use as reference
 
+        index_protein: bool (default=False)
+            Should the protein be passed to `func` wrapped in
+            `oddt.interactions.ReceptorIndex`, which is kept along with the
+            descriptor, so data derived from the protein is computed once.
+            The `protein` attribute still holds the molecule.
+
+            .. versionadded:: 0.7
+
         """
         self.func = func
-        self.protein = protein
         self.shape = shape
         self.sparse = sparse
+        self.index_protein = index_protein
+        self.set_protein(protein)
         if isinstance(func, partial):
             self.titles = self.func.func.__name__
         else:
             self.titles = self.func.__name__
 
+    def set_protein(self, protein):
+        """Set the default protein (and its index if `index_protein`)
+
+        Parameters
+        ----------
+        protein: oddt.toolkit.Molecule or None
+            Default protein to use as reference
+        """
+        self.protein = protein
+        if (self.index_protein and protein is not None and
+                not isinstance(protein, ReceptorIndex)):
+            self._protein_index = ReceptorIndex(protein)
+        else:
+            self._protein_index = None
+
     def build(self, ligands, protein=None):
         """Builds descriptors for series of ligands
 
@@ -1007,15 +1043,22 @@ class universal_descriptor(object):
 
         """
         if protein:
-            self.protein = protein
+            self.set_protein(protein)
+        # the protein might have been assigned directly
+        if self.index_protein and (
+                self._protein_index is None or
+                self._protein_index.mol is not self.protein):
+            self.set_protein(self.protein)
+        protein = (self.protein if self._protein_index is None
+                   else self._protein_index)
         if is_molecule(ligands):
             ligands = [ligands]
         out = []
         for mol in ligands:
-            if self.protein is None:
+            if protein is None:
                 out.append(self.func(mol))
             else:
-                out.append(self.func(mol, protein=self.protein))
+                out.append(self.func(mol, protein=protein))
         if self.sparse:
             # out = list(map(partial(sparse_to_csr_matrix, size=self.shape), out))
             return sparse_vstack(map(partial(sparse_to_csr_matrix,
@@ -1032,8 +1075,11 @@ class universal_descriptor(object):
             return self.shape
 
     def __reduce__(self):
-        return universal_descriptor, (self.func, self.protein, self.shape,
-                                      self.sparse)
+        # the index is pickled along with its cached data
+        args = (self.func, self.protein, self.shape, self.sparse,
+                self.index_protein)
+        return (universal_descriptor, args,
+                {'_protein_index': self._protein_index})
 
 
 # TODO: we don't use toolkit. should we?
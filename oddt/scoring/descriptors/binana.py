@@ -5,10 +5,10 @@
 
 import numpy as np
 from oddt.scoring.descriptors import (atoms_by_type,
+                                      atom_masks_by_type,
                                       close_contacts_descriptor,
                                       oddt_vina_descriptor)
-from oddt.interactions import (close_contacts, hbonds, hydrophobic_contacts,
-                               pi_cation, pi_stacking, salt_bridges)
+from oddt.interactions import ReceptorIndex, interaction_profile
 
 
 class binana_descriptor(object):
@@ -18,9 +18,14 @@ class binana_descriptor(object):
         Parameters
         ----------
         protein: oddt.toolkit.Molecule object (default=None)
-            Protein object to be used while generating descriptors.
+            Protein object to be used while generating descriptors. It is
+            indexed with `oddt.interactions.ReceptorIndex` to speed up
+            computation of descriptors for many ligands.
         """
         self.protein = protein
+        if protein is not None:
+            protein = ReceptorIndex(protein)
+        self._protein_index = protein
         self.titles = []
         self.vina = oddt_vina_descriptor(protein, vina_scores=['vina_gauss1',
                                                                'vina_gauss2',
@@ -189,6 +194,9 @@ class binana_descriptor(object):
             Protein becomes new global and default protein.
         """
         self.protein = protein
+        if protein is not None:
+            protein = ReceptorIndex(protein)
+        self._protein_index = protein
         self.vina.set_protein(protein)
         self.cc_4.protein = protein
         self.cc_25.protein = protein
@@ -213,12 +221,13 @@ class binana_descriptor(object):
         """
         if protein:
             self.set_protein(protein)
-        else:
-            protein = self.protein
-        protein_dict = protein.atom_dict
+        protein = self._protein_index
         desc = None
         for mol in ligands:
             mol_dict = mol.atom_dict
+            # all interactions are derived from a single neighbor search
+            profile = interaction_profile(mol, protein, cutoff=5.5,
+                                          ring_cutoff=7.5)
             vec = np.array([], dtype=float)
             vec = tuple()
             # Vina
@@ -231,11 +240,17 @@ class binana_descriptor(object):
 
             # Electrostatics (<4A)
             ele_rec_types, ele_lig_types = zip(*self.ele_types)
-            ele_mol_atoms = atoms_by_type(mol_dict, ele_lig_types, 'atom_types_ad4')
-            ele_rec_atoms = atoms_by_type(protein_dict, ele_rec_types, 'atom_types_ad4')
+            ele_mol_masks = atom_masks_by_type(mol_dict, ele_lig_types,
+                                               'atom_types_ad4')
+            if 'binana_ele_masks' not in protein.cache:
+                protein.cache['binana_ele_masks'] = atom_masks_by_type(
+                    protein.atom_dict, ele_rec_types, 'atom_types_ad4')
+            ele_rec_masks = protein.cache['binana_ele_masks']
             ele = tuple()
             for r_t, m_t in self.ele_types:
-                mol_ele_dict, rec_ele_dict = close_contacts(ele_mol_atoms[m_t], ele_rec_atoms[r_t], 4)
+                mol_ele_dict, rec_ele_dict = profile.atom_pairs(
+                    mol, protein, 4, ele_mol_masks[m_t], ele_rec_masks[r_t],
+                    return_index=True)
                 if len(mol_ele_dict) and len(rec_ele_dict):
                     ele += (mol_ele_dict['charge'] *
                             rec_ele_dict['charge'] /
@@ -254,7 +269,8 @@ class binana_descriptor(object):
             vec += tuple(self.cc_25.build(mol).flatten())
 
             # H-Bonds (<4A)
-            hbond_mol, hbond_rec, strict = hbonds(mol, protein, 4)
+            hbond_mol, hbond_rec, strict = profile.hbonds(mol, protein, 4,
+                                                          return_index=True)
             # Retain only strict hbonds
             hbond_mol = hbond_mol[strict]
             hbond_rec = hbond_rec[strict]
@@ -279,7 +295,8 @@ class binana_descriptor(object):
             vec += tuple(hbond_vec)
 
             # Hydrophobic contacts (<4A)
-            hydrophobic = hydrophobic_contacts(mol, protein, 4)[1]
+            hydrophobic = profile.hydrophobic_contacts(
+                mol, protein, 4, return_index=True)[1]
             backbone = hydrophobic['isbackbone']
             alpha = hydrophobic['isalpha']
             beta = hydrophobic['isbeta']
@@ -294,7 +311,8 @@ class binana_descriptor(object):
             vec += tuple(hyd_vec)
 
             # Pi-stacking (<7.5A)
-            pi_mol, pi_rec, pi_paralel, pi_tshaped = pi_stacking(mol, protein, 7.5)
+            pi_mol, pi_rec, pi_paralel, pi_tshaped = profile.pi_stacking(
+                mol, protein, 7.5, return_index=True)
             alpha = pi_rec['isalpha'] & pi_paralel
             beta = pi_rec['isbeta'] & pi_paralel
             other = ~alpha & ~beta & pi_paralel
@@ -308,13 +326,15 @@ class binana_descriptor(object):
             pi_t_vec = (alpha.sum(), beta.sum(), other.sum())
 
             # Pi-cation (<6A)
-            pi_rec, cat_mol, strict = pi_cation(protein, mol, 6)
+            pi_rec, cat_mol, strict = profile.pi_cation(protein, mol, 6,
+                                                        return_index=True)
             alpha = pi_rec['isalpha'] & strict
             beta = pi_rec['isbeta'] & strict
             other = ~alpha & ~beta & strict
             pi_cat_vec = (alpha.sum(), beta.sum(), other.sum())
 
-            pi_mol, cat_rec, strict = pi_cation(mol, protein, 6)
+            pi_mol, cat_rec, strict = profile.pi_cation(mol, protein, 6,
+                                                        return_index=True)
             alpha = cat_rec['isalpha'] & strict
             beta = cat_rec['isbeta'] & strict
             other = ~alpha & ~beta & strict
@@ -326,9 +346,9 @@ class binana_descriptor(object):
             vec += tuple(pi_t_vec)
 
             # Active site flexibility (<4A)
-            acitve_site = close_contacts(mol_dict[mol_dict['atomicnum'] != 1],
-                                         protein_dict[protein_dict['atomicnum'] != 1],
-                                         cutoff=4)[1]
+            acitve_site = profile.atom_pairs(mol, protein, 4,
+                                             'heavy', 'heavy',
+                                             return_index=True)[1]
             backbone = acitve_site['isbackbone']
             alpha = acitve_site['isalpha']
             beta = acitve_site['isbeta']
@@ -343,7 +363,8 @@ class binana_descriptor(object):
             vec += tuple(as_flex)
 
             # Salt bridges (<5.5)
-            salt_bridge_dict = salt_bridges(mol, protein, 5.5)[1]
+            salt_bridge_dict = profile.salt_bridges(
+                mol, protein, 5.5, return_index=True)[1]
             vec += (salt_bridge_dict['isalpha'].sum(),
                     salt_bridge_dict['isbeta'].sum(),
                     (~salt_bridge_dict['isalpha'] & ~salt_bridge_dict['isbeta']).sum(),
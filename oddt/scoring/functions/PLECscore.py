@@ -39,7 +39,9 @@ class PLECscore(scorer):
         Parameters
         ----------
         protein : oddt.toolkit.Molecule object
-            Receptor for the scored ligands
+            Receptor for the scored ligands. It is indexed with
+            `oddt.interactions.ReceptorIndex`, so ECFP environments of its
+            atoms are computed once for all scored ligands.
 
         n_jobs: int (default=-1)
             Number of cores to use for scoring and training. By default (-1)
@@ -80,7 +82,8 @@ class PLECscore(scorer):
                             sparse=True,
                             ignore_hoh=True)
         descriptors = universal_descriptor(plec_func, protein=protein,
-                                           shape=size, sparse=True)
+                                           shape=size, sparse=True,
+                                           index_protein=True)
 
         if version == 'linear':
             # avoid deprecation warnings
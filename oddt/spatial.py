@@ -2,9 +2,12 @@
 Mainly used by other modules, but can be accessed directly.
 """
 
-from math import sin, cos
+import weakref
+from collections import OrderedDict
+from itertools import chain
 
 import numpy as np
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 # for Hungarian algorithm, in future use scipy.optimize.linear_sum_assignment (in scipy 0.17+)
 try:
@@ -23,8 +26,28 @@ __all__ = ['angle',
            'angle_2v',
            'dihedral',
            'distance',
+           'close_pairs',
            'rmsd',
-           'rotate']
+           'rmsd_batch',
+           'rmsd_matrix',
+           'cluster_poses',
+           'rotate',
+           'rotation_matrix',
+           'axis_angle_matrix',
+           'quaternion_matrix',
+           'transform']
+
+# Minimal size of the full distance matrix (len(x) * len(y)) for which
+# `close_pairs(method='auto')` switches from brute force to a KD-tree search.
+KDTREE_MIN_PAIRS = 2 ** 16
+
+# Maximal number of topology pairs for which symmetry matches are kept by
+# `rmsd(method='min_symmetry')` and `rmsd_batch`.
+RMSD_MATCH_CACHE_SIZE = 128
+_rmsd_match_cache = OrderedDict()
+# topology keys of molecules, valid as long as the atom_dict they were
+# computed from is not rebuilt (i.e. after addh)
+_topology_keys = weakref.WeakKeyDictionary()
 
 
 def angle(p1, p2, p3):
@@ -123,7 +146,8 @@ def rmsd(ref, mol, ignore_h=True, method=None, normalize=False):
             ignoring H's)
             - hungarian - minimize RMSD using Hungarian algorithm
             - min_symmetry - makes multiple molecule-molecule matches and finds
-            minimal RMSD (the slowest). Hydrogens are ignored.
+            minimal RMSD (the slowest). Hydrogens are ignored. Matches are
+            cached per topology of both molecules.
 
     normalize : bool (default=False)
         Normalize RMSD by square root of rot. bonds
@@ -133,69 +157,364 @@ def rmsd(ref, mol, ignore_h=True, method=None, normalize=False):
     rmsd : float
         RMSD between two molecules
     """
+    return rmsd_batch(ref, mol, ignore_h=ignore_h, method=method,
+                      normalize=normalize)[0]
+
+
+def _topology_key(mol):
+    """Hashable description of atoms, charges and bonds of a molecule"""
+    atom_dict = mol.atom_dict
+    atom_dict_ref, key = _topology_keys.get(mol, (None, None))
+    if atom_dict_ref is not None and atom_dict_ref() is atom_dict:
+        return key
+    neighbors = np.where(np.isnan(atom_dict['neighbors'][..., 0]), -1,
+                         atom_dict['neighbors_id'])
+    # bond orders and formal charges change the SMARTS of the molecule,
+    # hence its matches, while keeping the connectivity
+    bonds = np.array([(bond.atoms[0].idx0, bond.atoms[1].idx0, bond.order)
+                      for bond in mol.bonds], dtype=np.float64)
+    charges = np.array([atom.formalcharge for atom in mol.atoms], dtype=int)
+    key = (is_openbabel_molecule(mol),
+           atom_dict['atomicnum'].tobytes(),
+           atom_dict['atomtype'].tobytes(),
+           atom_dict['isaromatic'].tobytes(),
+           neighbors.tobytes(),
+           bonds.tobytes(),
+           charges.tobytes())
+    _topology_keys[mol] = (weakref.ref(atom_dict), key)
+    return key
+
+
+def _symmetry_matches(ref, mol):
+    """Unique matches of reference heavy atoms onto molecule (found by
+    substructure search). Returns an array of shape [n_matches, n_heavy] of
+    molecule's atom indices, aligned with reference heavy atoms."""
+    ref_key = _topology_key(ref)
+    key = (ref_key, _topology_key(mol))
+    if key in _rmsd_match_cache:
+        # move to the end, as the most recently used
+        _rmsd_match_cache[key] = _rmsd_match_cache.pop(key)
+        return _rmsd_match_cache[key]
+
+    matches = (oddt.toolkit.smarts_registry.get(ref, key=ref_key)
+               .findall(mol, unique=False))
+    if not matches:
+        raise ValueError('Could not find any match between molecules.')
+    matches = np.array(matches, dtype=int)
+    if is_openbabel_molecule(mol):
+        matches -= 1  # OB has 1-based indices
+    heavy = mol.atom_dict['atomicnum'][matches] != 1
+    n_heavy = heavy.sum(axis=1)
+    # following should not happen, although safety check is left
+    if (n_heavy != (ref.atom_dict['atomicnum'] != 1).sum()).any():
+        raise Exception('Molecular match got wrong number of atoms.')
+    # permutations of hydrogens yield the same heavy atom matches
+    matches = matches[heavy].reshape(len(matches), -1)
+    matches = np.array(sorted(set(map(tuple, matches))), dtype=int)
+
+    _rmsd_match_cache[key] = matches
+    if len(_rmsd_match_cache) > RMSD_MATCH_CACHE_SIZE:
+        _rmsd_match_cache.popitem(last=False)
+    return matches
+
+
+def _squared_deviation(ref_atoms, mol_atoms):
+    """Mean squared deviation of aligned atoms along the last but one axis"""
+    return ((mol_atoms - ref_atoms) ** 2).sum(axis=-1).mean(axis=-1)
+
+
+def rmsd_batch(ref, mol, coords=None, ignore_h=True, method=None,
+               normalize=False):
+    """Computes RMSD between a reference molecule and multiple poses
+    (conformers) of a query molecule at once. Atom assignment (topology
+    dependent) is computed once for all poses and deviations are
+    vectorized over them. Arguments and results are the same as of
+    `oddt.spatial.rmsd` for each pose.
+
+    .. versionadded:: 0.7
+
+    Parameters
+    ----------
+    ref : oddt.toolkit.Molecule object
+        Reference molecule for the RMSD calculation
+
+    mol : oddt.toolkit.Molecule object
+        Query molecule, providing the topology of all poses.
+
+    coords : numpy array, shape = [n_poses, n_atoms, 3] or None (default=None)
+        Coordinates of all atoms of query molecule in each pose. If None,
+        coordinates of `mol` are used as the only pose.
+
+    ignore_h : bool (default=False)
+        Flag indicating to ignore Hydrogen atoms while performing RMSD
+        calculation. This toggle works only with 'hungarian' method and without
+        sorting (method=None).
+
+    method : str (default=None)
+        The method to be used for atom asignment between ref and mol. See
+        `oddt.spatial.rmsd`.
+
+    normalize : bool (default=False)
+        Normalize RMSD by square root of rot. bonds
+
+    Returns
+    -------
+    rmsd : numpy array, shape = [n_poses]
+        RMSD between reference and each pose.
+    """
+    if coords is None:
+        coords = mol.coords
+    coords = np.asarray(coords)
+    if coords.ndim == 2:
+        coords = coords[np.newaxis]
+    if coords.shape[1] != len(mol.atom_dict):
+        raise ValueError('Poses have %i atoms, but the molecule has %i.'
+                         % (coords.shape[1], len(mol.atom_dict)))
 
     if method == 'canonize':
         ref_atoms = ref.coords[ref.canonic_order]
-        mol_atoms = mol.coords[mol.canonic_order]
+        mol_atoms = coords[:, mol.canonic_order]
     elif method == 'hungarian':
+        mol_types = mol.atom_dict['atomtype']
+        ref_types = ref.atom_dict['atomtype']
         mol_map = []
         ref_map = []
-        for a_type in np.unique(mol.atom_dict['atomtype']):
+        for a_type in np.unique(mol_types):
             if a_type != 'H' or not ignore_h:
-                mol_idx = np.argwhere(mol.atom_dict['atomtype'] == a_type).flatten()
-                ref_idx = np.argwhere(ref.atom_dict['atomtype'] == a_type).flatten()
+                mol_idx = np.argwhere(mol_types == a_type).flatten()
+                ref_idx = np.argwhere(ref_types == a_type).flatten()
                 if len(mol_idx) != len(ref_idx):
                     raise ValueError('Unequal number of atoms type: %s' % a_type)
                 if len(mol_idx) == 1:
-                    mol_map.append(mol_idx)
+                    mol_map.append(np.tile(mol_idx, (len(coords), 1)))
                     ref_map.append(ref_idx)
                     continue
-                M = distance(mol.atom_dict['coords'][mol_idx],
-                             ref.atom_dict['coords'][ref_idx])
-                M = M - M.min(axis=0) - M.min(axis=1).reshape(-1, 1)
-                tmp_mol, tmp_ref = linear_sum_assignment(M)
-                mol_map.append(mol_idx[tmp_mol])
-                ref_map.append(ref_idx[tmp_ref])
-        mol_atoms = mol.atom_dict['coords'][np.hstack(mol_map)]
+                # distance matrices of all poses at once
+                M = np.linalg.norm(coords[:, mol_idx, np.newaxis] -
+                                   ref.atom_dict['coords'][ref_idx], axis=-1)
+                M = (M - M.min(axis=1, keepdims=True) -
+                     M.min(axis=2, keepdims=True))
+                # assignment of reference atoms to pose atoms, per pose
+                pose_map = np.empty((len(coords), len(mol_idx)), dtype=int)
+                for i, pose_M in enumerate(M):
+                    tmp_mol, tmp_ref = linear_sum_assignment(pose_M)
+                    pose_map[i, tmp_ref] = mol_idx[tmp_mol]
+                mol_map.append(pose_map)
+                ref_map.append(ref_idx)
+        mol_map = np.hstack(mol_map)
         ref_atoms = ref.atom_dict['coords'][np.hstack(ref_map)]
+        mol_atoms = coords[np.arange(len(coords))[:, np.newaxis], mol_map]
     elif method == 'min_symmetry':
-        min_rmsd = None
         ref_atoms = ref.atom_dict[ref.atom_dict['atomicnum'] != 1]['coords']
-        mol_atoms = mol.atom_dict[mol.atom_dict['atomicnum'] != 1]['coords']
+        mol_heavy = (mol.atom_dict['atomicnum'] != 1).sum()
         # safety swith to check if number of heavy atoms match
-        if ref_atoms.shape == mol_atoms.shape:
-            # match mol to ref, generate all matches to find best RMSD
-            matches = oddt.toolkit.Smarts(ref).findall(mol, unique=False)
-            if not matches:
-                raise ValueError('Could not find any match between molecules.')
-            # calculate RMSD between all matches and retain the smallest
-            for match in matches:
-                match = np.array(match, dtype=int)
-                if is_openbabel_molecule(mol):
-                    match -= 1  # OB has 1-based indices
-                tmp_dict = mol.atom_dict[match]
-                mol_atoms = tmp_dict[tmp_dict['atomicnum'] != 1]['coords']
-                # following should not happen, although safety check is left
-                if mol_atoms.shape != ref_atoms.shape:
-                    raise Exception('Molecular match got wrong number of atoms.')
-                rmsd = np.sqrt(((mol_atoms - ref_atoms)**2).sum(axis=-1).mean())
-                if min_rmsd is None or rmsd < min_rmsd:
-                    min_rmsd = rmsd
-            return min_rmsd
+        if len(ref_atoms) == mol_heavy:
+            matches = _symmetry_matches(ref, mol)
+            # limit memory used by [n_poses, n_matches, n_heavy, 3] arrays
+            chunk = max(1, 2 ** 20 // (len(matches) * max(mol_heavy, 1)))
+            # NOTE: normalization is not applied, as in former rmsd versions
+            return np.sqrt(np.concatenate([
+                _squared_deviation(ref_atoms, coords[i:i + chunk][:, matches]
+                                   ).min(axis=1)
+                for i in range(0, len(coords), chunk)]))
+        mol_atoms = coords[:, mol.atom_dict['atomicnum'] != 1]
     elif ignore_h:
-        mol_atoms = mol.coords[mol.atom_dict['atomicnum'] != 1]
+        mol_atoms = coords[:, mol.atom_dict['atomicnum'] != 1]
         ref_atoms = ref.coords[ref.atom_dict['atomicnum'] != 1]
     else:
-        mol_atoms = mol.coords
+        mol_atoms = coords
         ref_atoms = ref.coords
-    if mol_atoms.shape == ref_atoms.shape:
-        rmsd = np.sqrt(((mol_atoms - ref_atoms)**2).sum(axis=-1).mean())
+    if mol_atoms.shape[1:] == ref_atoms.shape:
+        rmsd = np.sqrt(_squared_deviation(ref_atoms, mol_atoms))
         if normalize:
             rmsd /= np.sqrt(mol.num_rotors)
         return rmsd
     # at this point raise an exception
     raise ValueError('Unequal number of atoms in molecules (%i and %i)'
-                     % (len(mol_atoms), len(ref_atoms)))
+                     % (mol_atoms.shape[1], len(ref_atoms)))
+
+
+def _det3(m):
+    """Determinants of stacked 3x3 matrices"""
+    return (m[..., 0, 0] * (m[..., 1, 1] * m[..., 2, 2] - m[..., 1, 2] * m[..., 2, 1]) -
+            m[..., 0, 1] * (m[..., 1, 0] * m[..., 2, 2] - m[..., 1, 2] * m[..., 2, 0]) +
+            m[..., 0, 2] * (m[..., 1, 0] * m[..., 2, 1] - m[..., 1, 1] * m[..., 2, 0]))
+
+
+def _kabsch_sq_deviation(x, y):
+    """Sum of squared deviations of all pairs of centered point sets x and y
+    (shapes [n_x, n_points, 3] and [n_y, n_points, 3]) after optimal
+    superposition, computed from singular values of covariance matrices."""
+    n_x, n_points = x.shape[:2]
+    n_y = len(y)
+    # covariance matrices of all pairs, shape = [n_x, n_y, 3, 3]
+    cov = np.dot(x.transpose(0, 2, 1).reshape(n_x * 3, n_points),
+                 y.transpose(1, 0, 2).reshape(n_points, n_y * 3))
+    cov = cov.reshape(n_x, 3, n_y, 3).transpose(0, 2, 1, 3)
+
+    # singular values are square roots of eigenvalues of cov^T * cov, which
+    # are computed analytically (much faster than stacked SVD)
+    m = np.einsum('...ji,...jk->...ik', cov, cov)
+    q = np.trace(m, axis1=-2, axis2=-1) / 3
+    b = m - q[..., np.newaxis, np.newaxis] * np.eye(3)
+    p = np.sqrt((b ** 2).sum(axis=(-2, -1)) / 6)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.where(p > 0, _det3(b) / (2 * p ** 3), 0)
+    phi = np.arccos(np.clip(r, -1, 1)) / 3
+    eig1 = q + 2 * p * np.cos(phi)
+    eig3 = q + 2 * p * np.cos(phi + 2 * np.pi / 3)
+    eig2 = 3 * q - eig1 - eig3
+    sv = np.sqrt(np.clip(np.stack((eig1, eig2, eig3), axis=-1), 0, None))
+    # avoid reflections
+    sv[..., -1] *= np.where(_det3(cov) < 0, -1, 1)
+    return ((x ** 2).sum(axis=(1, 2))[:, np.newaxis] +
+            (y ** 2).sum(axis=(1, 2)) - 2 * sv.sum(axis=-1))
+
+
+def rmsd_matrix(mol, coords, ignore_h=True, method='min_symmetry',
+                superpose=False, block_size=256):
+    """Computes symmetric matrix of RMSD between all pairs of poses
+    (conformers) of a molecule. Computation is vectorized in square blocks
+    of pose pairs, so memory used, apart from the resulting matrix, is
+    bounded by the block size.
+
+    .. versionadded:: 0.7
+
+    Parameters
+    ----------
+    mol : oddt.toolkit.Molecule object
+        Molecule providing the topology of all poses.
+
+    coords : numpy array, shape = [n_poses, n_atoms, 3]
+        Coordinates of all atoms of the molecule in each pose.
+
+    ignore_h : bool (default=True)
+        Flag indicating to ignore Hydrogen atoms (used only if method=None).
+
+    method : str or None (default='min_symmetry')
+        The method to be used for atom asignment between poses:
+            - None - direct matching of atoms
+            - min_symmetry - minimal RMSD over all symmetry equivalent
+            atom matches (as in `oddt.spatial.rmsd`). Hydrogens are ignored.
+
+    superpose : bool (default=False)
+        Optimally superpose (Kabsch algorithm) each pair of poses before
+        computing RMSD.
+
+    block_size : int (default=256)
+        Number of poses along each side of a block of pairs processed at
+        once.
+
+    Returns
+    -------
+    rmsd : numpy array, shape = [n_poses, n_poses], dtype=float32
+        RMSD between all pairs of poses.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if coords.ndim != 3 or coords.shape[1:] != (len(mol.atom_dict), 3):
+        raise ValueError('Coordinates of shape [n_poses, %i, 3] were expected, '
+                         'got %s.' % (len(mol.atom_dict), coords.shape))
+    if method == 'min_symmetry':
+        atoms = np.flatnonzero(mol.atom_dict['atomicnum'] != 1)
+        # automorphisms of molecule, aligned with its heavy atoms
+        matches = _symmetry_matches(mol, mol)
+    elif method is None:
+        if ignore_h:
+            atoms = np.flatnonzero(mol.atom_dict['atomicnum'] != 1)
+        else:
+            atoms = np.arange(len(mol.atom_dict))
+        matches = atoms[np.newaxis]
+    else:
+        raise ValueError('Unsupported RMSD method: "%s"' % method)
+
+    n_poses = len(coords)
+    n_atoms = len(atoms)
+    if superpose:
+        coords = coords - coords[:, atoms].mean(axis=1, keepdims=True)
+    else:
+        # common translation limits the loss of precision
+        coords = coords - coords[:, atoms].mean(axis=(0, 1))
+    x = coords[:, atoms]
+    x_sq = (x ** 2).sum(axis=(1, 2))
+
+    sq_dev = np.full((n_poses, n_poses), np.inf)
+    for match in matches:
+        y = coords[:, match]
+        y_sq = (y ** 2).sum(axis=(1, 2))
+        # RMSD is symmetric, compute upper triangle of blocks only
+        for start in range(0, n_poses, block_size):
+            stop = min(start + block_size, n_poses)
+            for cstart in range(start, n_poses, block_size):
+                cstop = min(cstart + block_size, n_poses)
+                if superpose:
+                    block = _kabsch_sq_deviation(x[start:stop],
+                                                 y[cstart:cstop])
+                else:
+                    block = (x_sq[start:stop, np.newaxis] + y_sq[cstart:cstop] -
+                             2 * np.dot(x[start:stop].reshape(stop - start, -1),
+                                        y[cstart:cstop].reshape(cstop - cstart,
+                                                                -1).T))
+                np.minimum(sq_dev[start:stop, cstart:cstop], block,
+                           out=sq_dev[start:stop, cstart:cstop])
+
+    out = np.sqrt(np.clip(sq_dev / n_atoms, 0, None)).astype(np.float32)
+    out = np.triu(out) + np.triu(out, 1).T
+    np.fill_diagonal(out, 0)
+    return out
+
+
+def cluster_poses(mol, coords, cutoff=2., algorithm='leader', **kwargs):
+    """Clusters poses (conformers) of a molecule by their RMSD, i.e. to
+    remove redundant docking poses before rescoring.
+
+    .. versionadded:: 0.7
+
+    Parameters
+    ----------
+    mol : oddt.toolkit.Molecule object
+        Molecule providing the topology of all poses.
+
+    coords : numpy array, shape = [n_poses, n_atoms, 3]
+        Coordinates of all atoms of the molecule in each pose.
+
+    cutoff : float (default=2.)
+        RMSD cutoff (inclusive) of poses belonging to the same cluster.
+
+    algorithm : str (default='leader')
+        Clustering algorithm:
+            - leader - poses are processed in order (i.e. sorted by score)
+            and each one not yet clustered becomes a center of a new
+            cluster with all unclustered poses within the cutoff
+            - butina - as above, but poses with the most neighbors within
+            the cutoff become centers first (Butina, 1999)
+
+    **kwargs
+        Passed to `oddt.spatial.rmsd_matrix`.
+
+    Returns
+    -------
+    labels : numpy array, shape = [n_poses]
+        Index of cluster of each pose.
+
+    centers : numpy array
+        Indices of poses being centers of clusters.
+    """
+    if algorithm not in ('leader', 'butina'):
+        raise ValueError('Unsupported clustering algorithm: "%s"' % algorithm)
+    neighbors = rmsd_matrix(mol, coords, **kwargs) <= cutoff
+    if algorithm == 'butina':
+        # stable sort keeps the order of poses with equal number of neighbors
+        order = np.argsort(-neighbors.sum(axis=1), kind='mergesort')
+    else:
+        order = np.arange(len(neighbors))
+
+    labels = np.full(len(neighbors), -1, dtype=int)
+    centers = []
+    for idx in order:
+        if labels[idx] < 0:
+            labels[neighbors[idx] & (labels < 0)] = len(centers)
+            centers.append(idx)
+    return labels, np.array(centers, dtype=int)
 
 
 def distance(x, y):
@@ -204,10 +523,10 @@ def distance(x, y):
     Parameters
     ----------
     x : numpy arrays, shape = [n_x, 3]
-        Array of poinds in 3D
+        Array of points in 3D
 
     y : numpy arrays, shape = [n_y, 3]
-        Array of poinds in 3D
+        Array of points in 3D
 
     Returns
     -------
@@ -225,10 +544,10 @@ def distance_complex(x, y):
     Parameters
     ----------
     x : numpy arrays, shape = [..., 3]
-        Array of poinds in 3D
+        Array of points in 3D
 
     y : numpy arrays, shape = [..., 3]
-        Array of poinds in 3D
+        Array of points in 3D
 
     Returns
     -------
@@ -238,6 +557,112 @@ def distance_complex(x, y):
     return np.linalg.norm(x[..., np.newaxis, :] - y, axis=-1)
 
 
+def _ball_pairs(tree, points, cutoff):
+    """Query a KD-tree with points and return (point, tree point) index pairs
+    ordered by point index and then by tree point index."""
+    if len(points) == 0 or tree.n == 0:
+        return np.zeros((0, 2), dtype=int)
+    hits = tree.query_ball_point(points, cutoff)
+    lengths = np.fromiter((len(h) for h in hits), dtype=int, count=len(hits))
+    index = np.empty((lengths.sum(), 2), dtype=int)
+    index[:, 0] = np.repeat(np.arange(len(points)), lengths)
+    index[:, 1] = np.fromiter(chain.from_iterable(hits), dtype=int,
+                              count=len(index))
+    # older SciPy versions do not guarantee sorted results
+    return index[np.lexsort((index[:, 1], index[:, 0]))]
+
+
+def _box_mask(x, y, cutoff):
+    """Mask of x points within a bounding box of y extended by cutoff"""
+    if len(y) == 0:
+        return np.zeros(len(x), dtype=bool)
+    return ((x >= y.min(axis=0) - cutoff) &
+            (x <= y.max(axis=0) + cutoff)).all(axis=-1)
+
+
+def close_pairs(x, y, cutoff, cutoff_low=0., method='auto', x_tree=None,
+                y_tree=None):
+    """Finds indices of all pairs of points from x and y which are within
+    the distance cutoff. The cutoff is semi-inclusive, i.e (cutoff_low, cutoff].
+
+    .. versionadded:: 0.7
+
+    Parameters
+    ----------
+    x : numpy arrays, shape = [n_x, 3]
+        Array of points in 3D
+
+    y : numpy arrays, shape = [n_y, 3]
+        Array of points in 3D
+
+    cutoff : float
+        Upper bound of distance (inclusive)
+
+    cutoff_low : float (default=0.)
+        Lower bound of distance (exclusive)
+
+    method : str (default='auto')
+        Neighbor search backend. Available methods:
+            - bruteforce - computes full distance matrix between x and y
+            - kdtree - uses `scipy.spatial.cKDTree` and evaluates only
+            pairs within the cutoff
+            - auto - prefilters points by bounding boxes of both sets and
+            uses KD-tree only if the number of remaining pairs is above
+            `oddt.spatial.KDTREE_MIN_PAIRS`, brute force otherwise
+
+    x_tree, y_tree : scipy.spatial.cKDTree or None (default=None)
+        Precomputed KD-tree built on x or y coordinates. If provided, the
+        KD-tree backend is used regardless of `method`.
+
+    Returns
+    -------
+    index : numpy array, shape = [n_pairs, 2]
+        Indices of x (column 0) and y (column 1) points in contact, sorted
+        in the same manner as `np.argwhere` on full distance matrix.
+    """
+    if method not in ('auto', 'bruteforce', 'kdtree'):
+        raise ValueError('Unsupported neighbor search method: "%s"' % method)
+    x = np.asarray(x, dtype=np.float64).reshape(-1, 3)
+    y = np.asarray(y, dtype=np.float64).reshape(-1, 3)
+    if len(x) == 0 or len(y) == 0:
+        return np.zeros((0, 2), dtype=int)
+
+    if x_tree is None and y_tree is None:
+        if method == 'bruteforce':
+            d = cdist(x, y)
+            return np.argwhere((d > cutoff_low) & (d <= cutoff))
+        if method == 'auto':
+            # discard points outside of the other set's bounding box (extended
+            # by cutoff), which is cheap and limits contacts to a local pocket
+            x_mask = _box_mask(x, y, cutoff)
+            y_mask = _box_mask(y, x[x_mask], cutoff)
+            x_idx = np.flatnonzero(x_mask)
+            y_idx = np.flatnonzero(y_mask)
+            if len(x_idx) * len(y_idx) <= KDTREE_MIN_PAIRS:
+                d = cdist(x[x_idx], y[y_idx])
+                index = np.argwhere((d > cutoff_low) & (d <= cutoff))
+                index[:, 0] = x_idx[index[:, 0]]
+                index[:, 1] = y_idx[index[:, 1]]
+                return index
+        # build the tree on a larger set of points and query the smaller one
+        if len(x) > len(y):
+            x_tree = cKDTree(x)
+        else:
+            y_tree = cKDTree(y)
+
+    # slightly extend the search radius, exact cutoffs are checked below
+    search_cutoff = cutoff + 1e-6
+    if y_tree is not None:
+        index = _ball_pairs(y_tree, x, search_cutoff)
+    else:
+        index = _ball_pairs(x_tree, y, search_cutoff)[:, ::-1]
+        index = index[np.lexsort((index[:, 1], index[:, 0]))]
+
+    # recompute distances to keep the exact cdist semantics of cutoffs
+    d = np.sqrt(((x[index[:, 0]] - y[index[:, 1]]) ** 2).sum(axis=-1))
+    return index[(d > cutoff_low) & (d <= cutoff)]
+
+
 def rotate(coords, alpha, beta, gamma):
     """Rotate coords by cerain angle in X, Y, Z. Angles are specified in radians.
 
@@ -257,13 +682,38 @@ def rotate(coords, alpha, beta, gamma):
     """
     centroid = coords.mean(axis=0)
     coords = coords - centroid
+    rot_matrix = rotation_matrix(alpha, beta, gamma)
+    return (coords[:, np.newaxis, :] * rot_matrix).sum(axis=2) + centroid
+
+
+def _stacked_matrix(matrix):
+    """Move matrix dimensions of array of shape [3, 3, ...] to the end"""
+    return np.rollaxis(np.rollaxis(matrix, 0, matrix.ndim), 0, matrix.ndim)
+
+
+def rotation_matrix(alpha, beta, gamma):
+    """Rotation matrices from angles along X, Y and Z axis, as used by
+    `oddt.spatial.rotate`. Angles can be arrays to get many matrices at once.
+
+    .. versionadded:: 0.7
+
+    Parameters
+    ----------
+    alpha, beta, gamma: float or numpy arrays
+        Angles to rotate the coordinates along X, Y and Z axis.
+        Angles are specified in radians.
 
-    sin_alpha = sin(alpha)
-    cos_alpha = cos(alpha)
-    sin_beta = sin(beta)
-    cos_beta = cos(beta)
-    sin_gamma = sin(gamma)
-    cos_gamma = cos(gamma)
+    Returns
+    -------
+    rot_matrix : numpy array, shape = [..., 3, 3]
+        Rotation matrices.
+    """
+    alpha, beta, gamma = np.broadcast_arrays(np.asarray(alpha, dtype=float),
+                                             np.asarray(beta, dtype=float),
+                                             np.asarray(gamma, dtype=float))
+    sin_alpha, cos_alpha = np.sin(alpha), np.cos(alpha)
+    sin_beta, cos_beta = np.sin(beta), np.cos(beta)
+    sin_gamma, cos_gamma = np.sin(gamma), np.cos(gamma)
 
     rot_matrix = np.array([[cos_beta * cos_gamma,
                             sin_alpha * sin_beta * cos_gamma - cos_alpha * sin_gamma,
@@ -274,5 +724,106 @@ def rotate(coords, alpha, beta, gamma):
                            [-sin_beta,
                             sin_alpha * cos_beta,
                             cos_alpha * cos_beta]])
+    return _stacked_matrix(rot_matrix)
 
-    return (coords[:, np.newaxis, :] * rot_matrix).sum(axis=2) + centroid
+
+def axis_angle_matrix(axis, angle):
+    """Rotation matrices (right-handed) by an angle around an axis.
+
+    .. versionadded:: 0.7
+
+    Parameters
+    ----------
+    axis : numpy array, shape = [..., 3]
+        Axes of rotation (not necessarily normalized).
+
+    angle : float or numpy array, shape = [...]
+        Angles of rotation in radians.
+
+    Returns
+    -------
+    rot_matrix : numpy array, shape = [..., 3, 3]
+        Rotation matrices.
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    axis = axis / np.linalg.norm(axis, axis=-1)[..., np.newaxis]
+    angle = np.asarray(angle, dtype=np.float64)[..., np.newaxis, np.newaxis]
+    # Rodrigues' formula with cross product matrix of the axis
+    x, y, z = np.rollaxis(axis, -1)
+    zeros = np.zeros_like(x)
+    cross = _stacked_matrix(np.array([[zeros, -z, y],
+                                      [z, zeros, -x],
+                                      [-y, x, zeros]]))
+    outer = axis[..., :, np.newaxis] * axis[..., np.newaxis, :]
+    return (np.cos(angle) * np.eye(3) + np.sin(angle) * cross +
+            (1 - np.cos(angle)) * outer)
+
+
+def quaternion_matrix(quaternion):
+    """Rotation matrices from quaternions.
+
+    .. versionadded:: 0.7
+
+    Parameters
+    ----------
+    quaternion : numpy array, shape = [..., 4]
+        Quaternions in (w, x, y, z) order, normalized internally.
+
+    Returns
+    -------
+    rot_matrix : numpy array, shape = [..., 3, 3]
+        Rotation matrices.
+    """
+    quaternion = np.asarray(quaternion, dtype=np.float64)
+    quaternion = quaternion / np.linalg.norm(quaternion, axis=-1)[..., np.newaxis]
+    w, x, y, z = np.rollaxis(quaternion, -1)
+    rot_matrix = np.array([[1 - 2 * (y * y + z * z),
+                            2 * (x * y - z * w),
+                            2 * (x * z + y * w)],
+                           [2 * (x * y + z * w),
+                            1 - 2 * (x * x + z * z),
+                            2 * (y * z - x * w)],
+                           [2 * (x * z - y * w),
+                            2 * (y * z + x * w),
+                            1 - 2 * (x * x + y * y)]])
+    return _stacked_matrix(rot_matrix)
+
+
+def transform(coords, rotation=None, translation=None, center=None):
+    """Applies rigid-body transformations to one or many sets of coordinates
+    at once. Coordinates are rotated around the center and then translated.
+    All arguments are broadcasted, so a single set of coordinates can be
+    transformed in many ways, or many sets in one way.
+
+    .. versionadded:: 0.7
+
+    Parameters
+    ----------
+    coords : numpy array, shape = [..., n_points, 3]
+        Coordinates in 3-dimensional space.
+
+    rotation : numpy array, shape = [..., 3, 3] or None (default=None)
+        Rotation matrices (see `rotation_matrix`, `axis_angle_matrix` and
+        `quaternion_matrix`).
+
+    translation : numpy array, shape = [..., 3] or None (default=None)
+        Translation vectors.
+
+    center : numpy array, shape = [..., 3] or None (default=None)
+        Centers of rotation, centroids of coordinates by default (as in
+        `oddt.spatial.rotate`).
+
+    Returns
+    -------
+    new_coords : numpy array, shape = [..., n_points, 3]
+        Transformed coordinates.
+    """
+    coords = np.asarray(coords)
+    if rotation is not None:
+        if center is None:
+            center = coords.mean(axis=-2)
+        center = np.asarray(center)[..., np.newaxis, :]
+        coords = np.einsum('...ij,...nj->...ni', rotation, coords - center) + center
+    if translation is not None:
+        coords = coords + np.asarray(translation)[..., np.newaxis, :]
+    return coords
@@ -1,7 +1,11 @@
 """Code common to all toolkits"""
-from collections import deque
+import os
+import hashlib
+from tempfile import NamedTemporaryFile
+from collections import deque, namedtuple, OrderedDict
 import numpy as np
 
+import oddt
 from oddt.spatial import dihedral, distance
 
 
@@ -103,3 +107,204 @@ def canonize_ring_path(path):
         path_deque.reverse()
         path_deque.rotate(1)
     return list(path_deque)
+
+
+SmartsCacheInfo = namedtuple('SmartsCacheInfo',
+                             ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class SmartsRegistry(object):
+    def __init__(self, compiler, maxsize=1024):
+        """Process-wide registry of compiled SMARTS patterns. Patterns are
+        compiled lazily on first use and shared afterwards, the least
+        recently used ones are discarded when `maxsize` is exceeded.
+
+        .. versionadded:: 0.7
+
+        Parameters
+        ----------
+        compiler : callable
+            Function compiling a pattern, usually toolkit's `Smarts` class.
+
+        maxsize : int or None (default=1024)
+            Maximum number of compiled patterns kept. None means unbounded.
+        """
+        self.compiler = compiler
+        self.maxsize = maxsize
+        self._patterns = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pattern, key=None):
+        """Get compiled pattern, compile it if it is not registered yet.
+
+        Parameters
+        ----------
+        pattern : str or oddt.toolkit.Molecule
+            SMARTS string or a molecule used as a pattern.
+
+        key : hashable or None (default=None)
+            Registry key of a pattern. By default the pattern itself is used,
+            which is required for unhashable patterns (e.g. molecules).
+
+        Returns
+        -------
+        compiled : object
+            Compiled pattern returned by the `compiler`.
+        """
+        if key is None:
+            key = pattern
+        if key in self._patterns:
+            self.hits += 1
+            # move to the end, as the most recently used
+            compiled = self._patterns.pop(key)
+            self._patterns[key] = compiled
+            return compiled
+
+        self.misses += 1
+        compiled = self.compiler(pattern)
+        self._patterns[key] = compiled
+        if self.maxsize is not None and len(self._patterns) > self.maxsize:
+            self._patterns.popitem(last=False)
+        return compiled
+
+    def __getitem__(self, pattern):
+        return self.get(pattern)
+
+    def __contains__(self, key):
+        return key in self._patterns
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def cache_info(self):
+        """Compilation counters, similar to `functools.lru_cache`"""
+        return SmartsCacheInfo(self.hits, self.misses, self.maxsize,
+                               len(self._patterns))
+
+    def cache_clear(self):
+        """Remove all compiled patterns and reset counters"""
+        self._patterns.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class DictsCache(object):
+    def __init__(self, directory, mmap_mode='r'):
+        """On-disk cache of molecules' `atom_dict`, `ring_dict` and
+        `res_dict`, stored as `.npy` files. Entries are keyed by a content
+        hash of the source file, reader options, position of a molecule in
+        that file, toolkit and its version, ODDT version and the `protein`
+        flag.
+
+        .. versionadded:: 0.7
+
+        Parameters
+        ----------
+        directory : str
+            Directory where the arrays are stored. It is created if needed.
+
+        mmap_mode : {None, 'r', 'c'} (default='r')
+            Memory-map mode used for loading arrays, see `numpy.load`. With
+            None the arrays are read into memory.
+        """
+        if mmap_mode not in (None, 'r', 'c'):
+            raise ValueError('Unsupported mmap_mode "%s"' % mmap_mode)
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # created concurrently by other process
+                if not os.path.isdir(directory):
+                    raise
+
+    def source_key(self, filename, backend, version, options=None):
+        """Hash of file content, toolkit, versions and reader options (a
+        dictionary of format, `opt` and keyword arguments of `readfile`)"""
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        sha1.update(('%s:%s:%s' % (backend, version, oddt.__version__))
+                    .encode('ascii'))
+        if options:
+            sha1.update(repr(_normalize_options(options)).encode('utf-8'))
+        return sha1.hexdigest()
+
+    def _path(self, key, protein, name):
+        return os.path.join(self.directory, '%s_%s.%s.npy' % (
+            key, 'protein' if protein else 'mol', name))
+
+    def load(self, key, protein):
+        """Load cached dicts. Returns a tuple of (atom_dict, ring_dict,
+        res_dict) or None if the entry is not (completely) cached."""
+        dicts = []
+        for name in ('atom_dict', 'ring_dict', 'res_dict'):
+            path = self._path(key, protein, name)
+            if not os.path.isfile(path):
+                if name == 'res_dict' and not protein:
+                    dicts.append(None)
+                    continue
+                return None
+            try:
+                array = np.asarray(np.load(path, mmap_mode=self.mmap_mode))
+            except (IOError, ValueError):  # truncated or corrupted file
+                return None
+            if self.mmap_mode != 'c':
+                array.setflags(write=False)
+            dicts.append(array)
+        return tuple(dicts)
+
+    def save(self, key, protein, atom_dict, ring_dict, res_dict=None):
+        """Store dicts in the cache. Files are written atomically and
+        `atom_dict` is written last, so concurrent readers never see
+        a partial entry."""
+        for name, array in (('res_dict', res_dict),
+                            ('ring_dict', ring_dict),
+                            ('atom_dict', atom_dict)):
+            if array is None:
+                continue
+            path = self._path(key, protein, name)
+            with NamedTemporaryFile(dir=self.directory, suffix='.tmp',
+                                    delete=False) as f:
+                np.save(f, array)
+            try:
+                os.rename(f.name, path)
+            except OSError:  # target exists on Windows
+                os.remove(f.name)
+
+
+def _normalize_options(options):
+    """Order independent representation of (nested) reader options"""
+    if isinstance(options, dict):
+        return tuple(sorted((str(k), _normalize_options(v))
+                            for k, v in options.items()))
+    return repr(options)
+
+
+def _attach_dicts_cache(mols, dicts_cache, filename, backend, version,
+                        options=None):
+    """Link molecules read from a file with an on-disk dicts cache"""
+    if not isinstance(dicts_cache, DictsCache):
+        dicts_cache = DictsCache(dicts_cache)
+    source_key = dicts_cache.source_key(filename, backend, version, options)
+    for i, mol in enumerate(mols):
+        if mol is not None:
+            mol._dicts_cache = (dicts_cache, '%s_%i' % (source_key, i))
+        yield mol
+
+
+def _load_dicts(mol):
+    """Generate molecule's dicts or load them from the on-disk cache"""
+    if mol._dicts_cache is None:
+        mol._dicts()
+        return
+    dicts_cache, key = mol._dicts_cache
+    dicts = dicts_cache.load(key, mol.protein)
+    if dicts is None:
+        mol._dicts()
+        dicts_cache.save(key, mol.protein, mol._atom_dict, mol._ring_dict,
+                         mol._res_dict if mol.protein else None)
+    else:
+        mol._atom_dict, mol._ring_dict, mol._res_dict = dicts
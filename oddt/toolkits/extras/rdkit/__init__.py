@@ -1,6 +1,6 @@
 from __future__ import absolute_import, print_function
 from math import isnan, isinf
-from itertools import combinations
+from itertools import chain, combinations
 
 import rdkit
 from rdkit import Chem
@@ -142,10 +142,14 @@ def MolFromPDBBlock(molBlock,
 
 
 # Mol2 Atom typing
-def _sybyl_atom_type(atom):
+def _sybyl_atom_type(atom, matches_cache=None):
     """ Asign sybyl atom type
     Reference #1: http://www.tripos.com/mol2/atom_types.html
     Reference #2: http://chemyang.ccnu.edu.cn/ccb/server/AIMMS/mol2.pdf
+
+    When typing all atoms of a molecule pass the same (initially empty)
+    `matches_cache` dictionary to every call, so that each SMARTS pattern is
+    matched against the molecule only once instead of once per atom.
     """
     sybyl = None
     atom_symbol = atom.GetSymbol()
@@ -166,18 +170,19 @@ def _sybyl_atom_type(atom):
     if atomic_num == 6:
         if aromtic:
             sybyl = 'C.ar'
-        elif degree == 3 and _atom_matches_smarts(atom, guanidine):
+        elif degree == 3 and _atom_matches_smarts(atom, guanidine, matches_cache):
             sybyl = 'C.cat'
         else:
             sybyl = '%s.%i' % (atom_symbol, hyb)
     elif atomic_num == 7:
         if aromtic:
             sybyl = 'N.ar'
-        elif _atom_matches_smarts(atom, 'C(=[O,S])-N'):
+        elif _atom_matches_smarts(atom, 'C(=[O,S])-N', matches_cache):
             sybyl = 'N.am'
-        elif degree == 3 and _atom_matches_smarts(atom, '[$(N!-*),$([NX3H1]-*!-*)]'):
+        elif degree == 3 and _atom_matches_smarts(atom, '[$(N!-*),$([NX3H1]-*!-*)]',
+                                                  matches_cache):
             sybyl = 'N.pl3'
-        elif _atom_matches_smarts(atom, guanidine):  # guanidine has N.pl3
+        elif _atom_matches_smarts(atom, guanidine, matches_cache):  # guanidine has N.pl3
             sybyl = 'N.pl3'
         elif degree == 4 or hyb == 3 and atom.GetFormalCharge():
             sybyl = 'N.4'
@@ -185,7 +190,8 @@ def _sybyl_atom_type(atom):
             sybyl = '%s.%i' % (atom_symbol, hyb)
     elif atomic_num == 8:
         # http://www.daylight.com/dayhtml_tutorials/languages/smarts/smarts_examples.html
-        if degree == 1 and _atom_matches_smarts(atom, '[CX3](=O)[OX1H0-]'):
+        if degree == 1 and _atom_matches_smarts(atom, '[CX3](=O)[OX1H0-]',
+                                                matches_cache):
             sybyl = 'O.co2'
         elif degree == 2 and not aromtic:  # Aromatic Os are sp2
             sybyl = 'O.3'
@@ -193,10 +199,12 @@ def _sybyl_atom_type(atom):
             sybyl = 'O.2'
     elif atomic_num == 16:
         # http://www.daylight.com/dayhtml_tutorials/languages/smarts/smarts_examples.html
-        if degree == 3 and _atom_matches_smarts(atom, '[$([#16X3]=[OX1]),$([#16X3+][OX1-])]'):
+        if degree == 3 and _atom_matches_smarts(atom, '[$([#16X3]=[OX1]),$([#16X3+][OX1-])]',
+                                                matches_cache):
             sybyl = 'S.O'
         # https://github.com/rdkit/rdkit/blob/master/Data/FragmentDescriptors.csv
-        elif _atom_matches_smarts(atom, 'S(=,-[OX1;+0,-1])(=,-[OX1;+0,-1])(-[#6])-[#6]'):
+        elif _atom_matches_smarts(atom, 'S(=,-[OX1;+0,-1])(=,-[OX1;+0,-1])(-[#6])-[#6]',
+                                  matches_cache):
             sybyl = 'S.o2'
         else:
             sybyl = '%s.%i' % (atom_symbol, hyb)
@@ -208,9 +216,22 @@ def _sybyl_atom_type(atom):
     return sybyl
 
 
-def _atom_matches_smarts(atom, smarts):
+def _compiled_smarts(smarts):
+    """RDKit pattern from the process-wide ODDT SMARTS registry"""
+    # imported here, since oddt.toolkits.rdk depends on this module
+    from oddt.toolkits.rdk import smarts_registry
+    return smarts_registry[smarts].rdksmarts
+
+
+def _atom_matches_smarts(atom, smarts, matches_cache=None):
     idx = atom.GetIdx()
-    patt = Chem.MolFromSmarts(smarts)
+    if matches_cache is not None:
+        if smarts not in matches_cache:
+            patt = _compiled_smarts(smarts)
+            matches = atom.GetOwningMol().GetSubstructMatches(patt)
+            matches_cache[smarts] = set(chain.from_iterable(matches))
+        return idx in matches_cache[smarts]
+    patt = _compiled_smarts(smarts)
     for m in atom.GetOwningMol().GetSubstructMatches(patt):
         if idx in m:
             return True
@@ -223,7 +244,7 @@ def _amide_bond(bond):
     if (a1.GetAtomicNum() == 6 and a2.GetAtomicNum() == 7 or
             a2.GetAtomicNum() == 6 and a1.GetAtomicNum() == 7):
         # https://github.com/rdkit/rdkit/blob/master/Data/FragmentDescriptors.csv
-        patt = Chem.MolFromSmarts('C(=O)-N')
+        patt = _compiled_smarts('C(=O)-N')
         for m in bond.GetOwningMol().GetSubstructMatches(patt):
             if a1.GetIdx() in m and a2.GetIdx() in m:
                 return True
@@ -21,7 +21,11 @@ import numpy as np
 from openbabel import OBAtomAtomIter, OBAtomBondIter, OBTypeTable
 
 from oddt.utils import check_molecule
-from oddt.toolkits.common import detect_secondary_structure, canonize_ring_path
+from oddt.toolkits.common import (detect_secondary_structure,
+                                  canonize_ring_path,
+                                  SmartsRegistry,
+                                  _attach_dicts_cache,
+                                  _load_dicts)
 
 ob.OBIterWithDepth.__next__ = ob.OBIterWithDepth.next
 
@@ -101,7 +105,20 @@ def _filereader_pdb(filename, opt=None):
             yield Molecule(source={'fmt': 'pdb', 'string': block, 'opt': opt})
 
 
-def readfile(format, filename, opt=None, lazy=False):
+def readfile(format, filename, opt=None, lazy=False, dicts_cache=None):
+    """Iterate over the molecules in a file. See `pybel.readfile` for details.
+
+    Molecules' dicts (`atom_dict`, `ring_dict`, `res_dict`) can be stored in
+    and loaded from an on-disk cache, pass a directory path or
+    `oddt.toolkits.common.DictsCache` as `dicts_cache`.
+    """
+    if dicts_cache is not None:
+        # reader options change parsed molecules, hence are a part of a key
+        options = {'format': format.lower(), 'opt': dict(opt or {})}
+        return _attach_dicts_cache(readfile(format, filename, opt=opt,
+                                            lazy=lazy),
+                                   dicts_cache, filename, backend, __version__,
+                                   options)
     if format == 'mol2':
         if __version__ < '2.4.0':
             warnings.warn('OpenBabel 2.3.2 does not support writing data in '
@@ -140,6 +157,7 @@ class Molecule(pybel.Molecule):
         self._ring_dict = None
         self._coords = None
         self._charges = None
+        self._dicts_cache = None  # (DictsCache, key) of on-disk dicts
 
     # lazy Molecule parsing requires masked OBMol
     @property
@@ -178,6 +196,7 @@ class Molecule(pybel.Molecule):
         # clear cache
         self._coords = None
         self._atom_dict = None
+        self._dicts_cache = None
 
     @property
     def charges(self):
@@ -234,7 +253,10 @@ class Molecule(pybel.Molecule):
     @protein.setter
     def protein(self, protein):
         """atom_dict caches must be cleared due to property change"""
+        dicts_cache = self._dicts_cache
         self._clear_cache()
+        # protein flag is a part of the on-disk cache key
+        self._dicts_cache = dicts_cache
         self._protein = protein
 
     def addh(self, only_polar=False):
@@ -300,22 +322,24 @@ class Molecule(pybel.Molecule):
         self._coords = None
         self._charges = None
         self._residues = None
+        # the molecule has changed, on-disk dicts are no longer valid
+        self._dicts_cache = None
 
     @property
     def num_rotors(self):
         """Number of strict rotatable """
-        rot_bond = Smarts('[!$(*#*)&!D1&!$(C(F)(F)F)&'
-                          '!$(C(Cl)(Cl)Cl)&'
-                          '!$(C(Br)(Br)Br)&'
-                          '!$(C([CH3])([CH3])[CH3])&'
-                          '!$([CD3](=[N,O,S])-!@[#7,O,S!D1])&'
-                          '!$([#7,O,S!D1]-!@[CD3]=[N,O,S])&'
-                          '!$([CD3](=[N+])-!@[#7!D1])&'
-                          '!$([#7!D1]-!@[CD3]=[N+])]-!@[!$(*#*)&'
-                          '!D1&!$(C(F)(F)F)&'
-                          '!$(C(Cl)(Cl)Cl)&'
-                          '!$(C(Br)(Br)Br)&'
-                          '!$(C([CH3])([CH3])[CH3])]')
+        rot_bond = smarts_registry['[!$(*#*)&!D1&!$(C(F)(F)F)&'
+                                   '!$(C(Cl)(Cl)Cl)&'
+                                   '!$(C(Br)(Br)Br)&'
+                                   '!$(C([CH3])([CH3])[CH3])&'
+                                   '!$([CD3](=[N,O,S])-!@[#7,O,S!D1])&'
+                                   '!$([#7,O,S!D1]-!@[CD3]=[N,O,S])&'
+                                   '!$([CD3](=[N+])-!@[#7!D1])&'
+                                   '!$([#7!D1]-!@[CD3]=[N+])]-!@[!$(*#*)&'
+                                   '!D1&!$(C(F)(F)F)&'
+                                   '!$(C(Cl)(Cl)Cl)&'
+                                   '!$(C(Br)(Br)Br)&'
+                                   '!$(C([CH3])([CH3])[CH3])]']
         return len(rot_bond.findall(self))
 
     def _repr_svg_(self):
@@ -376,21 +400,21 @@ class Molecule(pybel.Molecule):
     def atom_dict(self):
         # check cache and generate dicts
         if self._atom_dict is None:
-            self._dicts()
+            _load_dicts(self)
         return self._atom_dict
 
     @property
     def res_dict(self):
         # check cache and generate dicts
         if self._res_dict is None:
-            self._dicts()
+            _load_dicts(self)
         return self._res_dict
 
     @property
     def ring_dict(self):
         # check cache and generate dicts
         if self._ring_dict is None:
-            self._dicts()
+            _load_dicts(self)
         return self._ring_dict
 
     @property
@@ -434,96 +458,114 @@ class Molecule(pybel.Molecule):
                       ('isbeta', bool)
                       ]
 
-        atom_dict = np.empty(self.OBMol.NumAtoms(), dtype=atom_dtype)
+        num_atoms = self.OBMol.NumAtoms()
+        atom_dict = np.zeros(num_atoms, dtype=atom_dtype)
         metals = [3, 4, 11, 12, 13, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29,
                   30, 31, 37, 38, 39, 40, 41, 42, 43, 44, 45, 46, 47, 48, 49,
                   50, 55, 56, 57, 58, 59, 60, 61, 62, 63, 64, 65, 66, 67, 68,
                   69, 70, 71, 72, 73, 74, 75, 76, 77, 78, 79, 80, 81, 82, 83,
                   87, 88, 89, 90, 91, 92, 93, 94, 95, 96, 97, 98, 99, 100, 101,
                   102, 103]
-        for i, atom in enumerate(self.atoms):
-
-            atomicnum = atom.atomicnum
-            # skip non-polar hydrogens for performance
-#            if atomicnum == 1 and atom.OBAtom.IsNonPolarHydrogen():
-#                continue
-            atomtype = typetable.Translate(atom.type)  # sybyl atom type
-            partialcharge = atom.partialcharge
-            coords = atom.coords
-
-            if self.protein:
-                residue = Residue(atom.OBAtom.GetResidue())
-            else:
-                residue = False
-
-            # get neighbors, but only for those atoms which realy need them
-            neighbors = np.zeros(max_neighbors, dtype=[('id', np.int16),
-                                                       ('coords', np.float32, 3),
-                                                       ('atomicnum', np.int8)])
-            neighbors['coords'].fill(np.nan)
-            for n, nbr_atom in enumerate(atom.neighbors):
-                if n >= max_neighbors:
-                    warnings.warn('Error while parsing molecule "%s" '
-                                  'for `atom_dict`. Atom #%i (%s) has %i '
-                                  'neighbors (max_neighbors=%i). Additional '
-                                  'neighbors are ignored.' % (self.title,
-                                                              atom.idx0,
-                                                              atomtype,
-                                                              len(atom.neighbors),
-                                                              max_neighbors),
-                                  UserWarning)
-                    break
-                neighbors[n] = (nbr_atom.idx0, nbr_atom.coords, nbr_atom.atomicnum)
-            assert i == atom.idx0
-            atom_dict[i] = (i,
-                            coords,
-                            elementtable.GetVdwRad(atomicnum),
-                            partialcharge,
-                            atomicnum,
-                            atomtype,
-                            atom.OBAtom.GetHyb(),
-                            neighbors['id'],
-                            neighbors['coords'],
-                            # residue info
-                            residue.idx0 if residue else 0,
-                            residue.number if residue else 0,
-                            residue.name if residue else '',
-                            residue.OBResidue.GetAtomProperty(atom.OBAtom, 2) if residue else False,  # is backbone
-                            # atom properties
-                            False,  # atom.OBAtom.IsHbondAcceptor(),
-                            False,  # atom.OBAtom.IsHbondDonor(),
-                            False,  # atom.OBAtom.IsHbondDonorH(),
-                            atomicnum in metals,
-                            atomicnum == 6 and np.in1d(neighbors['atomicnum'], [6, 1, 0]).all(),  # hydrophobe
-                            atom.OBAtom.IsAromatic(),
-                            atom.formalcharge < 0,  # is charged (minus)
-                            atom.formalcharge > 0,  # is charged (plus)
-                            atomicnum in [9, 17, 35, 53],  # is halogen?
-                            False,  # alpha
-                            False  # beta
-                            )
+        ob_atoms = [self.OBMol.GetAtom(i + 1) for i in range(num_atoms)]
+        atomicnum = np.array([atom.GetAtomicNum() for atom in ob_atoms],
+                             dtype=int)
+        coords = np.array([(atom.GetX(), atom.GetY(), atom.GetZ())
+                           for atom in ob_atoms]).reshape(-1, 3)
+        # translate each internal type to sybyl atom type only once
+        int_types = [atom.GetType() for atom in ob_atoms]
+        sybyl_types = dict((t, typetable.Translate(t)) for t in set(int_types))
+        atomtype = [sybyl_types[t] for t in int_types]
+        formalcharge = np.array([atom.GetFormalCharge() for atom in ob_atoms],
+                                dtype=int)
+
+        # Neighbors table from the bond list. Directed edges are sorted by the
+        # atom and the bond index, which is the order of `OBAtomAtomIter`
+        bonds = np.array([(bond.GetBeginAtomIdx() - 1,
+                           bond.GetEndAtomIdx() - 1,
+                           bond.GetIdx())
+                          for bond in ob.OBMolBondIter(self.OBMol)],
+                         dtype=int).reshape(-1, 3)
+        edge_atom = np.hstack((bonds[:, 0], bonds[:, 1]))
+        edge_nbr = np.hstack((bonds[:, 1], bonds[:, 0]))
+        order = np.lexsort((np.tile(bonds[:, 2], 2), edge_atom))
+        edge_atom = edge_atom[order]
+        edge_nbr = edge_nbr[order]
+        degree = np.bincount(edge_atom, minlength=num_atoms)
+        edge_rank = np.arange(len(edge_atom)) - (np.cumsum(degree) - degree)[edge_atom]
+        for idx in np.argwhere(degree > max_neighbors).flatten():
+            warnings.warn('Error while parsing molecule "%s" '
+                          'for `atom_dict`. Atom #%i (%s) has %i '
+                          'neighbors (max_neighbors=%i). Additional '
+                          'neighbors are ignored.' % (self.title,
+                                                      idx,
+                                                      atomtype[idx],
+                                                      degree[idx],
+                                                      max_neighbors),
+                          UserWarning)
+        mask = edge_rank < max_neighbors
+        edge_atom = edge_atom[mask]
+        edge_nbr = edge_nbr[mask]
+        edge_rank = edge_rank[mask]
+        neighbors_atomicnum = np.zeros((num_atoms, max_neighbors), dtype=int)
+        neighbors_atomicnum[edge_atom, edge_rank] = atomicnum[edge_nbr]
+        atom_dict['neighbors_id'][edge_atom, edge_rank] = edge_nbr
+        atom_dict['neighbors'].fill(np.nan)
+        atom_dict['neighbors'][edge_atom, edge_rank] = coords[edge_nbr]
+
+        atom_dict['id'] = np.arange(num_atoms)
+        atom_dict['coords'] = coords
+        radius = dict((num, elementtable.GetVdwRad(int(num)))
+                      for num in np.unique(atomicnum))
+        atom_dict['radius'] = [radius[num] for num in atomicnum]
+        atom_dict['charge'] = [atom.GetPartialCharge() for atom in ob_atoms]
+        atom_dict['atomicnum'] = atomicnum
+        atom_dict['atomtype'] = atomtype
+        atom_dict['hybridization'] = [atom.GetHyb() for atom in ob_atoms]
+        # residue info, filled in a single pass over residues
+        if self.protein:
+            # perceive chains just like `OBAtom.GetResidue()` would
+            if not self.OBMol.HasChainsPerceived():
+                ob.OBChainsParser().PerceiveChains(self.OBMol)
+            for residue in ob.OBResidueIter(self.OBMol):
+                res_atoms = list(ob.OBResidueAtomIter(residue))
+                res_idx = [atom.GetIdx() - 1 for atom in res_atoms]
+                atom_dict['resid'][res_idx] = residue.GetIdx()
+                atom_dict['resnum'][res_idx] = residue.GetNum()
+                atom_dict['resname'][res_idx] = residue.GetName()
+                atom_dict['isbackbone'][res_idx] = [
+                    residue.GetAtomProperty(atom, 2) for atom in res_atoms]
+        # atom properties
+        atom_dict['ismetal'] = np.in1d(atomicnum, metals)
+        atom_dict['ishydrophobe'] = ((atomicnum == 6) &
+                                     np.in1d(neighbors_atomicnum, [6, 1, 0])
+                                     .reshape(num_atoms, max_neighbors)
+                                     .all(axis=1))
+        atom_dict['isaromatic'] = [atom.IsAromatic() for atom in ob_atoms]
+        atom_dict['isminus'] = formalcharge < 0
+        atom_dict['isplus'] = formalcharge > 0
+        atom_dict['ishalogen'] = np.in1d(atomicnum, [9, 17, 35, 53])
 
         not_carbon = np.argwhere(~np.in1d(atom_dict['atomicnum'], [1, 6])).flatten()
         # Acceptors
-        patt = Smarts('[$([O;H1;v2]),'
-                      '$([O;H0;v2;!$(O=N-*),'
-                      '$([O;-;!$(*-N=O)]),'
-                      '$([o;+0])]),'
-                      '$([n;+0;!X3;!$([n;H1](cc)cc),'
-                      '$([$([N;H0]#[C&v4])]),'
-                      '$([N&v3;H0;$(Nc)])]),'
-                      '$([F;$(F-[#6]);!$(FC[F,Cl,Br,I])])]')
+        patt = smarts_registry['[$([O;H1;v2]),'
+                               '$([O;H0;v2;!$(O=N-*),'
+                               '$([O;-;!$(*-N=O)]),'
+                               '$([o;+0])]),'
+                               '$([n;+0;!X3;!$([n;H1](cc)cc),'
+                               '$([$([N;H0]#[C&v4])]),'
+                               '$([N&v3;H0;$(Nc)])]),'
+                               '$([F;$(F-[#6]);!$(FC[F,Cl,Br,I])])]']
         matches = np.array(patt.findall(self)).flatten()
         if len(matches) > 0:
             atom_dict['isacceptor'][np.intersect1d(matches - 1, not_carbon)] = True
 
         # Donors
-        patt = Smarts('[$([N&!H0&v3,N&!H0&+1&v4,n&H1&+0,$([$([Nv3](-C)(-C)-C)]),'
-                      '$([$(n[n;H1]),'
-                      '$(nc[n;H1])])]),'
-                      # Guanidine can be tautormeic - e.g. Arginine
-                      '$([NX3,NX2]([!O,!S])!@C(!@[NX3,NX2]([!O,!S]))!@[NX3,NX2]([!O,!S])),'
-                      '$([O,S;H1;+0])]')
+        patt = smarts_registry['[$([N&!H0&v3,N&!H0&+1&v4,n&H1&+0,$([$([Nv3](-C)(-C)-C)]),'
+                               '$([$(n[n;H1]),'
+                               '$(nc[n;H1])])]),'
+                               # Guanidine can be tautormeic - e.g. Arginine
+                               '$([NX3,NX2]([!O,!S])!@C(!@[NX3,NX2]([!O,!S]))!@[NX3,NX2]([!O,!S])),'
+                               '$([O,S;H1;+0])]']
         matches = np.array(patt.findall(self)).flatten()
         if len(matches) > 0:
             atom_dict['isdonor'][np.intersect1d(matches - 1, not_carbon)] = True
@@ -533,16 +575,16 @@ class Molecule(pybel.Molecule):
                                    if n.atomicnum == 1]] = True
 
         # Basic group
-        patt = Smarts('[$([N;H2&+0][$([C,a]);!$([C,a](=O))]),'
-                      '$([N;H1&+0]([$([C,a]);!$([C,a](=O))])[$([C,a]);!$([C,a](=O))]),'
-                      '$([N;H0&+0]([C;!$(C(=O))])([C;!$(C(=O))])[C;!$(C(=O))]),'
-                      '$([N,n;X2;+0])]')
+        patt = smarts_registry['[$([N;H2&+0][$([C,a]);!$([C,a](=O))]),'
+                               '$([N;H1&+0]([$([C,a]);!$([C,a](=O))])[$([C,a]);!$([C,a](=O))]),'
+                               '$([N;H0&+0]([C;!$(C(=O))])([C;!$(C(=O))])[C;!$(C(=O))]),'
+                               '$([N,n;X2;+0])]']
         matches = np.array(patt.findall(self)).flatten()
         if len(matches) > 0:
             atom_dict['isplus'][np.intersect1d(matches - 1, not_carbon)] = True
 
         # Acidic group
-        patt = Smarts('[$([C,S](=[O,S,P])-[O;H1])]')
+        patt = smarts_registry['[$([C,S](=[O,S,P])-[O;H1])]']
         matches = np.array(patt.findall(self)).flatten()
         if len(matches) > 0:
             atom_dict['isminus'][np.intersect1d(matches - 1, not_carbon)] = True
@@ -973,3 +1015,7 @@ class Smarts(pybel.Smarts):
         else:
             idx = np.argsort(self.amap)
             return [np.array(m)[idx].tolist() for m in matches]
+
+
+# process-wide registry of compiled SMARTS, shared by toolkit and filters
+smarts_registry = SmartsRegistry(Smarts)
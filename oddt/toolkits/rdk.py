@@ -47,7 +47,11 @@ from rdkit.Chem.AllChem import ComputeGasteigerCharges
 from rdkit.Chem.Pharm2D import Gobbi_Pharm2D, Generate
 from rdkit.Chem import CanonicalRankAtoms
 
-from oddt.toolkits.common import detect_secondary_structure, canonize_ring_path
+from oddt.toolkits.common import (detect_secondary_structure,
+                                  canonize_ring_path,
+                                  SmartsRegistry,
+                                  _attach_dicts_cache,
+                                  _load_dicts)
 from oddt.toolkits.extras.rdkit import (_sybyl_atom_type,
                                         MolFromPDBBlock,
                                         MolToPDBQTBlock,
@@ -184,7 +188,8 @@ def _filereader_pdbqt(filename, opt=None):
             yield Molecule(source={'fmt': 'pdbqt', 'string': block, 'opt': opt})
 
 
-def readfile(format, filename, lazy=False, opt=None, **kwargs):
+def readfile(format, filename, lazy=False, opt=None, dicts_cache=None,
+             **kwargs):
     """Iterate over the molecules in a file.
 
     Required parameters:
@@ -207,9 +212,23 @@ def readfile(format, filename, lazy=False, opt=None, **kwargs):
     ...
     >>> print(atomtotal)
     43
+
+    Molecules' dicts (`atom_dict`, `ring_dict`, `res_dict`) can be stored
+    in and loaded from an on-disk cache, which saves rebuilding them for
+    receptors used over and over again:
+        mol = next(readfile("pdb", "receptor.pdb", dicts_cache="cache_dir"))
+
+    `dicts_cache` is a directory path or `oddt.toolkits.common.DictsCache`.
     """
     if not os.path.isfile(filename):
         raise IOError("No such file: '%s'" % filename)
+    if dicts_cache is not None:
+        # reader options change parsed molecules, hence are a part of a key
+        options = dict(kwargs, format=format.lower(), opt=dict(opt or {}))
+        return _attach_dicts_cache(readfile(format, filename, lazy=lazy,
+                                            opt=opt, **kwargs),
+                                   dicts_cache, filename, backend, __version__,
+                                   options)
     format = format.lower()
     # Eagerly evaluate the supplier functions in order to report
     # errors in the format and errors in opening the file.
@@ -385,6 +404,7 @@ class Molecule(object):
         self._ring_dict = None
         self._coords = None
         self._charges = None
+        self._dicts_cache = None  # (DictsCache, key) of on-disk dicts
         self._residues = None
         # lazy
         self._source = source  # dict with keys: n, fmt, string, filename
@@ -465,6 +485,7 @@ class Molecule(object):
         # clear cache
         self._coords = None
         self._atom_dict = None
+        self._dicts_cache = None
 
     @property
     def charges(self):
@@ -485,6 +506,8 @@ class Molecule(object):
         self._coords = None
         self._charges = None
         self._residues = None
+        # the molecule has changed, on-disk dicts are no longer valid
+        self._dicts_cache = None
 
     @property
     def residues(self):
@@ -528,7 +551,10 @@ class Molecule(object):
     @protein.setter
     def protein(self, protein):
         """atom_dict caches must be cleared due to property change"""
+        dicts_cache = self._dicts_cache
         self._clear_cache()
+        # protein flag is a part of the on-disk cache key
+        self._dicts_cache = dicts_cache
         self._protein = protein
 
     @property
@@ -554,21 +580,21 @@ class Molecule(object):
     def atom_dict(self):
         # check cache and generate dicts
         if self._atom_dict is None:
-            self._dicts()
+            _load_dicts(self)
         return self._atom_dict
 
     @property
     def res_dict(self):
         # check cache and generate dicts
         if self._res_dict is None:
-            self._dicts()
+            _load_dicts(self)
         return self._res_dict
 
     @property
     def ring_dict(self):
         # check cache and generate dicts
         if self._ring_dict is None:
-            self._dicts()
+            _load_dicts(self)
         return self._ring_dict
 
     @property
@@ -663,94 +689,113 @@ class Molecule(object):
                       ('isbeta', bool),
                       ]
 
-        atom_dict = np.empty(self.Mol.GetNumAtoms(), dtype=atom_dtype)
+        num_atoms = self.Mol.GetNumAtoms()
+        atom_dict = np.zeros(num_atoms, dtype=atom_dtype)
         metals = [3, 4, 11, 12, 13, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29,
                   30, 31, 37, 38, 39, 40, 41, 42, 43, 44, 45, 46, 47, 48, 49,
                   50, 55, 56, 57, 58, 59, 60, 61, 62, 63, 64, 65, 66, 67, 68,
                   69, 70, 71, 72, 73, 74, 75, 76, 77, 78, 79, 80, 81, 82, 83,
                   87, 88, 89, 90, 91, 92, 93, 94, 95, 96, 97, 98, 99, 100, 101,
                   102, 103]
-        for i, atom in enumerate(self.atoms):
-
-            atomicnum = atom.atomicnum
-            partialcharge = atom.partialcharge
-            coords = atom.coords
-            atomtype = (atom.Atom.GetProp("_TriposAtomType")
-                        if atom.Atom.HasProp("_TriposAtomType")
-                        else _sybyl_atom_type(atom.Atom))
-            if self.protein:
-                residue = atom.Atom.GetMonomerInfo()
-            else:
-                residue = False
-
-            # get neighbors, but only for those atoms which realy need them
-            neighbors = np.zeros(max_neighbors, dtype=[('id', np.int16),
-                                                       ('coords', np.float32, 3),
-                                                       ('atomicnum', np.int8)])
-            neighbors['coords'].fill(np.nan)
-            for n, nbr_atom in enumerate(atom.neighbors):
-                if n >= max_neighbors:
-                    warnings.warn('Error while parsing molecule "%s" '
-                                  'for `atom_dict`. Atom #%i (%s) has %i '
-                                  'neighbors (max_neighbors=%i). Additional '
-                                  'neighbors are ignored.' % (self.title,
-                                                              atom.idx0,
-                                                              atomtype,
-                                                              len(atom.neighbors),
-                                                              max_neighbors),
-                                  UserWarning)
-                    break
-                neighbors[n] = (nbr_atom.idx0, nbr_atom.coords, nbr_atom.atomicnum)
-            assert i == atom.idx0
-            atom_dict[i] = (atom.idx0,
-                            coords,
-                            elementtable.GetRvdw(atomicnum),
-                            partialcharge if atomicnum > 1 else 0,
-                            atomicnum,
-                            atomtype,
-                            np.clip(atom.Atom.GetHybridization() - 1, 0, 3),
-                            neighbors['id'],
-                            neighbors['coords'],
-                            # residue info
-                            0,  # RDKit does not support residue indexing
-                            residue.GetResidueNumber() if residue else 0,
-                            residue.GetResidueName().strip() if residue else '',
-                            False,  # is backbone
-                            # atom properties
-                            False,  # IsHbondAcceptor
-                            False,  # IsHbondDonor,
-                            False,  # IsHbondDonorH,
-                            atomicnum in metals,
-                            atomicnum == 6 and np.in1d(neighbors['atomicnum'], [6, 1, 0]).all(),  # hydrophobe
-                            atom.Atom.GetIsAromatic(),
-                            atom.formalcharge < 0,  # is charged (minus)
-                            atom.formalcharge > 0,  # is charged (plus)
-                            atomicnum in [9, 17, 35, 53],  # is halogen?
-                            False,  # alpha
-                            False  # beta
-                            )
+        rdkit_atoms = list(self.Mol.GetAtoms())
+        atomicnum = np.array([atom.GetAtomicNum() for atom in rdkit_atoms],
+                             dtype=int)
+        if self.Mol.GetNumConformers():
+            coords = self.Mol.GetConformer().GetPositions()
+        else:
+            coords = np.zeros((num_atoms, 3))
+        # share SMARTS matches between atoms while assigning sybyl types
+        matches_cache = {}
+        atomtype = [atom.GetProp('_TriposAtomType')
+                    if atom.HasProp('_TriposAtomType')
+                    else _sybyl_atom_type(atom, matches_cache)
+                    for atom in rdkit_atoms]
+        formalcharge = np.array([atom.GetFormalCharge()
+                                 for atom in rdkit_atoms], dtype=int)
+
+        # Neighbors table from the bond list. Directed edges are sorted by the
+        # atom and the bond index, which is the order of `atom.GetNeighbors()`
+        bonds = np.array([(bond.GetBeginAtomIdx(), bond.GetEndAtomIdx())
+                          for bond in self.Mol.GetBonds()],
+                         dtype=int).reshape(-1, 2)
+        edge_atom = np.hstack((bonds[:, 0], bonds[:, 1]))
+        edge_nbr = np.hstack((bonds[:, 1], bonds[:, 0]))
+        order = np.lexsort((np.tile(np.arange(len(bonds)), 2), edge_atom))
+        edge_atom = edge_atom[order]
+        edge_nbr = edge_nbr[order]
+        degree = np.bincount(edge_atom, minlength=num_atoms)
+        edge_rank = np.arange(len(edge_atom)) - (np.cumsum(degree) - degree)[edge_atom]
+        for idx in np.argwhere(degree > max_neighbors).flatten():
+            warnings.warn('Error while parsing molecule "%s" '
+                          'for `atom_dict`. Atom #%i (%s) has %i '
+                          'neighbors (max_neighbors=%i). Additional '
+                          'neighbors are ignored.' % (self.title,
+                                                      idx,
+                                                      atomtype[idx],
+                                                      degree[idx],
+                                                      max_neighbors),
+                          UserWarning)
+        mask = edge_rank < max_neighbors
+        edge_atom = edge_atom[mask]
+        edge_nbr = edge_nbr[mask]
+        edge_rank = edge_rank[mask]
+        neighbors_atomicnum = np.zeros((num_atoms, max_neighbors), dtype=int)
+        neighbors_atomicnum[edge_atom, edge_rank] = atomicnum[edge_nbr]
+        atom_dict['neighbors_id'][edge_atom, edge_rank] = edge_nbr
+        atom_dict['neighbors'].fill(np.nan)
+        atom_dict['neighbors'][edge_atom, edge_rank] = coords[edge_nbr]
+
+        atom_dict['id'] = np.arange(num_atoms)
+        atom_dict['coords'] = coords
+        radius = dict((num, elementtable.GetRvdw(int(num)))
+                      for num in np.unique(atomicnum))
+        atom_dict['radius'] = [radius[num] for num in atomicnum]
+        atom_dict['charge'] = [Atom(atom).partialcharge for atom in rdkit_atoms]
+        atom_dict['charge'][atomicnum <= 1] = 0
+        atom_dict['atomicnum'] = atomicnum
+        atom_dict['atomtype'] = atomtype
+        atom_dict['hybridization'] = np.clip(
+            [int(atom.GetHybridization()) - 1 for atom in rdkit_atoms], 0, 3)
+        # residue info (RDKit does not support residue indexing)
+        if self.protein:
+            residues = [atom.GetMonomerInfo() for atom in rdkit_atoms]
+            atom_dict['resnum'] = [residue.GetResidueNumber() if residue else 0
+                                   for residue in residues]
+            atom_dict['resname'] = [residue.GetResidueName().strip()
+                                    if residue else ''
+                                    for residue in residues]
+        # atom properties
+        atom_dict['ismetal'] = np.in1d(atomicnum, metals)
+        atom_dict['ishydrophobe'] = ((atomicnum == 6) &
+                                     np.in1d(neighbors_atomicnum, [6, 1, 0])
+                                     .reshape(num_atoms, max_neighbors)
+                                     .all(axis=1))
+        atom_dict['isaromatic'] = [atom.GetIsAromatic() for atom in rdkit_atoms]
+        atom_dict['isminus'] = formalcharge < 0
+        atom_dict['isplus'] = formalcharge > 0
+        atom_dict['ishalogen'] = np.in1d(atomicnum, [9, 17, 35, 53])
 
         not_carbon = np.argwhere(~np.in1d(atom_dict['atomicnum'], [1, 6])).flatten()
         # Acceptors
-        patt = Chem.MolFromSmarts('[$([O;H1;v2]),'
-                                  '$([O;H0;v2;!$(O=N-*),'
-                                  '$([O;-;!$(*-N=O)]),'
-                                  '$([o;+0])]),'
-                                  '$([n;+0;!X3;!$([n;H1](cc)cc),'
-                                  '$([$([N;H0]#[C&v4])]),'
-                                  '$([N&v3;H0;$(Nc)])]),'
-                                  '$([F;$(F-[#6]);!$(FC[F,Cl,Br,I])])]')
+        patt = smarts_registry['[$([O;H1;v2]),'
+                               '$([O;H0;v2;!$(O=N-*),'
+                               '$([O;-;!$(*-N=O)]),'
+                               '$([o;+0])]),'
+                               '$([n;+0;!X3;!$([n;H1](cc)cc),'
+                               '$([$([N;H0]#[C&v4])]),'
+                               '$([N&v3;H0;$(Nc)])]),'
+                               '$([F;$(F-[#6]);!$(FC[F,Cl,Br,I])])]'].rdksmarts
         matches = np.array(self.Mol.GetSubstructMatches(patt, maxMatches=5000)).flatten()
         if len(matches) > 0:
             atom_dict['isacceptor'][np.intersect1d(matches, not_carbon)] = True
 
         # Donors
-        patt = Chem.MolFromSmarts('[$([N&!H0&v3,N&!H0&+1&v4,n&H1&+0,$([$([Nv3](-C)(-C)-C)]),'
-                                  '$([$(n[n;H1]),'
-                                  '$(nc[n;H1])])]),'
-                                  # Guanidine can be tautormeic - e.g. Arginine
-                                  '$([NX3,NX2]([!O,!S])!@C(!@[NX3,NX2]([!O,!S]))!@[NX3,NX2]([!O,!S])),'
-                                  '$([O,S;H1;+0])]')
+        patt = smarts_registry['[$([N&!H0&v3,N&!H0&+1&v4,n&H1&+0,$([$([Nv3](-C)(-C)-C)]),'
+                               '$([$(n[n;H1]),'
+                               '$(nc[n;H1])])]),'
+                               # Guanidine can be tautormeic - e.g. Arginine
+                               '$([NX3,NX2]([!O,!S])!@C(!@[NX3,NX2]([!O,!S]))!@[NX3,NX2]([!O,!S])),'
+                               '$([O,S;H1;+0])]'].rdksmarts
         matches = np.array(self.Mol.GetSubstructMatches(patt, maxMatches=5000)).flatten()
         if len(matches) > 0:
             atom_dict['isdonor'][np.intersect1d(matches, not_carbon)] = True
@@ -760,16 +805,16 @@ class Molecule(object):
                                    if n.GetAtomicNum() == 1]] = True
 
         # Basic group
-        patt = Chem.MolFromSmarts('[$([N;H2&+0][$([C,a]);!$([C,a](=O))]),'
-                                  '$([N;H1&+0]([$([C,a]);!$([C,a](=O))])[$([C,a]);!$([C,a](=O))]),'
-                                  '$([N;H0&+0]([C;!$(C(=O))])([C;!$(C(=O))])[C;!$(C(=O))]),'
-                                  '$([N,n;X2;+0])]')
+        patt = smarts_registry['[$([N;H2&+0][$([C,a]);!$([C,a](=O))]),'
+                               '$([N;H1&+0]([$([C,a]);!$([C,a](=O))])[$([C,a]);!$([C,a](=O))]),'
+                               '$([N;H0&+0]([C;!$(C(=O))])([C;!$(C(=O))])[C;!$(C(=O))]),'
+                               '$([N,n;X2;+0])]'].rdksmarts
         matches = np.array(self.Mol.GetSubstructMatches(patt, maxMatches=5000)).flatten()
         if len(matches) > 0:
             atom_dict['isplus'][np.intersect1d(matches, not_carbon)] = True
 
         # Acidic group
-        patt = Chem.MolFromSmarts('[$([C,S](=[O,S,P])-[O;H1])]')
+        patt = smarts_registry['[$([C,S](=[O,S,P])-[O;H1])]'].rdksmarts
         matches = np.array(self.Mol.GetSubstructMatches(patt, maxMatches=5000)).flatten()
         if len(matches) > 0:
             atom_dict['isminus'][np.intersect1d(matches, not_carbon)] = True
@@ -790,7 +835,7 @@ class Molecule(object):
                          ('isbeta', bool)
                          ]  # N, CA, C, O
             b = []
-            aa = Chem.MolFromSmarts('NCC(-,=O)')  # amino backbone SMARTS
+            aa = smarts_registry['NCC(-,=O)'].rdksmarts  # amino backbone SMARTS
             conf = self.Mol.GetConformer()
             for residue in self.residues:
                 path = residue.Residue.GetSubstructMatch(aa)
@@ -1360,7 +1405,7 @@ class Bond(object):
         Chem.GetSSSR(self.Bond.GetOwningMol())
         if self.Bond.IsInRing():
             return False
-        rot_mol = Chem.MolFromSmarts(SMARTS_DEF['rot_bond'])
+        rot_mol = smarts_registry[SMARTS_DEF['rot_bond']].rdksmarts
         Chem.GetSSSR(rot_mol)  # MolFromSmarts don't initialize ring info
         rot_bond = rot_mol.GetBondWithIdx(0)
         if self.Bond.Match(rot_bond):
@@ -1512,6 +1557,10 @@ class Smarts(object):
         return molecule.Mol.GetSubstructMatches(self.rdksmarts, uniquify=unique)
 
 
+# process-wide registry of compiled SMARTS, shared by toolkit and filters
+smarts_registry = SmartsRegistry(Smarts)
+
+
 class MoleculeData(object):
     """Store molecule data in a dictionary-type object
 
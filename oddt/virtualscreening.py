@@ -1,24 +1,366 @@
 """ODDT pipeline framework for virtual screening"""
 from __future__ import print_function
+import os
 import sys
+import ast
 import csv
-from os.path import dirname, isfile, join
-from multiprocessing import Pool
-from itertools import chain
+import json
+import shutil
+import heapq
+from time import time
+from os.path import abspath, basename, dirname, getsize, isfile, join
+from tempfile import mkdtemp
+from multiprocessing import Pool, cpu_count
+from bisect import bisect_right
+from itertools import chain, islice
 from functools import partial
+from collections import OrderedDict, deque
 import warnings
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
 import six
-from six.moves import filter
-# from joblib import Parallel, delayed
+from six.moves import queue
+import numpy as np
+import joblib
 
 import oddt
-from oddt.utils import is_molecule, compose_iter, chunker, method_caller
+from oddt.utils import is_molecule, chunker, method_caller
 from oddt.scoring import scorer
 from oddt.fingerprints import (InteractionFingerprint,
-                               SimpleInteractionFingerprint,
-                               dice)
-from oddt.shape import usr, usr_cat, electroshape, usr_similarity
+                               SimpleInteractionFingerprint)
+from oddt.shape import usr, usr_cat, electroshape
+
+
+# pipeline attached by each worker process of `virtualscreening.fetch`
+_worker_pipe = None
+# warm-up timings of the worker, reported with its first chunk
+_worker_warmup = None
+
+
+def _cpu_time():
+    """User and system CPU time of current process"""
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _peak_rss():
+    """Peak resident set size of current process in bytes (None if unknown)"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _instrumented_compose_iter(iterable, funcs):
+    """Like `oddt.utils.compose_iter`, but also returns statistics of each
+    function: number of molecules in and out, wall and CPU time."""
+    iterable = list(iterable)
+    stats = []
+    # values of properties shared by consecutive filters
+    properties = {}
+    for func in funcs:
+        num_in = len(iterable)
+        wall_start, cpu_start = time(), _cpu_time()
+        if isinstance(func, partial) and func.func is _filter:
+            iterable = list(func(iterable, properties=properties))
+        else:
+            # other stages may change molecules
+            properties = {}
+            iterable = list(func(iterable))
+        stats.append({'in': num_in,
+                      'out': len(iterable),
+                      'wall': time() - wall_start,
+                      'cpu': _cpu_time() - cpu_start})
+    return iterable, stats
+
+
+def _stage_name(func):
+    """Human readable name of a pipeline stage"""
+    if hasattr(func, 'stage_name'):
+        return func.stage_name
+    if isinstance(func, partial):
+        if func.func is method_caller:
+            obj, methodname = func.args[:2]
+            return '%s.%s' % (obj.__class__.__name__, methodname)
+        func = func.func
+    return getattr(func, '__name__', func.__class__.__name__)
+
+
+def _warm_up_stage(func):
+    """Build lazy caches (e.g. receptors' dicts) of objects used by a stage,
+    so they are ready before the first chunk of ligands arrives."""
+    if isinstance(func, partial):
+        for obj in list(func.args) + list((func.keywords or {}).values()):
+            _warm_up_stage(obj)
+    else:
+        for mol in (func, getattr(func, 'protein', None)):
+            if is_molecule(mol):
+                mol.atom_dict
+
+
+def _warm_up_pipe(pipe):
+    """Warm up all stages of a pipeline. Returns a list of (stage, seconds)."""
+    warmup = []
+    for func in pipe:
+        start = time()
+        _warm_up_stage(func)
+        warmup.append((_stage_name(func), time() - start))
+    return warmup
+
+
+def _init_worker_pipe(pipe_filename):
+    """Pool initializer loading the pipeline dumped by `fetch`. Numpy arrays
+    (e.g. receptor's dicts, models' coefficients) are memory-mapped, hence
+    shared by all workers instead of being copied to each of them. Mode 'c'
+    (copy-on-write) keeps arrays writable for code expecting so."""
+    global _worker_pipe, _worker_warmup
+    start = time()
+    _worker_pipe = joblib.load(pipe_filename, mmap_mode='c')
+    _worker_warmup = [('load', time() - start)] + _warm_up_pipe(_worker_pipe)
+
+
+def _run_worker_pipe(task):
+    """Apply attached pipeline to a chunk of ligands. Exceptions are returned
+    (instead of timings) to be re-raised in the parent process."""
+    global _worker_warmup
+    idx, submitted, chunk = task
+    start = time()
+    try:
+        result, stages = _instrumented_compose_iter(chunk, _worker_pipe)
+    except Exception as e:
+        return idx, e, None, None
+    end = time()
+    warmup, _worker_warmup = _worker_warmup, None
+    chunk_timing = {'pid': os.getpid(),
+                    'size': len(chunk),
+                    'queued': start - submitted,
+                    'compute': end - start,
+                    'finished': end,
+                    'stages': stages,
+                    'peak_rss': _peak_rss()}
+    return idx, result, chunk_timing, warmup
+
+
+class _ChunkSizer(object):
+    def __init__(self, chunksize, chunk_time, max_chunksize=None,
+                 smoothing=0.3):
+        """Adapt the size of chunks, so that processing of a chunk takes
+        about `chunk_time` seconds. Per ligand time is estimated by an
+        exponential moving average of observed chunks."""
+        self.chunksize = chunksize
+        self.chunk_time = chunk_time
+        self.max_chunksize = max_chunksize or 10 * chunksize
+        self.smoothing = smoothing
+        self._ligand_time = None
+
+    def __call__(self):
+        return self.chunksize
+
+    def update(self, size, seconds):
+        if size == 0:
+            return
+        ligand_time = seconds / size
+        if self._ligand_time is None:
+            self._ligand_time = ligand_time
+        else:
+            self._ligand_time += self.smoothing * (ligand_time -
+                                                   self._ligand_time)
+        chunksize = self.chunk_time / max(self._ligand_time, 1e-6)
+        self.chunksize = int(min(max(round(chunksize), 1),
+                                 self.max_chunksize))
+
+
+class _Checkpoint(object):
+    def __init__(self, filename):
+        """Progress of a virtual screening run: ranges [start, stop) of input
+        molecules indices which were processed and which output was written,
+        and sizes of output files at that point. Stored as JSON."""
+        self.filename = filename
+        self.done = []
+        self.outputs = {}
+        if isfile(filename):
+            with open(filename) as f:
+                data = json.load(f)
+            self.done = [tuple(r) for r in data['done']]
+            self.outputs = data['outputs']
+        self._starts = [start for start, _ in self.done]
+
+    def __contains__(self, idx):
+        i = bisect_right(self._starts, idx) - 1
+        return i >= 0 and idx < self.done[i][1]
+
+    def add(self, indices):
+        """Mark molecules of given indices as processed"""
+        ranges = list(self.done)
+        for idx in sorted(indices):
+            if ranges and ranges[-1][1] == idx:
+                ranges[-1] = (ranges[-1][0], idx + 1)
+            else:
+                ranges.append((idx, idx + 1))
+        # merge adjacent and overlapping ranges
+        self.done = []
+        for start, stop in sorted(ranges):
+            if self.done and start <= self.done[-1][1]:
+                self.done[-1] = (self.done[-1][0],
+                                 max(stop, self.done[-1][1]))
+            else:
+                self.done.append((start, stop))
+        self._starts = [start for start, _ in self.done]
+
+    def truncate_output(self, filename):
+        """Truncate output file to its size at the last checkpoint, or empty
+        it if it was not written yet. Returns the resulting size."""
+        size = self.outputs.get(abspath(filename), 0)
+        if size and (not isfile(filename) or getsize(filename) < size):
+            raise IOError('Output file "%s" is missing or shorter than '
+                          'recorded in checkpoint "%s".'
+                          % (filename, self.filename))
+        with open(filename, 'ab') as f:
+            f.truncate(size)
+        self.outputs[abspath(filename)] = size
+        return size
+
+    def save(self):
+        """Atomically save checkpoint. All recorded outputs are synced to disk
+        first."""
+        for filename in self.outputs:
+            with open(filename, 'ab') as f:
+                os.fsync(f.fileno())
+            self.outputs[filename] = getsize(filename)
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump({'done': self.done, 'outputs': self.outputs}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.name == 'nt' and isfile(self.filename):
+            os.remove(self.filename)
+        os.rename(tmp_filename, self.filename)
+
+
+def _adaptive_chunker(iterable, sizer):
+    """Generate chunks of sizes given by `sizer` at the time of their
+    creation."""
+    iterable = iter(iterable)
+    chunk = list(islice(iterable, sizer()))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterable, sizer()))
+
+
+def _parallel_pipe(pipe, chunks, n_cpu, timings, ordered=True,
+                   max_inflight=None, sizer=None):
+    """Run pipeline over chunks in a pool of processes. The pipeline is
+    dumped once to a temporary file, so only ligands are sent per chunk.
+    At most `max_inflight` chunks are submitted and not yet yielded, which
+    bounds the memory used by the queues (and the reordering buffer).
+    Yields pairs of chunk index and result."""
+    n_workers = n_cpu if n_cpu > 0 else cpu_count()
+    if max_inflight is None:
+        max_inflight = 2 * n_workers
+    tmp_dir = mkdtemp(prefix='oddt_vs_')
+    pipe_filename = join(tmp_dir, 'pipe.pkl')
+    joblib.dump(pipe, pipe_filename)
+    pool = Pool(n_workers,
+                initializer=_init_worker_pipe,
+                initargs=(pipe_filename,))
+    try:
+        chunks = iter(chunks)
+        finished = queue.Queue()
+        # errors raised outside of the pipeline (e.g. unpicklable results)
+        if six.PY3:
+            error_callback = {'error_callback': lambda e: finished.put(
+                (None, e, None, None))}
+        else:
+            error_callback = {}
+        done = {}  # finished chunks waiting for their turn (ordered mode)
+        num_submitted = 0
+        num_yielded = 0
+        exhausted = False
+        while True:
+            while not exhausted and num_submitted - num_yielded < max_inflight:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pool.apply_async(_run_worker_pipe,
+                                 ((num_submitted, time(), chunk),),
+                                 callback=finished.put,
+                                 **error_callback)
+                num_submitted += 1
+            if num_yielded == num_submitted:
+                break
+
+            idx, result, chunk_timing, warmup = finished.get()
+            if chunk_timing is None:
+                raise result
+            chunk_timing['transfer'] = time() - chunk_timing.pop('finished')
+            timings['chunks'].append(chunk_timing)
+            if warmup is not None:
+                timings['warmup'].append({'pid': chunk_timing['pid'],
+                                          'stages': warmup})
+            if sizer is not None:
+                sizer.update(chunk_timing['size'], chunk_timing['compute'])
+
+            if ordered:
+                done[idx] = result
+                while num_yielded in done:
+                    result = done.pop(num_yielded)
+                    num_yielded += 1
+                    yield num_yielded - 1, result
+            else:
+                num_yielded += 1
+                yield idx, result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _serial_pipe(pipe, chunks, timings, sizer=None):
+    """Run pipeline over chunks in the current process. Yields pairs of
+    chunk index and result."""
+    timings['warmup'].append({'pid': os.getpid(),
+                              'stages': _warm_up_pipe(pipe)})
+    for idx, chunk in enumerate(chunks):
+        start = time()
+        result, stages = _instrumented_compose_iter(chunk, pipe)
+        chunk_timing = {'pid': os.getpid(),
+                        'size': len(chunk),
+                        'queued': 0.,
+                        'compute': time() - start,
+                        'transfer': 0.,
+                        'stages': stages,
+                        'peak_rss': _peak_rss()}
+        timings['chunks'].append(chunk_timing)
+        if sizer is not None:
+            sizer.update(chunk_timing['size'], chunk_timing['compute'])
+        yield idx, result
+
+
+def _mol_csv_data(mol):
+    """Molecule's data to be written to CSV, without some internal
+    toolkits' fields. None if there is no data."""
+    data = mol.data.to_dict()
+    # filter some internal data
+    blacklist_keys = ['OpenBabel Symmetry Classes',
+                      'MOL Chiral Flag',
+                      'PartialCharges',
+                      'TORSDO',
+                      'REMARK']
+    for b in blacklist_keys:
+        if b in data:
+            del data[b]
+    if len(data) > 0:
+        data['name'] = mol.title
+        return data
+    return None
 
 
 def _filter_smarts(mols, smarts, soft_fail=0):
@@ -28,11 +370,11 @@ def _filter_smarts(mols, smarts, soft_fail=0):
     out = []
     for mol in mols:
         if isinstance(smarts, six.string_types):
-            compiled_smarts = oddt.toolkit.Smarts(smarts)
+            compiled_smarts = oddt.toolkit.smarts_registry[smarts]
             if len(compiled_smarts.findall(mol)) == 0:
                 out.append(mol)
         else:
-            compiled_smarts = [oddt.toolkit.Smarts(s) for s in smarts]
+            compiled_smarts = [oddt.toolkit.smarts_registry[s] for s in smarts]
             fail = 0
             for s in compiled_smarts:
                 if len(s.findall(mol)) > 0:
@@ -44,35 +386,181 @@ def _filter_smarts(mols, smarts, soft_fail=0):
     return out
 
 
-def _filter(mols, expression, soft_fail=0):
-    """Filter molecule by a generic expression, such as `mol.logp > 1`."""
+def _mol_property(properties, mol, name):
+    """Value of molecule's attribute, memoized in `properties` dict (keyed by
+    molecules), so it is shared by all filters in one pass of the pipeline.
+    Methods are not memoized."""
+    properties = properties.setdefault(mol, {})
+    try:
+        return properties[name]
+    except KeyError:
+        value = getattr(mol, name)
+        if not callable(value):
+            properties[name] = value
+        return value
+
+
+class _MemoizeProperties(ast.NodeTransformer):
+    """Replaces `mol.<name>` lookups with memoized `_mol_property` calls"""
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        if (isinstance(node.value, ast.Name) and node.value.id == 'mol' and
+                isinstance(node.ctx, ast.Load)):
+            call = ast.parse('_mol_property(_properties, mol, %r)'
+                             % node.attr, mode='eval').body
+            return ast.copy_location(call, node)
+        return node
+
+
+class _Expression(object):
+    def __init__(self, source):
+        """Filter expression, such as `mol.logp > 1`, compiled once. Names of
+        molecule's properties it references are stored in `properties`,
+        their values are memoized. Only the source is pickled, the code is
+        recompiled on unpickling."""
+        self.source = source
+        self._compile()
+
+    def _compile(self):
+        tree = ast.parse(self.source, mode='eval')
+        self.properties = frozenset(
+            node.attr for node in ast.walk(tree)
+            if (isinstance(node, ast.Attribute) and
+                isinstance(node.value, ast.Name) and node.value.id == 'mol'))
+        tree = ast.fix_missing_locations(_MemoizeProperties().visit(tree))
+        self.code = compile(tree, '<filter>', 'eval')
+
+    def __call__(self, mol, properties=None):
+        """Evaluate the expression, memoizing properties of the molecule in
+        `properties` dict if given"""
+        if properties is None:
+            properties = {}
+        return eval(self.code, globals(), {'mol': mol,
+                                           '_properties': properties})
+
+    def __getstate__(self):
+        return {'source': self.source}
+
+    def __setstate__(self, state):
+        self.source = state['source']
+        self._compile()
+
+
+def _filter(mols, expression, soft_fail=0, properties=None):
+    """Filter molecule by a generic expression, such as `mol.logp > 1`.
+    Expressions can be passed as strings or `_Expression`s. Values of
+    molecules' properties are memoized in `properties` dict, which can be
+    shared by consecutive filters."""
+    if properties is None:
+        properties = {}
+    if isinstance(expression, list):
+        expression = [e if isinstance(e, _Expression) else _Expression(e)
+                      for e in expression]
+    elif not isinstance(expression, _Expression):
+        expression = _Expression(expression)
     out = []
     for mol in mols:
         if isinstance(expression, list):
             fail = 0
             for e in expression:
-                if not eval(e):
+                if not e(mol, properties):
                     fail += 1
                 if fail > soft_fail:
                     break
             if fail <= soft_fail:
                 out.append(mol)
         else:
-            if eval(expression):
+            if expression(mol, properties):
                 out.append(mol)
     return out
 
 
-def _filter_similarity(mols, distance, generator, query_fps, cutoff):
-    """Filter molecules by a certain distance to the reference fingerprints.
-    User must supply distance funtion, FP generator, query FPs and cutoff."""
-    return list(filter(
-        lambda q: any(distance(generator(q), q_fp) >= float(cutoff)
-                      for q_fp in query_fps), mols))
+def _filter_similarity(mols, distance, generator, query_fps, cutoff,
+                       fusion='max', data_field=None):
+    """Filter molecules by a certain similarity to the reference fingerprints.
+    User must supply similarity funtion comparing two matrices of FPs, FP
+    generator, query FPs (as a matrix) and cutoff. Each molecule's FP is
+    generated once and similarities to all queries are fused by `max` or
+    `mean`."""
+    mols = list(mols)
+    if not mols:
+        return []
+    fps = np.array([generator(mol) for mol in mols])
+    sims = distance(fps, query_fps)
+    scores = sims.max(axis=1) if fusion == 'max' else sims.mean(axis=1)
+    out = []
+    for mol, score, best_query in zip(mols, scores, sims.argmax(axis=1)):
+        if score >= float(cutoff):
+            if data_field:
+                mol.data[data_field] = score
+                mol.data[data_field + '_query'] = best_query
+            out.append(mol)
+    return out
+
+
+def _dice_matrix(fps, query_fps):
+    """Dice similarity of dense FPs, for all pairs of rows of two matrices"""
+    fps = np.asarray(fps, dtype=float)
+    query_fps = np.asarray(query_fps, dtype=float)
+    common = np.minimum(fps[:, np.newaxis], query_fps[np.newaxis]).sum(axis=2)
+    denominator = fps.sum(axis=1)[:, np.newaxis] + query_fps.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sims = 2 * common / denominator
+    sims[denominator == 0] = 0.
+    return sims
+
+
+def _usr_similarity_matrix(shapes, query_shapes):
+    """USR-like similarity (USR, USRCAT with default weights, Electroshape)
+    for all pairs of rows of two matrices"""
+    diff = np.abs(shapes[:, np.newaxis] - query_shapes[np.newaxis])
+    return 1. / (1. + diff.mean(axis=2))
+
+
+def _top_score(mol, key):
+    """Score of a molecule used by `virtualscreening.top`, None if missing"""
+    if callable(key):
+        score = key(mol)
+    elif key in mol.data:
+        score = mol.data[key]
+    else:
+        return None
+    if score is None:
+        return None
+    score = float(score)
+    return None if np.isnan(score) else score
+
+
+def _top_chunk(mols, n, key, ascending=False):
+    """Select `n` best scored molecules of a chunk"""
+    scored = [(score, mol) for score, mol in
+              ((_top_score(mol, key), mol) for mol in mols)
+              if score is not None]
+    select = heapq.nsmallest if ascending else heapq.nlargest
+    return [mol for _, mol in select(n, scored, key=lambda x: x[0])]
+
+
+def _top_merge(chunks, n, key, ascending=False):
+    """Merge (index, chunk) pairs of pre-selected molecules into `n` best ones
+    using a heap. Ties are resolved by input order, so the result does not
+    depend on the order of chunks. Yields a single (None, molecules) pair
+    once chunks are exhausted."""
+    sign = 1 if ascending else -1
+    heap = []  # the worst of kept molecules is on top
+    for idx, mols in chunks:
+        for pos, mol in enumerate(mols):
+            entry = (-sign * _top_score(mol, key), -idx, -pos, mol)
+            if len(heap) < n:
+                heapq.heappush(heap, entry)
+            elif entry[:3] > heap[0][:3]:
+                heapq.heapreplace(heap, entry)
+    yield None, [entry[3] for entry in sorted(heap, key=lambda e: e[:3],
+                                              reverse=True)]
 
 
 class virtualscreening:
-    def __init__(self, n_cpu=-1, verbose=False, chunksize=100):
+    def __init__(self, n_cpu=-1, verbose=False, chunksize=100,
+                 checkpoint=None):
         """Virtual Screening pipeline stack
 
         Parameters
@@ -81,7 +569,22 @@ class virtualscreening:
             The number of parallel procesors to use
 
         verbose: bool (default=False)
-            Verbosity flag for some methods
+            Verbosity flag for some methods. When set, the summary of
+            timings is printed to stderr once the pipeline is exhausted.
+
+        chunksize: int (default=100)
+            The number of ligands processed at once by a worker.
+
+        checkpoint: str or None (default=None)
+            Path to a checkpoint file. If set, `write` and `write_csv` record
+            which input molecules (counted across all `load_ligands` calls)
+            were processed, after their output is written. If the file
+            exists, the run is resumed: `load_ligands` skips processed
+            molecules and output is appended to files truncated to their size
+            at the last checkpoint. The pipeline and input has to be the same
+            as in the interrupted run.
+
+            .. versionadded:: 0.7
         """
         self._pipe = []
         self._mol_feed = []
@@ -90,6 +593,20 @@ class virtualscreening:
         self.num_output = 0
         self.verbose = verbose
         self.chunksize = chunksize
+        # timings of the last `fetch`
+        self.timings = None
+        self._checkpoint = _Checkpoint(checkpoint) if checkpoint else None
+        # indices of loaded molecules, consumed along with the feed
+        self._num_loaded = 0
+        self._feed_indices = deque()
+
+    def _add_stage(self, func, name):
+        """Append a function to the pipeline, labeled for reports"""
+        if self._pipe and getattr(self._pipe[-1], 'func', None) is _top_chunk:
+            raise ValueError('top() has to be the last stage of the '
+                             'pipeline.')
+        func.stage_name = name
+        self._pipe.append(func)
 
     def load_ligands(self, fmt, ligands_file, **kwargs):
         """Loads file with ligands.
@@ -108,10 +625,20 @@ class virtualscreening:
                 kwargs['opt']['c'] = None
             else:
                 kwargs['opt'] = {'c': None}
-        self._mol_feed = chain(self._mol_feed,
-                               oddt.toolkit.readfile(fmt,
-                                                     ligands_file,
-                                                     **kwargs))
+        mols = oddt.toolkit.readfile(fmt, ligands_file, **kwargs)
+        if self._checkpoint is not None:
+            mols = self._skip_processed(mols)
+        self._mol_feed = chain(self._mol_feed, mols)
+
+    def _skip_processed(self, mols):
+        """Skip molecules processed according to checkpoint and keep track of
+        indices of the remaining ones"""
+        for mol in mols:
+            idx = self._num_loaded
+            self._num_loaded += 1
+            if idx not in self._checkpoint:
+                self._feed_indices.append(idx)
+                yield mol
 
     def apply_filter(self, expression, soft_fail=0):
         """Filtering method, can use raw expressions (strings to be evaled
@@ -130,26 +657,36 @@ class virtualscreening:
         soft_fail: int (default=0)
             The number of faulures molecule can have to pass filter, aka.
             soft-fails.
+
+        Notes
+        -----
+        Expressions are compiled once. Values of molecule's properties they
+        reference are computed once per molecule and shared by all filters
+        of the pipeline.
         """
         if expression in ['l5', 'ro5', 'ro3', 'pains']:
             # define presets
             # TODO: move presets to another config file
             # Lipinski rule of 5's
             if expression.lower() in ['l5', 'ro5']:
-                self._pipe.append((partial(_filter,
-                                           expression=['mol.molwt < 500',
-                                                       'mol.HBA1 <= 10',
-                                                       'mol.HBD <= 5',
-                                                       'mol.logP <= 5'],
-                                           soft_fail=soft_fail)))
+                self._add_stage(partial(_filter,
+                                        expression=[
+                                            _Expression('mol.molwt < 500'),
+                                            _Expression('mol.HBA1 <= 10'),
+                                            _Expression('mol.HBD <= 5'),
+                                            _Expression('mol.logP <= 5')],
+                                        soft_fail=soft_fail),
+                                'apply_filter(%s)' % expression.lower())
             # Rule of three
             elif expression.lower() == 'ro3':
-                self._pipe.append((partial(_filter,
-                                           expression=['mol.molwt < 300',
-                                                       'mol.HBA1 <= 3',
-                                                       'mol.HBD <= 3',
-                                                       'mol.logP <= 3'],
-                                           soft_fail=soft_fail)))
+                self._add_stage(partial(_filter,
+                                        expression=[
+                                            _Expression('mol.molwt < 300'),
+                                            _Expression('mol.HBA1 <= 3'),
+                                            _Expression('mol.HBD <= 3'),
+                                            _Expression('mol.logP <= 3')],
+                                        soft_fail=soft_fail),
+                                'apply_filter(ro3)')
             # PAINS filter
             elif expression.lower() == 'pains':
                 pains_smarts = {}
@@ -159,15 +696,22 @@ class virtualscreening:
                     for line in csv_reader:
                         if len(line) > 1:
                             pains_smarts[line[1][8:-2]] = line[0]
-                self._pipe.append((partial(_filter_smarts,
-                                           smarts=list(pains_smarts.values()),
-                                           soft_fail=soft_fail)))
+                self._add_stage(partial(_filter_smarts,
+                                        smarts=list(pains_smarts.values()),
+                                        soft_fail=soft_fail),
+                                'apply_filter(pains)')
         else:
-            self._pipe.append((partial(_filter,
-                                       expression=expression,
-                                       soft_fail=soft_fail)))
+            if isinstance(expression, list):
+                expression = [_Expression(e) for e in expression]
+            else:
+                expression = _Expression(expression)
+            self._add_stage(partial(_filter,
+                                    expression=expression,
+                                    soft_fail=soft_fail),
+                            'apply_filter')
 
-    def similarity(self, method, query, cutoff=0.9, protein=None):
+    def similarity(self, method, query, cutoff=0.9, protein=None,
+                   fusion='max', data_field=None):
         """Similarity filter. Supported structural methods:
             * ift: interaction fingerprints
             * sift: simple interaction fingerprints
@@ -197,35 +741,54 @@ class virtualscreening:
             Protein for underling method. By default it's empty, but
             sturctural fingerprints need one.
 
+        fusion: string (default='max')
+            How similarities to multiple query molecules are combined:
+            `max` (the most similar query) or `mean`.
+
+            .. versionadded:: 0.7
+
+        data_field: string or None (default=None)
+            If set, the fused similarity is stored in `mol.data[data_field]`
+            and the index of the most similar query in
+            `mol.data[data_field + '_query']`.
+
+            .. versionadded:: 0.7
+
         """
+        if fusion not in ('max', 'mean'):
+            raise ValueError('Fusion "%s" is not supported, use "max" or '
+                             '"mean".' % fusion)
         if is_molecule(query):
             query = [query]
 
         # choose fp/usr and appropriate distance
         if method.lower() == 'ifp':
             gen = partial(InteractionFingerprint, protein=protein)
-            dist = dice
+            dist = _dice_matrix
         elif method.lower() == 'sifp':
             gen = partial(SimpleInteractionFingerprint, protein=protein)
-            dist = dice
+            dist = _dice_matrix
         elif method.lower() == 'usr':
             gen = usr
-            dist = usr_similarity
+            dist = _usr_similarity_matrix
         elif method.lower() == 'usr_cat':
             gen = usr_cat
-            dist = usr_similarity
+            dist = _usr_similarity_matrix
         elif method.lower() == 'electroshape':
             gen = electroshape
-            dist = usr_similarity
+            dist = _usr_similarity_matrix
         else:
             raise ValueError('Similarity filter "%s" is not supported.' % method)
         # generate FPs for query molecules once
-        query_fps = [gen(q) for q in query]
-        self._pipe.append(partial(_filter_similarity,
-                                  distance=dist,
-                                  generator=gen,  # same generator for pipe mols
-                                  query_fps=query_fps,
-                                  cutoff=cutoff))
+        query_fps = np.array([gen(q) for q in query])
+        self._add_stage(partial(_filter_similarity,
+                                distance=dist,
+                                generator=gen,  # same generator for pipe mols
+                                query_fps=query_fps,
+                                cutoff=cutoff,
+                                fusion=fusion,
+                                data_field=data_field),
+                        'similarity(%s)' % method.lower())
 
     def dock(self, engine, protein, *args, **kwargs):
         """Docking procedure.
@@ -243,13 +806,14 @@ class virtualscreening:
         1. Audodock Vina (```engine="autodock_vina"```), see
         :class:`oddt.docking.autodock_vina`.
         """
+        stage_name = 'dock(%s)' % engine.lower()
         if engine.lower() == 'autodock_vina':
             from oddt.docking import autodock_vina
             engine = autodock_vina(protein, *args, **kwargs)
         else:
             raise ValueError('Docking engine %s was not implemented in ODDT'
                              % engine)
-        self._pipe.append(partial(method_caller, engine, 'dock'))
+        self._add_stage(partial(method_caller, engine, 'dock'), stage_name)
 
     def score(self, function, protein=None, *args, **kwargs):
         """Scoring procedure compatible with any scoring function implemented
@@ -330,11 +894,102 @@ class virtualscreening:
             else:
                 raise ValueError('Supplied object "%s" is not an ODDT scoring '
                                  'funtion' % function.__name__)
-        self._pipe.append(partial(method_caller, sf, 'predict_ligands'))
+        self._add_stage(partial(method_caller, sf, 'predict_ligands'),
+                        'score(%s)' % (os.path.basename(function)
+                                       if isinstance(function, six.string_types)
+                                       else sf.__class__.__name__))
+
+    def top(self, n, key, ascending=False):
+        """Keep only `n` best scored molecules. Each chunk is reduced to its
+        best molecules by the workers and the survivors are merged with a
+        heap as chunks arrive, so memory is bounded by `n` (times the number
+        of chunks in flight). Molecules are yielded (and written) sorted,
+        best first, once the whole input is processed. Has to be the last
+        stage of the pipeline.
+
+        .. versionadded:: 0.7
+
+        Parameters
+        ----------
+        n: int
+            The number of molecules to keep.
+
+        key: str or callable
+            Name of the molecule's data field with the score (e.g.
+            'vina_affinity') or a function returning the score for a molecule
+            (it has to be picklable for parallel pipelines). Molecules with a
+            missing or NaN score are discarded.
+
+        ascending: bool (default=False)
+            If True the lowest scores are the best ones (e.g. for binding
+            energies), the highest otherwise.
+        """
+        if n < 1:
+            raise ValueError('n has to be a positive integer.')
+        if self._checkpoint is not None:
+            raise ValueError('top() cannot be used with checkpointing, as the '
+                             'output is ready only after the whole input is '
+                             'processed.')
+        self._add_stage(partial(_top_chunk, n=n, key=key,
+                                ascending=ascending),
+                        'top(%i, %s)' % (n, getattr(key, '__name__', key)))
+
+    def fetch(self, ordered=True, max_inflight=None, chunk_time=None,
+              report_file=None, report_interval=60.):
+        """A method to exhaust the pipeline. Itself it is lazy (a generator)
+
+        Parameters
+        ----------
+        ordered: bool (default=True)
+            If False, chunks of ligands are yielded as soon as they are
+            processed, so a slow chunk does not stall the output. Only
+            applies to parallel (`n_cpu` != 1) pipelines.
+
+        max_inflight: int or None (default=None)
+            The maximum number of chunks submitted to workers and not yet
+            yielded (including finished chunks waiting for their turn in
+            ordered mode). Limits memory used for reading ahead. By default
+            twice the number of workers.
+
+        chunk_time: float or None (default=None)
+            If set, the chunk size is adapted (starting from `chunksize`, up
+            to 10 times that) from the observed processing time of chunks,
+            so that a chunk takes about `chunk_time` seconds.
+
+        report_file: str, file-like or None (default=None)
+            If set, `report` is periodically written (appended) to this file
+            as JSON lines. The last line is written when the pipeline is
+            exhausted (with `done` set to True).
 
-    def fetch(self):
-        """A method to exhaust the pipeline. Itself it is lazy (a generator)"""
-        chunk_feed = chunker(self._mol_feed, chunksize=self.chunksize)
+        report_interval: float (default=60.)
+            The minimal number of seconds between JSON reports.
+        """
+        chunks = self._fetch_chunks(ordered=ordered,
+                                    max_inflight=max_inflight,
+                                    chunk_time=chunk_time,
+                                    report_file=report_file,
+                                    report_interval=report_interval)
+        # merge chunks into one iterable
+        return chain.from_iterable(result for _, result in chunks)
+
+    def _fetch_chunks(self, ordered=True, max_inflight=None, chunk_time=None,
+                      report_file=None, report_interval=60.):
+        """Exhaust the pipeline chunk by chunk. Returns an iterator of pairs
+        of input molecules indices (None if not checkpointing) and chunk's
+        output. See `fetch` for parameters."""
+        if max_inflight is not None and max_inflight < 1:
+            raise ValueError('max_inflight has to be a positive integer.')
+        if chunk_time is not None:
+            sizer = _ChunkSizer(self.chunksize, chunk_time)
+            chunk_feed = _adaptive_chunker(self._mol_feed, sizer)
+        else:
+            sizer = None
+            chunk_feed = chunker(self._mol_feed, chunksize=self.chunksize)
+        if self._checkpoint is not None:
+            chunk_indices = {}
+            chunk_feed = self._track_indices(chunk_feed, chunk_indices)
+        else:
+            chunk_indices = None
         # get first chunk and check if it is saturated
         try:
             first_chunk = next(chunk_feed)
@@ -367,22 +1022,178 @@ class virtualscreening:
                 # turn off VS multiprocessing
                 self.n_cpu = 1
 
-        # TODO add some verbosity or progress bar
+        self.timings = {'stages': [_stage_name(func) for func in self._pipe],
+                        'start': time(),
+                        'done': False,
+                        'warmup': [],
+                        'chunks': []}
         if self.n_cpu != 1:
-            out = (Pool(self.n_cpu if self.n_cpu > 0 else None)
-                   .imap(partial(compose_iter, funcs=self._pipe),
-                         (chunk for chunk in chain([first_chunk], chunk_feed))))
+            out = _parallel_pipe(self._pipe,
+                                 chain([first_chunk], chunk_feed),
+                                 self.n_cpu,
+                                 self.timings,
+                                 ordered=ordered,
+                                 max_inflight=max_inflight,
+                                 sizer=sizer)
         else:
-            out = (compose_iter(chunk, self._pipe)
-                   for chunk in chain([first_chunk], chunk_feed))
+            out = _serial_pipe(self._pipe,
+                               chain([first_chunk], chunk_feed),
+                               self.timings,
+                               sizer=sizer)
 
-        # FIXME use joblib version as soon as it gets return_generator merged
-        # out = Parallel(n_jobs=self.n_cpu)(
-        #     delayed(compose_iter)(chunk, self._pipe)
-        #     for chunk in chain([first_chunk], chunk_feed))
+        out = self._monitor(out, report_file, report_interval)
+        if self._pipe and getattr(self._pipe[-1], 'func', None) is _top_chunk:
+            top = self._pipe[-1]
+            out = _top_merge(out, **top.keywords)
+        if chunk_indices is not None:
+            return ((chunk_indices.pop(idx), result) for idx, result in out)
+        return ((None, result) for _, result in out)
 
-        # merge chunks into one iterable
-        return chain.from_iterable(out)
+    def _track_indices(self, chunks, chunk_indices):
+        """Record input indices of molecules in each chunk"""
+        for idx, chunk in enumerate(chunks):
+            chunk_indices[idx] = [self._feed_indices.popleft()
+                                  for _ in chunk]
+            yield chunk
+
+    def _monitor(self, chunks, report_file=None, report_interval=60.):
+        """Pass (index, chunk) pairs through, write JSON reports and print the
+        summary (if verbose) when the pipeline is exhausted"""
+        if isinstance(report_file, six.string_types):
+            report_file = open(report_file, 'a')
+            close_report = True
+        else:
+            close_report = False
+        try:
+            last_report = time()
+            for chunk in chunks:
+                yield chunk
+                if (report_file is not None and
+                        time() - last_report >= report_interval):
+                    report_file.write(json.dumps(self.report()) + '\n')
+                    report_file.flush()
+                    last_report = time()
+            self.timings['done'] = True
+            if report_file is not None:
+                report_file.write(json.dumps(self.report()) + '\n')
+                report_file.flush()
+            if self.verbose:
+                print(self.timings_summary(), file=sys.stderr)
+        finally:
+            if close_report:
+                report_file.close()
+
+    def report(self):
+        """Structured report of the last `fetch`, aggregated over all worker
+        processes. Contains:
+
+        * `stages` - for each stage of the pipeline: molecules in and out,
+          total wall and CPU time, throughput (input molecules per second of
+          wall time), mean latency per chunk and mean warm-up time,
+        * `workers` - for each process: number of chunks and ligands,
+          computation time and peak resident set size (bytes),
+        * `overhead` - mean time chunks spent queued and being transferred,
+        * totals: `chunks`, `ligands_in`, `ligands_out`, `elapsed`, `done`.
+
+        .. versionadded:: 0.7
+
+        Returns
+        -------
+        report: dict or None
+            JSON serializable report, None if pipeline was not fetched.
+        """
+        if self.timings is None:
+            return None
+        chunks = self.timings['chunks']
+
+        stages = []
+        for i, name in enumerate(self.timings['stages']):
+            stats = [c['stages'][i] for c in chunks]
+            # workers' warm-up starts with loading the pipeline
+            warmup = [w['stages'][i - len(self.timings['stages'])][1]
+                      for w in self.timings['warmup']]
+            wall = float(sum(st['wall'] for st in stats))
+            mols_in = sum(st['in'] for st in stats)
+            stages.append(OrderedDict((
+                ('name', name),
+                ('mols_in', mols_in),
+                ('mols_out', sum(st['out'] for st in stats)),
+                ('wall', wall),
+                ('cpu', float(sum(st['cpu'] for st in stats))),
+                ('throughput', mols_in / wall if wall > 0 else None),
+                ('latency', wall / len(stats) if stats else None),
+                ('warmup', float(np.mean(warmup)) if warmup else None),
+            )))
+
+        workers = OrderedDict()
+        for c in chunks:
+            worker = workers.setdefault(c['pid'], OrderedDict((
+                ('pid', c['pid']), ('chunks', 0), ('ligands', 0),
+                ('compute', 0.), ('peak_rss', None))))
+            worker['chunks'] += 1
+            worker['ligands'] += c['size']
+            worker['compute'] += c['compute']
+            if c['peak_rss'] is not None:
+                worker['peak_rss'] = max(worker['peak_rss'] or 0,
+                                         c['peak_rss'])
+
+        overhead = OrderedDict(
+            (field, float(np.mean([c[field] for c in chunks]))
+             if chunks else None)
+            for field in ('queued', 'transfer'))
+
+        return OrderedDict((
+            ('elapsed', time() - self.timings['start']),
+            ('done', self.timings['done']),
+            ('chunks', len(chunks)),
+            ('ligands_in', sum(c['size'] for c in chunks)),
+            ('ligands_out', stages[-1]['mols_out'] if stages
+             else sum(c['size'] for c in chunks)),
+            ('stages', stages),
+            ('workers', list(workers.values())),
+            ('overhead', overhead),
+        ))
+
+    def timings_summary(self):
+        """Human readable summary of `report`: per stage counts, times,
+        throughput and warm-up, per worker peak memory and per chunk
+        overhead (time spent in queues and transferring data between
+        processes).
+
+        .. versionadded:: 0.7
+
+        Returns
+        -------
+        summary: str
+            Multiline, human readable summary.
+        """
+        report = self.report()
+        if report is None:
+            return 'Pipeline has not been fetched yet.'
+        lines = ['%-30s %8s %8s %9s %9s %10s %9s' % (
+            'stage', 'in', 'out', 'wall [s]', 'cpu [s]', 'mol/s',
+            'warm-up')]
+        for stage in report['stages']:
+            lines.append('%-30s %8i %8i %9.3f %9.3f %10s %9s' % (
+                stage['name'][:30], stage['mols_in'], stage['mols_out'],
+                stage['wall'], stage['cpu'],
+                '%.1f' % stage['throughput'] if stage['throughput'] else '-',
+                '%.3f' % stage['warmup'] if stage['warmup'] is not None
+                else '-'))
+        for worker in report['workers']:
+            lines.append('worker %-8i %5i chunks %8i ligands %9.3f s%s' % (
+                worker['pid'], worker['chunks'], worker['ligands'],
+                worker['compute'],
+                ', peak RSS %.1f MB' % (worker['peak_rss'] / 2. ** 20)
+                if worker['peak_rss'] else ''))
+        if report['chunks']:
+            lines.append('chunk overhead: queued %.3f s, transfer %.3f s'
+                         % (report['overhead']['queued'],
+                            report['overhead']['transfer']))
+        lines.append('%i chunks (%i ligands in, %i out) in %.3f s' % (
+            report['chunks'], report['ligands_in'], report['ligands_out'],
+            report['elapsed']))
+        return '\n'.join(lines)
 
     def write(self, fmt, filename, csv_filename=None, **kwargs):
         """Outputs molecules to a file
@@ -403,40 +1214,35 @@ class virtualscreening:
                 kwargs['opt']['c'] = None
             else:
                 kwargs['opt'] = {'c': None}
-        output_mol_file = oddt.toolkit.Outputfile(fmt,
-                                                  filename,
-                                                  overwrite=True,
-                                                  **kwargs)
-        if csv_filename:
-            f = open(csv_filename, 'w')
-            csv_file = None
-        for mol in self.fetch():
+        if self._checkpoint is not None:
+            if self._write_checkpointed(fmt, filename, csv_filename,
+                                        mol_kwargs=kwargs,
+                                        csv_kwargs=kwargs) is False:
+                return False
+        else:
+            output_mol_file = oddt.toolkit.Outputfile(fmt,
+                                                      filename,
+                                                      overwrite=True,
+                                                      **kwargs)
             if csv_filename:
-                data = mol.data.to_dict()
-                # filter some internal data
-                blacklist_keys = ['OpenBabel Symmetry Classes',
-                                  'MOL Chiral Flag',
-                                  'PartialCharges',
-                                  'TORSDO',
-                                  'REMARK']
-                for b in blacklist_keys:
-                    if b in data:
-                        del data[b]
-                if len(data) > 0:
-                    data['name'] = mol.title
-                else:
-                    print("There is no data to write in CSV file",
-                          file=sys.stderr)
-                    return False
-                if csv_file is None:
-                    csv_file = csv.DictWriter(f, data.keys(), **kwargs)
-                    csv_file.writeheader()
-                csv_file.writerow(data)
-            # write ligand
-            output_mol_file.write(mol)
-        output_mol_file.close()
-        if csv_filename:
-            f.close()
+                f = open(csv_filename, 'w')
+                csv_file = None
+            for mol in self.fetch():
+                if csv_filename:
+                    data = _mol_csv_data(mol)
+                    if data is None:
+                        print("There is no data to write in CSV file",
+                              file=sys.stderr)
+                        return False
+                    if csv_file is None:
+                        csv_file = csv.DictWriter(f, data.keys(), **kwargs)
+                        csv_file.writeheader()
+                    csv_file.writerow(data)
+                # write ligand
+                output_mol_file.write(mol)
+            output_mol_file.close()
+            if csv_filename:
+                f.close()
         # TODO keep_pipe using hdf5 to store molecules
         if isfile(filename):
             kwargs.pop('overwrite', None)  # this argument is unsupported
@@ -456,25 +1262,21 @@ class virtualscreening:
         keep_pipe: bool (default=False)
             If set to True, the ligand pipe is sustained.
         """
+        if self._checkpoint is not None:
+            if hasattr(csv_filename, 'write'):
+                raise ValueError('Checkpointing requires a path to the CSV '
+                                 'file, not a file object.')
+            return self._write_checkpointed(
+                csv_filename=csv_filename, fields=fields,
+                csv_kwargs=dict(kwargs, extrasaction='ignore'))
         if hasattr(csv_filename, 'write'):
             f = csv_filename
         else:
             f = open(csv_filename, 'w')
         csv_file = None
         for mol in self.fetch():
-            data = mol.data.to_dict()
-            # filter some internal data
-            blacklist_keys = ['OpenBabel Symmetry Classes',
-                              'MOL Chiral Flag',
-                              'PartialCharges',
-                              'TORSDO',
-                              'REMARK']
-            for b in blacklist_keys:
-                if b in data:
-                    del data[b]
-            if len(data) > 0:
-                data['name'] = mol.title
-            else:
+            data = _mol_csv_data(mol)
+            if data is None:
                 print("There is no data to write in CSV file", file=sys.stderr)
                 return False
             if csv_file is None:
@@ -484,3 +1286,60 @@ class virtualscreening:
             csv_file.writerow(data)
             # TODO keep_pipe using hdf5 to store molecules
         f.close()
+
+    def _write_checkpointed(self, fmt=None, filename=None, csv_filename=None,
+                            fields=None, mol_kwargs=None, csv_kwargs=None):
+        """Write output chunk by chunk and record processed input in the
+        checkpoint after each one. Output files are first truncated to their
+        size at the last checkpoint, so nothing is written twice. Molecules
+        of each chunk are written to a temporary file, which is then appended
+        to the output (toolkits' Outputfile cannot append)."""
+        mol_kwargs = mol_kwargs or {}
+        csv_kwargs = csv_kwargs or {}
+        if filename:
+            self._checkpoint.truncate_output(filename)
+            tmp_filename = join(dirname(abspath(filename)),
+                                '.oddt_chunk_' + basename(filename))
+        if csv_filename and self._checkpoint.truncate_output(csv_filename):
+            # resuming, reuse the header
+            with open(csv_filename) as f:
+                fields = next(csv.reader(f))
+            csv_header = False
+        else:
+            csv_header = True
+        # save truncated outputs, in case nothing is left to process
+        self._checkpoint.save()
+        try:
+            chunks = self._fetch_chunks()
+        except StopIteration:  # everything was already processed
+            chunks = []
+        try:
+            for indices, mols in chunks:
+                if filename and mols:
+                    output_mol_file = oddt.toolkit.Outputfile(
+                        fmt, tmp_filename, overwrite=True, **mol_kwargs)
+                    for mol in mols:
+                        output_mol_file.write(mol)
+                    output_mol_file.close()
+                    with open(tmp_filename, 'rb') as f_in, \
+                            open(filename, 'ab') as f_out:
+                        shutil.copyfileobj(f_in, f_out)
+                if csv_filename and mols:
+                    rows = [_mol_csv_data(mol) for mol in mols]
+                    if any(data is None for data in rows):
+                        print("There is no data to write in CSV file",
+                              file=sys.stderr)
+                        return False
+                    with open(csv_filename, 'a') as f:
+                        csv_file = csv.DictWriter(f, fields or rows[0].keys(),
+                                                  **csv_kwargs)
+                        if csv_header:
+                            csv_file.writeheader()
+                            fields = csv_file.fieldnames
+                            csv_header = False
+                        csv_file.writerows(rows)
+                self._checkpoint.add(indices)
+                self._checkpoint.save()
+        finally:
+            if filename and isfile(tmp_filename):
+                os.remove(tmp_filename)
@@ -1,4 +1,5 @@
 import os
+import pickle
 import numpy as np
 from scipy.sparse import vstack as sparse_vstack
 from numpy.testing import (assert_array_equal,
@@ -22,7 +23,18 @@ from oddt.fingerprints import (InteractionFingerprint,
                                csr_matrix_to_sparse,
                                dense_to_sparse,
                                dice,
-                               tanimoto)
+                               tanimoto,
+                               similarity_search,
+                               PackedFingerprints,
+                               hash32,
+                               _hash32_rows,
+                               _heavy_atom_reprs,
+                               _ECFP_atom_repr,
+                               _ECFP_atom_reprs,
+                               _ECFP_atom_hash,
+                               _ECFP_environments,
+                               _ECFP_cache)
+from oddt.interactions import ReceptorIndex
 from .utils import shuffle_mol
 
 
@@ -245,6 +257,125 @@ def test_sparse_similarity():
     assert tanimoto(np.zeros(10), np.zeros(10), sparse=False) == 0.
 
 
+def test_similarity_search():
+    """Similarity search of query fingerprints in a library"""
+    mols = list(oddt.toolkit.readfile('sdf', os.path.join(
+        test_data_dir, 'data/dude/xiap/actives_docked.sdf')))[:30]
+    fps = [ECFP(mol, size=1024) for mol in mols]
+    library = sparse_vstack([sparse_to_csr_matrix(fp, 1024)
+                             for fp in fps]).tocsr()
+    dense_library = np.array([sparse_to_dense(fp, 1024) for fp in fps])
+    query = dense_library[:3]
+
+    for metric, count_bits, func in (('tanimoto', False, tanimoto),
+                                     ('dice', True, dice)):
+        target = np.array([[func(a, b) for b in dense_library]
+                           for a in query])
+        for lib in (library, dense_library):
+            for block_size in (None, 7):
+                query_idx, library_idx, scores = similarity_search(
+                    query, lib, metric=metric, count_bits=count_bits,
+                    threshold=0.5, block_size=block_size)
+                assert len(scores) == (target >= 0.5).sum()
+                assert_array_almost_equal(scores,
+                                          target[query_idx, library_idx])
+                assert (scores >= 0.5).all()
+
+                query_idx, library_idx, scores = similarity_search(
+                    library[:3], lib, metric=metric, count_bits=count_bits,
+                    top_k=5, block_size=block_size)
+                assert_array_equal(query_idx, np.repeat(np.arange(3), 5))
+                for i in range(3):
+                    order = np.lexsort((np.arange(len(fps)), -target[i]))[:5]
+                    assert_array_equal(library_idx[query_idx == i], order)
+                    assert_array_almost_equal(scores[query_idx == i],
+                                              target[i, order])
+                    # each molecule is the most similar to itself
+                    assert scores[query_idx == i][0] == 1.
+
+    # Tversky with equal weights of 0.5 is Dice
+    assert_array_almost_equal(
+        similarity_search(query[0], library, metric='tversky', alpha=0.5,
+                          beta=0.5, top_k=10)[2],
+        similarity_search(query[0], library, metric='dice', top_k=10)[2])
+
+    with pytest.raises(ValueError):
+        similarity_search(query, library, metric='cosine', top_k=1)
+    with pytest.raises(ValueError):
+        similarity_search(query, library)
+    with pytest.raises(ValueError):
+        similarity_search(query[:, :512], library, top_k=1)
+
+
+def test_packed_fingerprints():
+    """Packed fingerprints and their similarity search"""
+    mols = list(oddt.toolkit.readfile('sdf', os.path.join(
+        test_data_dir, 'data/dude/xiap/actives_docked.sdf')))[:30]
+    fps = [ECFP(mol, size=1024) for mol in mols]
+    dense = np.array([sparse_to_dense(fp, 1024) for fp in fps])
+    library = sparse_vstack([sparse_to_csr_matrix(fp, 1024)
+                             for fp in fps]).tocsr()
+
+    for count_bits in (False, True):
+        target = dense if count_bits else dense.astype(bool)
+        for packed in (PackedFingerprints(dense, count_bits=count_bits),
+                       PackedFingerprints(library, count_bits=count_bits),
+                       PackedFingerprints(fps, size=1024,
+                                          count_bits=count_bits)):
+            assert packed.shape == (30, 1024)
+            assert packed.bits.shape == (30, 16)
+            assert packed.bits.dtype == np.uint64
+            assert_array_equal(packed.to_dense(), target)
+            assert_array_equal(packed.to_csr_matrix().toarray(), target)
+            assert_array_equal(packed.popcount(), target.sum(axis=1))
+            assert_array_equal(packed[[4, 0, 17]].to_dense(),
+                               target[[4, 0, 17]])
+            assert_array_equal(packed[5:9].to_dense(), target[5:9])
+            assert_array_equal(packed[3].to_dense(), target[3:4])
+            packed = pickle.loads(pickle.dumps(packed))
+            assert_array_equal(packed.to_dense(), target)
+        assert packed.nbytes <= dense.nbytes / (2 if count_bits else 8)
+
+        for metric in ('tanimoto', 'dice', 'tversky'):
+            for query in (dense[:3], packed[:3]):
+                for block_size in (None, 7):
+                    packed_results = similarity_search(
+                        query, packed, metric=metric, count_bits=count_bits,
+                        alpha=0.7, beta=0.3, top_k=5, threshold=0.2,
+                        block_size=block_size)
+                    csr_results = similarity_search(
+                        library[:3], library, metric=metric,
+                        count_bits=count_bits, alpha=0.7, beta=0.3, top_k=5,
+                        threshold=0.2)
+                    for packed_result, csr_result in zip(packed_results,
+                                                         csr_results):
+                        assert_array_almost_equal(packed_result, csr_result)
+    assert_almost_equal(
+        similarity_search(dense[0], packed, metric='dice', count_bits=True,
+                          top_k=2)[2][1],
+        dice(fps[0], fps[1], sparse=True))
+
+    # binary similarity ignores counts stored in packed fingerprints
+    for metric in ('tanimoto', 'dice', 'tversky'):
+        csr_results = similarity_search(library[:3], library, metric=metric,
+                                        alpha=0.7, beta=0.3, top_k=5)
+        for query in (dense[:3], packed[:3]):
+            packed_results = similarity_search(query, packed, metric=metric,
+                                               alpha=0.7, beta=0.3, top_k=5)
+            for packed_result, csr_result in zip(packed_results, csr_results):
+                assert_array_almost_equal(packed_result, csr_result)
+    query_idx, library_idx, sims = similarity_search(packed, packed, top_k=1)
+    # some molecules share fingerprints
+    assert_array_equal(dense[library_idx], dense)
+    assert_array_almost_equal(sims, np.ones(30))
+
+    with pytest.raises(ValueError):
+        similarity_search(dense[0], PackedFingerprints(dense), top_k=1,
+                          count_bits=True)
+    with pytest.raises(ValueError):
+        PackedFingerprints([[1, 1024]], size=1024)
+
+
 def test_ecfp():
     """ECFP fingerprints"""
     mol1 = oddt.toolkit.readstring("smi", "CC1=C(C(=CC=C1)C)NC(=O)CN2CCN(CC2)CC(=O)N3CCC4=C(C3)C=CS4")
@@ -367,6 +498,71 @@ def test_ecfp_invaraiants():
         assert_array_equal(fp, ECFP(sildenafil, **params))
 
 
+def test_ecfp_environments():
+    """ECFP: vectorized environments vs atom by atom hashing"""
+    rows = np.array([[0, -1, 2 ** 31, 7], [-2, 5, 3, -1]])
+    assert_array_equal(_hash32_rows(rows),
+                       [hash32(tuple(row)) for row in rows.tolist()])
+
+    for mol, depth in ((ligand, 3), (protein, 2)):
+        atom_reprs = _heavy_atom_reprs(mol)
+        atom_ids, reprs = atom_reprs
+        atom_repr_dict = dict(zip(atom_ids.tolist(),
+                                  map(tuple, reprs.tolist())))
+        roots = atom_ids[::7]
+        environments = _ECFP_environments(mol, roots, depth, atom_reprs)
+        assert environments.shape == (len(roots), depth + 1)
+        for root, hashes in zip(roots.tolist(), environments):
+            assert_array_equal(
+                hashes, _ECFP_atom_hash(mol, root, depth=depth,
+                                        atom_repr_dict=atom_repr_dict))
+
+
+def test_ecfp_atom_reprs():
+    """ECFP: atom representations from atom_dict vs atom by atom"""
+    mols = [ligand, protein, oddt.toolkit.readstring(
+        'smi', '[13CH3]C(=O)[O-].[NH4+].C1CCCCCCCCCCC1.c1ccccc1')]
+    mols[2].addh()
+    for mol in mols:
+        atom_ids, reprs = _ECFP_atom_reprs(mol.clone)
+        heavy = [atom.idx0 for atom in mol if atom.atomicnum != 1]
+        assert_array_equal(atom_ids, heavy)
+        assert_array_equal(reprs, [_ECFP_atom_repr(mol, idx) for idx in heavy])
+
+        mol.atom_dict
+        atom_ids_dict, reprs_dict = _ECFP_atom_reprs(mol)
+        assert_array_equal(atom_ids_dict, atom_ids)
+        assert_array_equal(reprs_dict, reprs)
+
+
+def test_ligand_environments_cache():
+    """PLEC and SPLIF: ligand environments are cached by its topology"""
+    pose = ligand.clone
+    pose.coords = ligand.coords + np.array([0.3, -0.2, 0.1])
+    shuffled = shuffle_mol(pose)
+
+    references = []
+    for mol in (ligand, pose, shuffled):
+        _ECFP_cache.clear()
+        references.append((PLEC(mol, protein), SPLIF(mol, protein)['hash']))
+
+    _ECFP_cache.clear()
+    for mol, (plec, splif) in zip((ligand, pose), references):
+        assert_array_equal(PLEC(mol, protein), plec)
+        assert_array_equal(SPLIF(mol, protein)['hash'], splif)
+    assert len(_ECFP_cache) == 1
+    # atoms' order is a part of the topology
+    assert_array_equal(PLEC(shuffled, protein), references[2][0])
+    assert len(_ECFP_cache) == 2
+
+    # deeper environments replace shallower ones
+    plec = PLEC(pose, protein, depth_ligand=4)
+    assert len(_ECFP_cache) == 2
+    assert_array_equal(PLEC(ligand, protein), references[0][0])
+    _ECFP_cache.clear()
+    assert_array_equal(PLEC(pose, protein, depth_ligand=4), plec)
+
+
 def test_splif():
     """SPLIF fingerprints"""
     mols = list(oddt.toolkit.readfile('sdf', os.path.join(
@@ -583,3 +779,32 @@ def test_plec_similarity():
                           sparse=False) for mol in mols[1:]]
     assert_array_almost_equal(outcome_sparse, target_outcome, decimal=2)
     assert_array_almost_equal(outcome_dense, target_outcome, decimal=2)
+
+
+def test_plec_receptor_index():
+    """PLEC with protein environments stored in ReceptorIndex"""
+    mols = list(oddt.toolkit.readfile('sdf', os.path.join(
+        test_data_dir, 'data/dude/xiap/actives_docked.sdf')))[:10]
+    receptor = next(oddt.toolkit.readfile('pdb', os.path.join(
+        test_data_dir, 'data/dude/xiap/receptor_rdkit.pdb')))
+    receptor.protein = True
+    receptor_index = ReceptorIndex(receptor)
+    # deeper environments are computed first, then shallower ones reused
+    for depth_protein, depth_ligand in ((4, 2), (1, 3), (5, 1)):
+        for mol in mols:
+            assert_array_equal(
+                PLEC(mol, receptor_index, depth_protein=depth_protein,
+                     depth_ligand=depth_ligand),
+                PLEC(mol, receptor, depth_protein=depth_protein,
+                     depth_ligand=depth_ligand))
+
+    # environments are computed only for atoms in contact
+    table = receptor_index.cache['ECFP_atom_hashes']
+    assert 0 < len(table) < (receptor.atom_dict['atomicnum'] != 1).sum()
+    assert all(len(hashes) == 6 for hashes in table.values())
+
+    # and they are kept when the index is sent to other processes
+    receptor_index = pickle.loads(pickle.dumps(receptor_index))
+    assert receptor_index.cache['ECFP_atom_hashes'] == table
+    assert_array_equal(PLEC(mols[0], receptor_index),
+                       PLEC(mols[0], receptor))
@@ -1,17 +1,29 @@
 import os
+import pickle
 
+import numpy as np
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 import pytest
 
 import oddt
-from oddt.interactions import (close_contacts,
+from oddt.interactions import (ReceptorIndex,
+                               DictIndex,
+                               interaction_profile,
+                               batch_interactions,
+                               BATCH_INTERACTION_TYPES,
+                               close_contacts,
                                hbonds,
-                               distance,
                                halogenbonds,
                                pi_stacking,
                                salt_bridges,
                                pi_cation,
-                               hydrophobic_contacts)
+                               hydrophobic_contacts,
+                               hbond_acceptor_donor,
+                               salt_bridge_plus_minus,
+                               acceptor_metal,
+                               pi_metal,
+                               halogenbond_acceptor_halogen)
+from oddt.spatial import distance, rotate
 
 test_data_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -184,3 +196,222 @@ def test_hyd_contacts():
                         20, 9, 6, 6, 3, 7, 7, 4, 7, 6, 2, 5, 6, 14, 9, 4, 6,
                         11, 10, 9, 6, 10, 8, 6, 5, 6, 11, 8, 16, 9, 9, 11, 6,
                         8, 5, 8, 15])
+
+
+def test_receptor_index():
+    """Interactions computed with ReceptorIndex must match Molecule"""
+    rec_index = ReceptorIndex(rec)
+    assert rec_index.atom_dict is rec.atom_dict
+    assert rec_index.title == rec.title
+    assert ReceptorIndex(rec_index).mol is rec
+    assert_array_equal(rec_index.atoms('isdonor')['id'],
+                       rec.atom_dict[rec.atom_dict['isdonor']]['id'])
+    assert rec_index.tree('isdonor') is rec_index.tree('isdonor')
+    with pytest.raises(ValueError):
+        rec_index.atoms('not_a_selection')
+    # custom selections are cached along with their masks
+    mask = rec.atom_dict['atomicnum'] == 8
+    oxygens = rec_index.atoms('oxygens', mask=mask)
+    assert_array_equal(oxygens['id'], rec.atom_dict[mask]['id'])
+    assert rec_index.atoms('oxygens') is oxygens
+    assert rec_index.atoms('oxygens', mask=mask.copy()) is oxygens
+    with pytest.raises(ValueError, match='different mask'):
+        rec_index.atoms('oxygens', mask=rec.atom_dict['atomicnum'] == 7)
+    with pytest.raises(ValueError, match='different mask'):
+        rec_index.tree('oxygens', mask=~mask)
+    with pytest.raises(ValueError, match='different mask'):
+        rec_index.atoms('isdonor', mask=mask)
+
+    funcs = (hbonds, halogenbonds, pi_stacking, salt_bridges, pi_cation,
+             hydrophobic_contacts, acceptor_metal, pi_metal)
+    for mol in mols[:10]:
+        for func in funcs:
+            for args, index_args in (((rec, mol), (rec_index, mol)),
+                                     ((mol, rec), (mol, rec_index))):
+                for ref, out in zip(func(*args), func(*index_args)):
+                    assert len(ref) == len(out)
+                    if ref.dtype.names:
+                        assert_array_equal(ref['id' if 'id' in ref.dtype.names
+                                               else 'resid'],
+                                           out['id' if 'id' in ref.dtype.names
+                                               else 'resid'])
+                    else:
+                        assert_array_equal(ref, out)
+
+    # pickled index is rebuilt lazily
+    rec_index = pickle.loads(pickle.dumps(rec_index))
+    assert_array_equal(hbonds(rec_index, mols[0])[2], hbonds(rec, mols[0])[2])
+
+
+def test_receptor_index_invalidation():
+    """ReceptorIndex is rebuilt when molecule changes"""
+    mol = mols[0].clone
+    mol_index = ReceptorIndex(mol)
+    hydrophobes = mol_index.atoms('ishydrophobe')
+    mol.coords = mol.coords + 10
+    assert_array_almost_equal(mol_index.atoms('ishydrophobe')['coords'],
+                              hydrophobes['coords'] + 10, decimal=4)
+    assert len(hydrophobic_contacts(mol_index, mols[0])[0]) == 0
+
+
+def test_interaction_profile():
+    """Interactions derived from profile must match interaction functions"""
+    funcs = (('hbonds', {'cutoff': 3.5}),
+             ('hbond_acceptor_donor', {'cutoff': 4, 'tolerance': 20}),
+             ('halogenbonds', {}),
+             ('pi_stacking', {'cutoff': 7.5}),
+             ('salt_bridges', {'cutoff': 5.5}),
+             ('salt_bridge_plus_minus', {}),
+             ('pi_cation', {'cutoff': 6}),
+             ('hydrophobic_contacts', {'cutoff': 3}),
+             ('acceptor_metal', {}),
+             ('pi_metal', {}))
+    for protein in (rec, ReceptorIndex(rec)):
+        for mol in mols[:10]:
+            profile = interaction_profile(mol, protein, cutoff=5.5,
+                                          ring_cutoff=7.5)
+            for name, kwargs in funcs:
+                func = globals()[name]
+                for args in ((mol, protein), (protein, mol)):
+                    ref = func(*args, **kwargs)
+                    out = getattr(profile, name)(*args, **kwargs)
+                    assert len(ref) == len(out)
+                    for ref_array, out_array in zip(ref, out):
+                        assert ref_array.dtype == out_array.dtype
+                        if ref_array.dtype.names:
+                            field = ('id' if 'id' in ref_array.dtype.names
+                                     else 'centroid')
+                            assert_array_equal(ref_array[field],
+                                               out_array[field])
+                        else:
+                            assert_array_equal(ref_array, out_array)
+
+            # heavy atoms in close contact
+            heavy = mol.atom_dict['atomicnum'] != 1
+            ref = close_contacts(mol.atom_dict[heavy],
+                                 rec.atom_dict[rec.atom_dict['atomicnum'] != 1],
+                                 cutoff=4)
+            out = profile.atom_pairs(mol, protein, 4, heavy, 'heavy')
+            for ref_array, out_array in zip(ref, out):
+                assert_array_equal(ref_array['id'], out_array['id'])
+
+    profile = interaction_profile(mols[0], rec)
+    # cutoffs larger than the ones of profile
+    with pytest.raises(ValueError):
+        profile.hbonds(mols[0], rec, cutoff=5)
+    with pytest.raises(ValueError):
+        profile.pi_stacking(mols[0], rec, cutoff=7.5)
+    # molecules outside of the profile
+    with pytest.raises(ValueError):
+        profile.hbonds(mols[0], mols[1])
+
+
+def test_return_index():
+    """Interactions returned as indices into atom_dict and ring_dict"""
+    functions = (hbonds, halogenbonds, pi_stacking, salt_bridges,
+                 hydrophobic_contacts, pi_cation, acceptor_metal, pi_metal)
+    protein = ReceptorIndex(rec)
+    for mol in mols[:5]:
+        profile = interaction_profile(mol, protein)
+        for func in functions:
+            for mol1, mol2 in ((mol, rec), (rec, mol), (protein, mol)):
+                ref = func(mol1, mol2)
+                out = func(mol1, mol2, return_index=True)
+                profile_out = getattr(profile, func.__name__)(
+                    mol if mol1 is mol else protein,
+                    mol if mol2 is mol else protein,
+                    return_index=True)
+                for ref_array, out_array, profile_array in zip(
+                        ref, out, profile_out):
+                    if not ref_array.dtype.names:
+                        assert_array_equal(ref_array, out_array)
+                        assert_array_equal(ref_array, profile_array)
+                        continue
+                    assert isinstance(out_array, DictIndex)
+                    field = ('id' if 'id' in ref_array.dtype.names
+                             else 'centroid')
+                    assert_array_equal(ref_array[field], out_array[field])
+                    assert_array_equal(ref_array[field],
+                                       out_array.records[field])
+                    assert_array_equal(ref_array[field], profile_array[field])
+
+    a, d, strict = hbonds(mols[0], rec, return_index=True)
+    assert a.dtype.kind == 'i'
+    assert_array_equal(a, a['id'])
+    assert_array_equal(a[strict]['coords'], mols[0].atom_dict['coords'][a[strict]])
+
+    x, y = close_contacts(rec.atom_dict, mols[0].atom_dict, cutoff=3,
+                          return_index=True)
+    ref_x, ref_y = close_contacts(rec.atom_dict, mols[0].atom_dict, cutoff=3)
+    assert_array_equal(rec.atom_dict[x]['id'], ref_x['id'])
+    assert_array_equal(mols[0].atom_dict[y]['id'], ref_y['id'])
+
+
+def test_batch_interactions():
+    """Batched interactions of many poses"""
+    def ring_ids(ring_dict, rings):
+        return [np.flatnonzero((ring_dict['centroid'] == ring).all(axis=1))[0]
+                for ring in rings['centroid']]
+
+    protein = ReceptorIndex(rec)
+    for mol in mols[:5]:
+        coords = mol.coords
+        centroid = coords.mean(axis=0)
+        poses = [coords] + [rotate(coords - centroid, 0.1 * j, -0.1 * j, 0.2) +
+                            centroid + 0.3 * j for j in range(1, 4)]
+        out = batch_interactions(mol, poses, protein)
+        assert (np.diff(out['pose'].astype(int)) >= 0).all()
+
+        for pose_id, pose_coords in enumerate(poses):
+            pose = mol.clone
+            pose.coords = pose_coords
+            pose_out = out[out['pose'] == pose_id]
+
+            # (ligand_ids, protein_ids, strict) of per-pose functions
+            ref = {}
+            lig, prot = hydrophobic_contacts(pose, rec)
+            ref['hydrophobic_contacts'] = lig['id'], prot['id'], True
+            lig, prot, strict = hbond_acceptor_donor(pose, rec)
+            ref['hbond_acceptor'] = lig['id'], prot['id'], strict
+            prot, lig, strict = hbond_acceptor_donor(rec, pose)
+            ref['hbond_donor'] = lig['id'], prot['id'], strict
+            lig, prot, strict = halogenbond_acceptor_halogen(pose, rec)
+            ref['halogenbond_acceptor'] = lig['id'], prot['id'], strict
+            prot, lig, strict = halogenbond_acceptor_halogen(rec, pose)
+            ref['halogenbond_halogen'] = lig['id'], prot['id'], strict
+            lig, prot = salt_bridge_plus_minus(pose, rec)
+            ref['salt_bridge_plus'] = lig['id'], prot['id'], True
+            prot, lig = salt_bridge_plus_minus(rec, pose)
+            ref['salt_bridge_minus'] = lig['id'], prot['id'], True
+            lig, prot, strict = acceptor_metal(pose, rec)
+            ref['acceptor_metal'] = lig['id'], prot['id'], strict
+            lig, prot, parallel, perpendicular = pi_stacking(pose, rec)
+            lig = ring_ids(pose.ring_dict, lig)
+            prot = ring_ids(rec.ring_dict, prot)
+            ref['pi_stacking_parallel'] = lig, prot, parallel
+            ref['pi_stacking_perpendicular'] = lig, prot, perpendicular
+            lig, prot, strict = pi_cation(pose, rec)
+            ref['pi_cation_ligand_ring'] = (ring_ids(pose.ring_dict, lig),
+                                            prot['id'], strict)
+            prot, lig, strict = pi_cation(rec, pose)
+            ref['pi_cation_protein_ring'] = (lig['id'],
+                                             ring_ids(rec.ring_dict, prot),
+                                             strict)
+            lig, prot, strict = pi_metal(pose, rec)
+            ref['pi_metal'] = (ring_ids(pose.ring_dict, lig), prot['id'],
+                               strict)
+
+            assert sorted(ref) == sorted(BATCH_INTERACTION_TYPES)
+            for name, (lig, prot, strict) in ref.items():
+                table = pose_out[pose_out['type'] ==
+                                 BATCH_INTERACTION_TYPES.index(name)]
+                strict = np.broadcast_to(strict, len(lig))
+                assert (sorted(zip(table['ligand_id'], table['protein_id'],
+                                   table['strict'])) ==
+                        sorted(zip(lig, prot, strict)))
+
+    # pose coordinates must match the ligand topology
+    with pytest.raises(ValueError):
+        batch_interactions(mols[0], mols[0].coords[:-1], rec)
+    with pytest.raises(ValueError):
+        batch_interactions(mols[0], mols[0].coords, rec, cutoffs={'foo': 4})
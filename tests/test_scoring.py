@@ -1,18 +1,22 @@
 import os
+import pickle
 from types import GeneratorType
 from tempfile import mkdtemp, NamedTemporaryFile
 
 import numpy as np
 
-from numpy.testing import assert_almost_equal, assert_array_almost_equal
+from numpy.testing import (assert_almost_equal, assert_array_almost_equal,
+                           assert_array_equal)
 import pytest
 from sklearn.metrics import r2_score
 
 import oddt
+from oddt.docking.internal import vina_docking
 from oddt.scoring import scorer, ensemble_descriptor, ensemble_model
 from oddt.scoring.descriptors import (autodock_vina_descriptor,
                                       fingerprints,
-                                      oddt_vina_descriptor)
+                                      oddt_vina_descriptor,
+                                      universal_descriptor)
 from oddt.scoring.models.classifiers import neuralnetwork
 from oddt.scoring.models import regressors
 from oddt.scoring.functions import rfscore, nnscore, PLECscore
@@ -170,6 +174,19 @@ def test_internal_vina():
     assert_array_almost_equal(oddt_vina_results, autodock_vina_results, decimal=4)
 
 
+def test_internal_vina_mutate_batch():
+    """Batched mutation of poses in internal Vina"""
+    mol = next(oddt.toolkit.readfile('sdf', actives_sdf))
+    mol.addh()
+    engine = vina_docking(None, mol)
+    x = np.random.RandomState(42).uniform(-np.pi, np.pi,
+                                          (20, 6 + len(engine.rotors)))
+    assert_array_almost_equal(engine.lig.mutate_batch(x),
+                              [engine.lig.mutate(pose_x, force=True)
+                               for pose_x in x],
+                              decimal=4)
+
+
 def test_rfscore_desc():
     """Test RFScore v1-3 descriptors generators"""
     mols = list(oddt.toolkit.readfile('sdf', actives_sdf))
@@ -238,6 +255,50 @@ def test_nnscore_desc():
     assert_array_almost_equal(descs, descs_correct, decimal=4)
 
 
+def test_nnscore_save():
+    """Test saving NNScore after its protein was set"""
+    rec = next(oddt.toolkit.readfile('pdb', receptor_pdb))
+    rec.protein = True
+
+    model = nnscore(protein=rec, n_jobs=1)
+    assert model.descriptor_generator.protein is rec
+    model.set_protein(None)
+    assert model.descriptor_generator.protein is None
+
+    with NamedTemporaryFile(suffix='.pickle') as f:
+        model.save(f.name)
+        loaded = scorer.load(f.name)
+    assert loaded.descriptor_generator.protein is None
+
+
+def test_plecscore_protein_index():
+    """Test PLECscore keeping an index of its protein"""
+    mols = list(oddt.toolkit.readfile('sdf', actives_sdf))[:5]
+    rec = next(oddt.toolkit.readfile('pdb', receptor_pdb))
+    rec.protein = True
+
+    model = PLECscore(protein=rec, n_jobs=1, size=2048)
+    gen = model.descriptor_generator
+    assert model.protein is rec
+    assert gen.protein is rec
+    assert gen._protein_index.mol is rec
+
+    descs = gen.build(mols)
+    plain_gen = universal_descriptor(gen.func, protein=rec, shape=2048,
+                                     sparse=True)
+    assert_array_equal(descs.toarray(), plain_gen.build(mols).toarray())
+    assert gen._protein_index.cache
+
+    # cached data of the index is pickled
+    gen_copy = pickle.loads(pickle.dumps(gen))
+    assert (set(gen_copy._protein_index.cache) ==
+            set(gen._protein_index.cache))
+
+    model.set_protein(None)
+    assert gen.protein is None
+    assert gen._protein_index is None
+
+
 models = ([PLECscore(n_jobs=1, version=v, size=2048)
            for v in ['linear', 'nn', 'rf']] +
           [nnscore(n_jobs=1)] +
@@ -10,8 +10,16 @@ import oddt
 from oddt.spatial import (angle,
                           dihedral,
                           rmsd,
+                          rmsd_batch,
+                          rmsd_matrix,
+                          cluster_poses,
                           distance,
-                          rotate)
+                          close_pairs,
+                          rotate,
+                          rotation_matrix,
+                          axis_angle_matrix,
+                          quaternion_matrix,
+                          transform)
 from .utils import shuffle_mol
 
 
@@ -111,6 +119,36 @@ def test_distance():
     assert_array_almost_equal(d, ref_dist)
 
 
+def test_close_pairs():
+    """Test neighbor search backends against full distance matrix"""
+    mols = list(oddt.toolkit.readfile('sdf', os.path.join(
+        test_data_dir, 'data/dude/xiap/actives_docked.sdf')))
+    lig_coords = mols[0].coords
+    # all other docked poses make a crowded set of points
+    rec_coords = np.vstack([mol.coords for mol in mols[1:]])
+
+    for cutoff_low, cutoff in ((0., 4.), (2., 8.)):
+        d = distance(lig_coords, rec_coords)
+        ref = np.argwhere((d > cutoff_low) & (d <= cutoff))
+        assert len(ref) > 0
+        for method in ('auto', 'bruteforce', 'kdtree'):
+            assert_array_equal(close_pairs(lig_coords, rec_coords, cutoff,
+                                           cutoff_low=cutoff_low,
+                                           method=method), ref)
+            # swapped sets
+            assert_array_equal(close_pairs(rec_coords, lig_coords, cutoff,
+                                           cutoff_low=cutoff_low,
+                                           method=method),
+                               np.argwhere((d.T > cutoff_low) & (d.T <= cutoff)))
+
+    # empty sets
+    assert close_pairs(np.zeros((0, 3)), rec_coords, 4.).shape == (0, 2)
+    assert close_pairs(lig_coords, np.zeros((0, 3)), 4.).shape == (0, 2)
+
+    with pytest.raises(ValueError):
+        close_pairs(lig_coords, rec_coords, 4., method='unknown')
+
+
 def test_spatial():
     """Test spatial misc computations"""
     mol = oddt.toolkit.readstring('smi', 'c1ccccc1')
@@ -130,6 +168,40 @@ def test_spatial():
     assert_almost_equal(rmsd(mol, mol2, method='min_symmetry'), 0, decimal=0)
 
 
+def test_transform():
+    """Batched rigid-body transformations"""
+    rng = np.random.RandomState(42)
+    coords = rng.uniform(-5, 5, (20, 3))
+    angles = rng.uniform(-np.pi, np.pi, (10, 3))
+
+    rot_matrix = rotation_matrix(*angles.T)
+    assert rot_matrix.shape == (10, 3, 3)
+    assert_array_almost_equal(np.linalg.det(rot_matrix), np.ones(10))
+    assert_array_almost_equal(transform(coords, rot_matrix),
+                              [rotate(coords, *a) for a in angles])
+
+    # axis-angle and equivalent quaternions
+    axis = rng.uniform(-1, 1, (10, 3))
+    theta = angles[:, 0]
+    unit_axis = axis / np.linalg.norm(axis, axis=1)[:, np.newaxis]
+    quaternion = np.hstack((np.cos(theta / 2)[:, np.newaxis],
+                            unit_axis * np.sin(theta / 2)[:, np.newaxis]))
+    assert_array_almost_equal(axis_angle_matrix(axis, theta),
+                              quaternion_matrix(quaternion))
+    assert_array_almost_equal(axis_angle_matrix([0, 0, 1], np.pi / 2).dot([1, 0, 0]),
+                              [0, 1, 0])
+
+    # many coordinate sets with rotations and translations
+    coords_stack = rng.uniform(-5, 5, (10, 20, 3))
+    translation = rng.uniform(-5, 5, (10, 3))
+    out = transform(coords_stack, rot_matrix, translation, center=np.zeros(3))
+    for i in range(10):
+        assert_array_almost_equal(out[i], coords_stack[i].dot(rot_matrix[i].T) +
+                                  translation[i])
+    assert_array_almost_equal(transform(coords_stack, translation=translation),
+                              coords_stack + translation[:, np.newaxis])
+
+
 def test_rmsd():
     # pick one molecule from docked poses
     mols = list(oddt.toolkit.readfile('sdf', os.path.join(test_data_dir, 'data/dude/xiap/actives_docked.sdf')))
@@ -175,6 +247,138 @@ def test_rmsd():
                                       res[res_key], decimal=4)
 
 
+def test_rmsd_batch():
+    """Batched RMSD of multiple poses of one molecule"""
+    mols = list(oddt.toolkit.readfile('sdf', os.path.join(test_data_dir, 'data/dude/xiap/actives_docked.sdf')))
+    mols = list(filter(lambda x: x.title == '312335', mols))
+    ref = mols[0]
+    mol = mols[1]
+
+    # rotated and translated poses sharing the topology of mol (values
+    # computed pose by pose)
+    coords = np.array([rotate(mol.coords, 0.3 * i, -0.2 * i, 0.1 * i) + 0.5 * i
+                       for i in range(6)])
+    res = {
+        None: [4.7536, 4.9846, 5.5139, 6.2459, 7.0813, 7.9396],
+        'hungarian': [0.9013, 1.8331, 3.4414, 4.8829, 6.0142, 7.0412],
+        'min_symmetry': [0.9013, 1.8663, 3.403, 4.9768, 6.4663, 7.829],
+        'canonize': [6.9485, 7.0661, 7.3053, 7.6494, 8.074, 8.5527],
+        }
+    for method, ref_rmsd in res.items():
+        for ignore_h in [True, False]:
+            assert_array_almost_equal(rmsd_batch(ref, mol, coords,
+                                                 method=method,
+                                                 ignore_h=ignore_h),
+                                      ref_rmsd, decimal=4)
+
+    # atoms of poses in a different order
+    shuffled = shuffle_mol(mol)
+    order = distance(shuffled.coords, mol.coords).argmin(axis=1)
+    for method in ['hungarian', 'min_symmetry']:
+        assert_array_almost_equal(
+            rmsd_batch(ref, shuffled, coords[:, order], method=method),
+            res[method], decimal=4)
+
+    # single pose is taken from the molecule
+    assert_array_almost_equal(rmsd_batch(ref, mol, method='min_symmetry'),
+                              res['min_symmetry'][:1], decimal=4)
+
+    with pytest.raises(ValueError, match='Poses have'):
+        rmsd_batch(ref, mol, coords[:, :-1])
+
+    # hydrogens (their positions depend on the toolkit)
+    if oddt.toolkit.backend == 'rdk':
+        ref.addh()
+        mol.addh()
+        coords = np.array([rotate(mol.coords, 0.3 * i, -0.2 * i, 0.1 * i) +
+                           0.5 * i for i in range(6)])
+        res = {
+            (None, True): [4.7536, 4.9707, 5.4787, 6.2117, 7.0825, 8.0057],
+            (None, False): [4.8249, 5.1851, 5.853, 6.709, 7.6436, 8.5726],
+            ('hungarian', True):
+                [0.9013, 1.7948, 3.3847, 4.8132, 6.0206, 7.1133],
+            ('hungarian', False):
+                [1.0753, 2.0002, 3.5113, 4.5835, 5.5513, 6.4428],
+            ('min_symmetry', False):
+                [0.9013, 1.8286, 3.3456, 4.9337, 6.4832, 7.9206],
+            }
+        for (method, ignore_h), ref_rmsd in res.items():
+            assert_array_almost_equal(rmsd_batch(ref, mol, coords,
+                                                 method=method,
+                                                 ignore_h=ignore_h),
+                                      ref_rmsd, decimal=4)
+
+
+def test_rmsd_matrix():
+    """RMSD matrix and clustering of poses"""
+    mol = next(oddt.toolkit.readfile('sdf', os.path.join(test_data_dir, 'data/dude/xiap/actives_docked.sdf')))
+    rng = np.random.RandomState(42)
+    # three groups of similar poses, rotated and translated
+    centers = [mol.coords, rotate(mol.coords, 0, 0, np.pi / 2),
+               rotate(mol.coords, np.pi / 2, 0, 0) + 5]
+    coords = np.array([center + rng.uniform(-0.2, 0.2, mol.coords.shape)
+                       for center in centers for _ in range(4)])
+
+    for method in [None, 'min_symmetry']:
+        matrix = rmsd_matrix(mol, coords, method=method, block_size=5)
+        assert matrix.shape == (len(coords), len(coords))
+        assert_array_equal(matrix, matrix.T)
+        assert_array_equal(np.diag(matrix), 0)
+        for i in range(len(coords)):
+            ref = mol.clone
+            ref.coords = coords[i]
+            assert_array_almost_equal(matrix[i], rmsd_batch(ref, mol, coords,
+                                                            method=method),
+                                      decimal=4)
+
+        superposed = rmsd_matrix(mol, coords, method=method, superpose=True)
+        assert_array_equal(superposed, superposed.T)
+        assert_array_almost_equal(
+            rmsd_matrix(mol, coords, method=method, superpose=True,
+                        block_size=5),
+            superposed, decimal=4)
+        assert (superposed <= matrix + 1e-4).all()
+        # rotated and translated copies of the same pose
+        assert_array_almost_equal(
+            rmsd_matrix(mol, np.array([centers[0], centers[2]]),
+                        method=method, superpose=True),
+            np.zeros((2, 2)), decimal=4)
+
+    labels, centers = cluster_poses(mol, coords, cutoff=1.)
+    assert_array_equal(labels, np.repeat([0, 1, 2], 4))
+    assert_array_equal(centers, [0, 4, 8])
+    labels, centers = cluster_poses(mol, coords, cutoff=1., algorithm='butina')
+    assert_array_equal(np.unique(labels), [0, 1, 2])
+    # superposition merges all poses into one cluster
+    labels, centers = cluster_poses(mol, coords, cutoff=1., superpose=True)
+    assert_array_equal(labels, 0)
+    assert_array_equal(centers, [0])
+
+    with pytest.raises(ValueError):
+        rmsd_matrix(mol, coords, method='hungarian')
+    with pytest.raises(ValueError):
+        rmsd_matrix(mol, coords[:, 1:])
+    with pytest.raises(ValueError):
+        cluster_poses(mol, coords, algorithm='kmeans')
+
+
+def test_rmsd_symmetry_bonding():
+    """Symmetry matches are not shared by molecules of equal connectivity,
+    but different bond orders or charges"""
+    coords = np.array([[[0., 0., 0.], [1.4, 0., 0.], [2.1, 1.2, 0.],
+                        [3.5, 1.2, 0.]]])
+    # swapped ends of the chain
+    coords = np.concatenate([coords, coords[:, ::-1]])
+
+    diol = oddt.toolkit.readstring('smi', 'OCCO')
+    assert_array_almost_equal(rmsd_matrix(diol, coords), np.zeros((2, 2)))
+
+    alkoxide = oddt.toolkit.readstring('smi', '[O-]CCO')
+    assert_array_almost_equal(rmsd_matrix(alkoxide, coords),
+                              rmsd_matrix(alkoxide, coords, method=None))
+    assert rmsd_matrix(alkoxide, coords)[0, 1] > 1
+
+
 def test_rmsd_errors():
     mol = oddt.toolkit.readstring('smi', 'c1ccccc1')
     mol.make3D()
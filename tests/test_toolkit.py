@@ -382,6 +382,32 @@ def test_dicts():
                 err_msg='Protein atom_dict\'s collumn: "%s" is not equal' % name)
 
 
+def test_dicts_neighbors():
+    """Test neighbors table of atom_dict against per-atom neighbors"""
+    mols = list(oddt.toolkit.readfile('sdf', xiap_actives))[:10]
+    list(map(lambda x: x.addh(), mols))
+    for mol in mols:
+        atom_dict = mol.atom_dict
+        assert_array_equal(atom_dict['id'], np.arange(len(mol.atoms)))
+        assert_array_almost_equal(atom_dict['coords'], mol.coords, decimal=4)
+        for atom in mol:
+            nbrs = atom.neighbors
+            row = atom_dict[atom.idx0]
+            assert row['atomicnum'] == atom.atomicnum
+            assert_array_equal(row['neighbors_id'][:len(nbrs)],
+                               [nbr.idx0 for nbr in nbrs])
+            assert_array_equal(row['neighbors_id'][len(nbrs):], 0)
+            assert_array_almost_equal(row['neighbors'][:len(nbrs)],
+                                      [nbr.coords for nbr in nbrs], decimal=4)
+            assert np.isnan(row['neighbors'][len(nbrs):]).all()
+
+    # atoms with more than 6 neighbors are truncated with a warning
+    mol = oddt.toolkit.readstring('smi', '[Fe](Cl)(Cl)(Cl)(Cl)(Cl)(Cl)(Cl)CC')
+    with pytest.warns(UserWarning, match='has 8 neighbors'):
+        atom_dict = mol.atom_dict
+    assert_array_equal(atom_dict['neighbors_id'][0], np.arange(1, 7))
+
+
 def test_ss():
     """Secondary structure assignment"""
     # Alpha Helix
@@ -531,3 +557,99 @@ def test_canonize_ring_path():
 
     with pytest.raises(ValueError):
         canonize_ring_path(tuple(range(6)))
+
+
+def test_smarts_registry():
+    """Test process-wide registry of compiled SMARTS"""
+    from oddt.toolkits.common import SmartsRegistry
+    registry = SmartsRegistry(oddt.toolkit.Smarts, maxsize=2)
+    mol = oddt.toolkit.readstring('smi', 'CCN(CC)CC')
+
+    patt = registry['[#6][#6]']
+    assert len(patt.findall(mol)) == 3
+    assert registry['[#6][#6]'] is patt
+    assert registry.cache_info() == (1, 1, 2, 1)
+
+    registry['[#7]']
+    registry['[#8]']
+    # least recently used pattern is discarded
+    assert '[#6][#6]' not in registry
+    assert '[#7]' in registry
+    assert registry.cache_info() == (1, 3, 2, 2)
+
+    # invalid patterns are not registered
+    with pytest.raises(IOError):
+        registry['[#6']
+    assert len(registry) == 2
+
+    registry.cache_clear()
+    assert registry.cache_info() == (0, 0, 2, 0)
+
+    # toolkit registry is shared by the features perception
+    oddt.toolkit.readstring('smi', 'CCO').atom_dict
+    info = oddt.toolkit.smarts_registry.cache_info()
+    mol.atom_dict
+    new_info = oddt.toolkit.smarts_registry.cache_info()
+    assert new_info.hits > info.hits
+    assert new_info.misses == info.misses
+
+    if oddt.toolkit.backend == 'rdk':
+        # so is the Sybyl atom typing
+        oddt.toolkit.readstring('smi', 'CC(=O)NC').atom_dict
+        assert 'C(=[O,S])-N' in oddt.toolkit.smarts_registry
+        info = oddt.toolkit.smarts_registry.cache_info()
+        oddt.toolkit.readstring('smi', 'CCC(=O)NCC').atom_dict
+        new_info = oddt.toolkit.smarts_registry.cache_info()
+        assert new_info.misses == info.misses
+
+
+def test_dicts_cache(tmpdir):
+    """Test on-disk cache of molecules' dicts"""
+    cache_dir = str(tmpdir.join('dicts'))
+    prot_file = os.path.join(test_data_dir, 'data', 'pdb', '1cos_helix.pdb')
+    for protein in (False, True):
+        ref = next(oddt.toolkit.readfile('pdb', prot_file))
+        ref.protein = protein
+        for _ in range(2):  # store and load
+            mol = next(oddt.toolkit.readfile('pdb', prot_file,
+                                             dicts_cache=cache_dir))
+            mol.protein = protein
+            assert mol._dicts_cache is not None
+            for name in ('atom_dict', 'ring_dict', 'res_dict'):
+                if name == 'res_dict' and not protein:
+                    continue
+                ref_dict, mol_dict = getattr(ref, name), getattr(mol, name)
+                assert ref_dict.dtype == mol_dict.dtype
+                assert len(ref_dict) == len(mol_dict)
+                for field in ref_dict.dtype.names:
+                    assert_array_equal(ref_dict[field], mol_dict[field])
+            assert not mol.atom_dict.flags.writeable
+    # protein flag is a part of a key
+    assert len(tmpdir.join('dicts').listdir()) == 5
+
+    # changing a molecule invalidates the cache
+    mols = list(oddt.toolkit.readfile('sdf', xiap_actives,
+                                      dicts_cache=cache_dir))[:2]
+    assert mols[0]._dicts_cache[1] != mols[1]._dicts_cache[1]
+    mols[0].atom_dict
+    mols[0].addh()
+    assert mols[0]._dicts_cache is None
+    assert (mols[0].atom_dict['atomicnum'] == 1).any()
+
+    # reader options are a part of a key
+    if oddt.toolkit.backend == 'ob':
+        options = ({}, {'opt': {'s': None}})
+    else:
+        options = ({}, {'removeHs': False})
+    mols = [next(oddt.toolkit.readfile('sdf', xiap_actives,
+                                       dicts_cache=cache_dir, **kwargs))
+            for kwargs in options]
+    assert mols[0]._dicts_cache[1] != mols[1]._dicts_cache[1]
+    ref = next(oddt.toolkit.readfile('sdf', xiap_actives, **options[1]))
+    for _ in range(2):  # store and load
+        mol = next(oddt.toolkit.readfile('sdf', xiap_actives,
+                                         dicts_cache=cache_dir, **options[1]))
+        assert_array_equal(mol.atom_dict['atomicnum'],
+                           ref.atom_dict['atomicnum'])
+    if oddt.toolkit.backend == 'rdk':
+        assert len(mols[0].atom_dict) < len(mols[1].atom_dict)
@@ -1,7 +1,11 @@
 import os
+import json
+import pickle
 from tempfile import mkdtemp, NamedTemporaryFile
+from functools import partial
 
 import pytest
+import numpy as np
 from numpy.testing import assert_array_equal, assert_array_almost_equal
 
 import pandas as pd
@@ -9,9 +13,11 @@ import pandas as pd
 import oddt
 from oddt.utils import method_caller
 from oddt.spatial import rmsd
+from oddt.shape import usr, usr_cat, electroshape, usr_similarity
 from oddt.scoring import scorer
 from oddt.scoring.functions import rfscore, nnscore
-from oddt.virtualscreening import virtualscreening
+from oddt.virtualscreening import (virtualscreening, _Expression, _filter,
+                                   _instrumented_compose_iter)
 
 test_data_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -122,6 +128,250 @@ def test_vs_multithreading_fallback():
         method_caller(vs, 'fetch')
 
 
+def test_vs_parallel():
+    """Parallel pipeline gives the same results as a serial one"""
+    ref_mol = next(oddt.toolkit.readfile('sdf', xiap_crystal_ligand))
+    titles = []
+    for n_cpu in (1, 2):
+        vs = virtualscreening(n_cpu=n_cpu, chunksize=10)
+        vs.load_ligands('sdf', xiap_actives_docked)
+        vs.apply_filter('mol.num_rotors < 10')
+        vs.similarity('usr', cutoff=0.3, query=ref_mol)
+        titles.append([mol.title for mol in vs.fetch()])
+
+        # timings of warm-up and chunks are collected
+        assert sum(c['size'] for c in vs.timings['chunks']) == 100
+        assert len(vs.timings['warmup']) >= 1
+        summary = vs.timings_summary()
+        assert 'similarity(usr)' in summary
+        assert '10 chunks (100 ligands in' in summary
+    assert len(titles[0]) > 0
+    assert titles[0] == titles[1]
+
+
+def test_vs_unordered():
+    """Unordered and adaptive fetching of parallel pipeline"""
+    vs = virtualscreening(n_cpu=2, chunksize=5)
+    vs.load_ligands('sdf', xiap_actives_docked)
+    vs.apply_filter('mol.num_rotors < 10')
+    titles = [mol.title for mol in vs.fetch()]
+
+    vs = virtualscreening(n_cpu=2, chunksize=5)
+    vs.load_ligands('sdf', xiap_actives_docked)
+    vs.apply_filter('mol.num_rotors < 10')
+    unordered_titles = [mol.title for mol in vs.fetch(ordered=False,
+                                                      max_inflight=1,
+                                                      chunk_time=1e-3)]
+    assert sorted(unordered_titles) == sorted(titles)
+    # chunks are resized, but none is larger than 10x chunksize
+    sizes = [c['size'] for c in vs.timings['chunks']]
+    assert sum(sizes) == 100
+    assert len(set(sizes)) > 1
+    assert max(sizes) <= 50
+
+    with pytest.raises(ValueError, match='max_inflight'):
+        vs.fetch(max_inflight=0)
+
+    # errors in workers are raised
+    vs = virtualscreening(n_cpu=2, chunksize=5)
+    vs.load_ligands('sdf', xiap_actives_docked)
+    vs.apply_filter('mol.no_such_property > 1')
+    with pytest.raises(AttributeError):
+        list(vs.fetch(ordered=False))
+
+
+def test_vs_report(tmpdir):
+    """Per-stage instrumentation of VS pipeline"""
+    ref_mol = next(oddt.toolkit.readfile('sdf', xiap_crystal_ligand))
+    report_file = str(tmpdir / 'report.jsonl')
+    for n_cpu in (1, 2):
+        vs = virtualscreening(n_cpu=n_cpu, chunksize=10)
+        assert vs.report() is None
+        vs.load_ligands('sdf', xiap_actives_docked)
+        vs.apply_filter('mol.num_rotors < 10')
+        vs.similarity('usr', cutoff=0.3, query=ref_mol)
+        n_out = len(list(vs.fetch(report_file=report_file,
+                                  report_interval=0)))
+
+        report = vs.report()
+        assert report['done']
+        assert report['chunks'] == 10
+        assert report['ligands_in'] == 100
+        assert report['ligands_out'] == n_out
+        assert ([stage['name'] for stage in report['stages']] ==
+                ['apply_filter', 'similarity(usr)'])
+        filtering, similarity = report['stages']
+        assert filtering['mols_in'] == 100
+        assert filtering['mols_out'] == similarity['mols_in']
+        assert similarity['mols_out'] == n_out
+        for stage in report['stages']:
+            assert stage['wall'] > 0
+            assert stage['throughput'] > 0
+            assert stage['warmup'] is not None
+        assert sum(w['ligands'] for w in report['workers']) == 100
+
+    # a line per chunk and a final one for each of the runs
+    with open(report_file) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 22
+    assert [line['done'] for line in lines].count(True) == 2
+    assert lines[-1]['ligands_out'] == n_out
+
+
+def test_vs_checkpoint(tmpdir):
+    """Interrupted VS run is resumed from checkpoint"""
+    titles = [mol.title for mol in
+              oddt.toolkit.readfile('sdf', xiap_actives_docked)]
+    for n_cpu in (1, 2):
+        checkpoint = str(tmpdir / ('checkpoint_%i.json' % n_cpu))
+        sdf_file = str(tmpdir / ('output_%i.sdf' % n_cpu))
+        csv_file = str(tmpdir / ('output_%i.csv' % n_cpu))
+
+        # fail in the 4th chunk
+        vs = virtualscreening(n_cpu=n_cpu, chunksize=10,
+                              checkpoint=checkpoint)
+        vs.load_ligands('sdf', xiap_actives_docked)
+        failing = set(titles[30:40]) - set(titles[:30])
+        vs.apply_filter('mol.title not in %r or 1 / 0' % failing)
+        with pytest.raises(ZeroDivisionError):
+            vs.write('sdf', sdf_file, csv_filename=csv_file)
+        with open(checkpoint) as f:
+            assert json.load(f)['done'] == [[0, 30]]
+        assert len(list(oddt.toolkit.readfile('sdf', sdf_file))) == 30
+
+        # resume, output is appended
+        vs = virtualscreening(n_cpu=n_cpu, chunksize=10,
+                              checkpoint=checkpoint)
+        vs.load_ligands('sdf', xiap_actives_docked)
+        vs.apply_filter('mol.num_rotors < 100')
+        vs.write('sdf', sdf_file, csv_filename=csv_file)
+        with open(checkpoint) as f:
+            assert json.load(f)['done'] == [[0, 100]]
+        assert ([mol.title for mol in oddt.toolkit.readfile('sdf', sdf_file)]
+                == titles)
+        csv_data = pd.read_csv(csv_file)
+        assert csv_data['name'].astype(str).tolist() == titles
+
+        # nothing is left to process
+        vs = virtualscreening(n_cpu=n_cpu, chunksize=10,
+                              checkpoint=checkpoint)
+        vs.load_ligands('sdf', xiap_actives_docked)
+        vs.write_csv(csv_file)
+        assert pd.read_csv(csv_file)['name'].astype(str).tolist() == titles
+
+
+def test_vs_top(tmpdir):
+    """Top-N selection of VS pipeline"""
+    scores = [float(mol.data['score']) for mol in
+              oddt.toolkit.readfile('sdf', xiap_actives_docked)]
+    for n_cpu, ordered in ((1, True), (2, True), (2, False)):
+        for ascending in (True, False):
+            vs = virtualscreening(n_cpu=n_cpu, chunksize=10)
+            vs.load_ligands('sdf', xiap_actives_docked)
+            vs.top(15, 'score', ascending=ascending)
+            top_scores = [float(mol.data['score'])
+                          for mol in vs.fetch(ordered=ordered)]
+            assert top_scores == sorted(scores, reverse=not ascending)[:15]
+
+    # more molecules requested than available
+    vs = virtualscreening(n_cpu=1, chunksize=10)
+    vs.load_ligands('sdf', xiap_actives_docked)
+    vs.top(1000, 'score')
+    assert len(list(vs.fetch())) == 100
+
+    # molecules without score are discarded
+    vs = virtualscreening(n_cpu=1, chunksize=10)
+    vs.load_ligands('sdf', xiap_actives_docked)
+    vs.top(10, 'no_such_score')
+    assert len(list(vs.fetch())) == 0
+
+    with pytest.raises(ValueError, match='last stage'):
+        vs.apply_filter('mol.num_rotors < 10')
+    with pytest.raises(ValueError):
+        vs.top(0, 'score')
+    vs = virtualscreening(checkpoint=str(tmpdir / 'checkpoint.json'))
+    with pytest.raises(ValueError, match='checkpoint'):
+        vs.top(10, 'score')
+
+
+def test_vs_filter_expressions():
+    """Filter expressions are compiled once and share properties' values"""
+    expression = _Expression('mol.molwt < 500 and len(mol.atoms) > 10')
+    assert expression.properties == {'molwt', 'atoms'}
+    expression = pickle.loads(pickle.dumps(expression))
+    assert expression.properties == {'molwt', 'atoms'}
+
+    mols = list(oddt.toolkit.readfile('sdf', xiap_actives_docked))
+    expressions = ['mol.molwt < 500', 'mol.num_rotors < 10',
+                   'len(mol.atoms) < 60']
+    ref_titles = [mol.title for mol in mols
+                  if sum(not eval(e, {'mol': mol})
+                         for e in expressions) <= 1 and mol.molwt > 300]
+    for n_cpu in (1, 2):
+        vs = virtualscreening(n_cpu=n_cpu, chunksize=10)
+        vs.load_ligands('sdf', xiap_actives_docked)
+        vs.apply_filter(expressions, soft_fail=1)
+        vs.apply_filter('mol.molwt > 300')
+        assert [mol.title for mol in vs.fetch()] == ref_titles
+
+    # properties are computed once per molecule for filters in one pass
+    mol = mols[0]
+    properties = {}
+    assert _filter([mol], 'mol.molwt > 1', properties=properties) == [mol]
+    assert properties[mol]['molwt'] == mol.molwt
+    properties[mol]['molwt'] = 0
+    assert _filter([mol], ['mol.molwt > 1', 'mol.molwt < 1'],
+                   soft_fail=0, properties=properties) == []
+    # values are not kept between passes
+    mol = mols[1].clone
+    assert _filter([mol], 'mol.coords[0][0] < 100') == [mol]
+    mol.coords = mol.coords + 1000
+    assert _filter([mol], 'mol.coords[0][0] < 100') == []
+    assert _filter([mol], 'mol.title != "x"') == [mol]
+    mol.title = 'x'
+    assert _filter([mol], 'mol.title == "x"') == [mol]
+    # stages other than filters drop memoized values
+    n_atoms = len(mol.atoms)
+    result, _ = _instrumented_compose_iter([mol], [
+        partial(_filter, expression='len(mol.atoms) == %i' % n_atoms),
+        partial(map, lambda mol: mol.addh() or mol),
+        partial(_filter, expression='len(mol.atoms) > %i' % n_atoms)])
+    assert result == [mol]
+
+    # expressions get the molecule itself
+    assert _filter([mol], 'is_molecule(mol)') == [mol]
+
+    with pytest.raises(SyntaxError):
+        virtualscreening().apply_filter('mol.molwt >')
+
+
+def test_vs_similarity_fusion():
+    """Similarity to multiple queries is fused"""
+    mols = list(oddt.toolkit.readfile('sdf', xiap_actives_docked))
+    query = [next(oddt.toolkit.readfile('sdf', xiap_crystal_ligand)),
+             mols[10], mols[50]]
+    for method, gen in (('usr', usr), ('usr_cat', usr_cat),
+                        ('electroshape', electroshape)):
+        query_fps = [gen(q) for q in query]
+        sims = np.array([[usr_similarity(gen(mol), q_fp)
+                          for q_fp in query_fps] for mol in mols])
+        for fusion, scores in (('max', sims.max(axis=1)),
+                               ('mean', sims.mean(axis=1))):
+            vs = virtualscreening(n_cpu=1, chunksize=10)
+            vs.load_ligands('sdf', xiap_actives_docked)
+            vs.similarity(method, query, cutoff=0.4, fusion=fusion,
+                          data_field='sim')
+            out = list(vs.fetch())
+            assert len(out) == (scores >= 0.4).sum()
+            assert_array_almost_equal([float(mol.data['sim']) for mol in out],
+                                      scores[scores >= 0.4])
+            assert_array_equal([int(mol.data['sim_query']) for mol in out],
+                               sims.argmax(axis=1)[scores >= 0.4])
+
+    with pytest.raises(ValueError, match='Fusion'):
+        vs.similarity('usr', query, fusion='min')
+
+
 if oddt.toolkit.backend == 'ob':  # RDKit rewrite needed
     def test_vs_filtering():
         """VS preset filtering tests"""